@@ -2,3 +2,4 @@ from dqc.api.loadbasis import *
 from dqc.api.getxc import *
 from dqc.api.properties import *
 from dqc.api.parser import *
+from dqc.api.auxbasis import *
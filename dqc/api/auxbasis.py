@@ -0,0 +1,158 @@
+import math
+import torch
+from typing import List, Optional, Dict
+from dqc.utils.datastruct import CGTOBasis
+from dqc.api.loadbasis import _normalize_basisname
+
+__all__ = ["get_auxbasis_name", "autoaux"]
+
+# the official fitting basis matched to the orbital basis. The fitted density
+# is used for the coulomb matrix, so the JKFIT basis is used if it is
+# available. The augmented JKFIT basis is not available in the Basis Set
+# Exchange, so the augmented basis uses the JKFIT basis of the unaugmented
+# one, and the RIFIT basis is only used if there is no JKFIT basis.
+_AUXBASIS_TABLE: Dict[str, str] = {
+    # correlation consistent basis
+    "cc-pvdz": "def2-universal-jkfit",
+    "cc-pvtz": "cc-pvtz-jkfit",
+    "cc-pvqz": "cc-pvqz-jkfit",
+    "cc-pv5z": "cc-pv5z-jkfit",
+    "aug-cc-pvdz": "def2-universal-jkfit",
+    "aug-cc-pvtz": "cc-pvtz-jkfit",
+    "aug-cc-pvqz": "cc-pvqz-jkfit",
+    "aug-cc-pv5z": "cc-pv5z-jkfit",
+    # karlsruhe basis
+    "def2-sv(p)": "def2-sv(p)-jkfit",
+    "def2-svp": "def2-universal-jkfit",
+    "def2-svpd": "def2-universal-jkfit",
+    "def2-tzvp": "def2-universal-jkfit",
+    "def2-tzvpp": "def2-universal-jkfit",
+    "def2-tzvpd": "def2-universal-jkfit",
+    "def2-tzvppd": "def2-universal-jkfit",
+    "def2-qzvp": "def2-universal-jkfit",
+    "def2-qzvpp": "def2-universal-jkfit",
+    "def2-qzvppd": "def2-universal-jkfit",
+    # pople basis
+    "6-31g**": "6-31g**-rifit",
+    "6-311g**": "6-311g**-rifit",
+}
+
+def get_auxbasis_name(basis: str) -> Optional[str]:
+    """
+    Returns the name of the official auxiliary basis for density fitting that
+    matches the given orbital basis.
+
+    Arguments
+    ---------
+    basis: str
+        The name of the orbital basis, e.g. ``"cc-pvdz"``.
+
+    Returns
+    -------
+    str or None
+        The name of the matching auxiliary basis or ``None`` if the orbital
+        basis has no official fitting basis. In the latter case, the auxiliary
+        basis can be generated with :func:`autoaux`.
+    """
+    key = _normalize_basisname(basis.strip())
+    table = {_normalize_basisname(k): v for (k, v) in _AUXBASIS_TABLE.items()}
+    return table.get(key, None)
+
+def autoaux(atomz: int, bases: List[CGTOBasis], beta: float = 2.0) -> List[CGTOBasis]:
+    """
+    Generate the auxiliary basis for density fitting from the orbital basis of
+    an atom following the AutoAux procedure, i.e. even-tempered uncontracted
+    Gaussians spanning the exponents of the orbital products.
+
+    Ref: Stoychev, et al. J. Chem. Theory Comput. 13 (2017) 554-562.
+
+    Arguments
+    ---------
+    atomz: int
+        The atomic number of the atom.
+    bases: list of CGTOBasis
+        The orbital basis of the atom.
+    beta: float
+        The ratio between two consecutive exponents in the even-tempered series.
+
+    Returns
+    -------
+    list of CGTOBasis
+        The generated auxiliary basis of the atom.
+    """
+    assert beta > 1.0, "beta must be larger than 1"
+    assert len(bases) > 0, "the orbital basis must not be empty"
+
+    # get the range of the exponents for every angular momentum in the orbital
+    # basis, the primitive exponents are used to describe the total density (the
+    # s-type products) while the effective exponents of the contracted functions
+    # are used for the higher angular momentum to avoid spanning the core region
+    amin: Dict[int, float] = {}
+    amax: Dict[int, float] = {}
+    emin: Dict[int, float] = {}
+    emax: Dict[int, float] = {}
+    for basis in bases:
+        alphas = basis.alphas.detach()
+        angmom = basis.angmom
+        aeff = _get_effective_exponent(basis)
+        amin[angmom] = min(amin.get(angmom, math.inf), float(alphas.min()))
+        amax[angmom] = max(amax.get(angmom, 0.0), float(alphas.max()))
+        emin[angmom] = min(emin.get(angmom, math.inf), aeff)
+        emax[angmom] = max(emax.get(angmom, 0.0), aeff)
+
+    # maximum angular momentum of the auxiliary basis, limited by the angular
+    # momentum of the occupied shells and the orbital products
+    lmax_orb = max(amax.keys())
+    lmax_aux = min(max(2 * _get_lmax_occ(atomz), lmax_orb + 1), 2 * lmax_orb)
+
+    # exponents range of the orbital products for every angular momentum
+    dtype = bases[0].alphas.dtype
+    device = bases[0].alphas.device
+    res: List[CGTOBasis] = []
+    for lprod in range(lmax_aux + 1):
+        pmin = math.inf
+        pmax = 0.0
+        bmin, bmax = (amin, amax) if lprod == 0 else (emin, emax)
+        for l1 in amin.keys():
+            for l2 in amin.keys():
+                if abs(l1 - l2) <= lprod <= l1 + l2:
+                    pmin = min(pmin, bmin[l1] + bmin[l2])
+                    pmax = max(pmax, bmax[l1] + bmax[l2])
+        if pmax == 0.0:
+            continue
+
+        # even-tempered series from the most diffuse to the tightest exponents
+        nalphas = int(math.ceil(math.log(pmax / pmin) / math.log(beta))) + 1
+        for i in range(nalphas):
+            alpha = torch.tensor([pmin * beta ** i], dtype=dtype, device=device)
+            coeff = torch.ones(1, dtype=dtype, device=device)
+            basis = CGTOBasis(angmom=lprod, alphas=alpha, coeffs=coeff)
+            basis.wfnormalize_()
+            res.append(basis)
+    return res
+
+def _get_effective_exponent(basis: CGTOBasis) -> float:
+    # returns the exponent of the contracted function, i.e. the average of the
+    # primitive exponents weighted by their contributions to the norm
+    alphas = basis.alphas.detach()
+    coeffs = basis.coeffs.detach()
+    if alphas.numel() == 1:
+        return float(alphas[0])
+    # overlap of the primitives (up to a constant factor)
+    asum = alphas.unsqueeze(-1) + alphas.unsqueeze(-2)  # (ngauss, ngauss)
+    ovlp = asum ** (-(basis.angmom + 1.5))
+    # normalized basis already has the primitive normalization in its coefficients
+    cn = coeffs if basis.normalized else coeffs * alphas ** ((basis.angmom + 1.5) / 2)
+    w = torch.abs(cn.unsqueeze(-1) * cn.unsqueeze(-2) * ovlp)
+    return float(torch.sum(w * asum * 0.5) / torch.sum(w))
+
+def _get_lmax_occ(atomz: int) -> int:
+    # returns the maximum angular momentum of the occupied shells of the atom
+    if atomz <= 2:
+        return 0
+    elif atomz <= 20:
+        return 1
+    elif atomz <= 56:
+        return 2
+    else:
+        return 3
@@ -9,6 +9,9 @@ from dqc.xc.libxc import LibXCLDA, LibXCGGA, LibXCMGGA
 
 __all__ = ["get_xc"]
 
+# XC_FAMILY_HYB_GGA, XC_FAMILY_HYB_MGGA, and XC_FAMILY_HYB_LDA in libxc < 5
+_HYB_FAMILIES = {32: 2, 64: 4, 128: 1}
+
 def get_libxc(name: str) -> BaseXC:
     """
     Get the XC object of the libxc based on its libxc's name.
@@ -26,6 +29,10 @@ def get_libxc(name: str) -> BaseXC:
     obj = pylibxc.LibXCFunctional(name, "unpolarized")
     family = obj.get_family()
     del obj
+    # hybrids have their own families in libxc < 5, the exact exchange part is
+    # handled by the Hamiltonian, so they are treated as their semilocal family
+    if family in _HYB_FAMILIES:
+        family = _HYB_FAMILIES[family]
     if family == 1:  # LDA
         return LibXCLDA(name)
     elif family == 2:  # GGA
@@ -1,6 +1,6 @@
 import torch
 import xitorch as xt
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import dqc.hamilton.intor as intor
 from dqc.df.base_df import BaseDF
 from dqc.hamilton.orbconverter import OrbitalOrthogonalizer
@@ -42,8 +42,16 @@ class DFMol(BaseDF):
             # TODO: implement overlap3c
             raise NotImplementedError(
                 "Density fitting with overlap minimization is not implemented")
+        # j3c is symmetric in the first two indices, so only store the lower
+        # triangular pairs to halve the memory and the contraction work
+        nao = j3c.shape[0]
+        self._nao = nao
+        self._tril_idxs, self._tril2full, self._tril_weights = \
+            _get_tril_mapping(nao, dtype=j3c.dtype, device=j3c.device)
+        j3c = j3c[self._tril_idxs[0], self._tril_idxs[1]]  # (nao * (nao + 1) / 2, nxao)
+
         self._j2c = j2c  # (nxao, nxao)
-        self._j3c = j3c  # (nao, nao, nxao)
+        self._j3c = j3c  # (npair, nxao)
         logger.log("Precompute matrix for density fittings")
         self._inv_j2c = torch.inverse(j2c)
 
@@ -52,7 +60,7 @@ class DFMol(BaseDF):
             self._precompute_elmat = False
         else:
             self._precompute_elmat = True
-            self._el_mat = torch.matmul(j3c, self._inv_j2c)  # (nao, nao, nxao)
+            self._el_mat = torch.matmul(j3c, self._inv_j2c)  # (npair, nxao)
 
         logger.log("Density fitting done")
         return self
@@ -66,14 +74,20 @@ class DFMol(BaseDF):
         if self._orthozer is not None:
             dm = self._orthozer.unconvert_dm(dm)
 
+        # pack the density matrix into the lower triangular pairs where the
+        # off-diagonal elements contain the contribution from both (i, j) and (j, i)
+        dm_tril = (dm + dm.transpose(-2, -1))[..., self._tril_idxs[0], self._tril_idxs[1]] * \
+            self._tril_weights  # (*BD, npair)
+
         if self._precompute_elmat:
-            df_coeffs = torch.einsum("...ij,ijk->...k", dm, self._el_mat)  # (*BD, nxao)
+            df_coeffs = torch.matmul(dm_tril, self._el_mat)  # (*BD, nxao)
         else:
-            temp = torch.einsum("...ij,ijl->...l", dm, self._j3c)
-            df_coeffs = torch.einsum("...l,lk->...k", temp, self._inv_j2c)  # (*BD, nxao)
+            temp = torch.matmul(dm_tril, self._j3c)
+            df_coeffs = torch.matmul(temp, self._inv_j2c)  # (*BD, nxao)
 
-        mat = torch.einsum("...k,ijk->...ij", df_coeffs, self._j3c)  # (*BD, nao, nao)
-        mat = (mat + mat.transpose(-2, -1)) * 0.5
+        mat_tril = torch.matmul(df_coeffs, self._j3c.transpose(-2, -1))  # (*BD, npair)
+        # unpacking makes the matrix symmetric by construction
+        mat = _unpack_tril(mat_tril, self._tril2full, self._nao)  # (*BD, nao, nao)
         if self._orthozer is not None:
             mat = self._orthozer.convert2(mat)
         return xt.LinearOperator.m(mat, is_hermitian=True)
@@ -84,7 +98,9 @@ class DFMol(BaseDF):
 
     @property
     def j3c(self) -> torch.Tensor:
-        return self._j3c
+        # the integrals are stored in the packed form, so unpack it here
+        j3c = _unpack_tril(self._j3c.transpose(-2, -1), self._tril2full, self._nao)
+        return torch.movedim(j3c, 0, -1)  # (nao, nao, nxao)
 
     def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
         if methodname == "get_elrep":
@@ -99,3 +115,23 @@ class DFMol(BaseDF):
             return params
         else:
             raise KeyError("getparamnames has no %s method" % methodname)
+
+def _get_tril_mapping(nao: int, dtype: torch.dtype, device: torch.device) \
+        -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # returns the indices of the lower triangular pairs (2, npair), the mapping
+    # from the full (nao * nao) flattened index to the packed index, and the
+    # weights of the packed elements to be used with (dm + dm^T)
+    tril_idxs = torch.tril_indices(nao, nao, device=device)  # (2, npair)
+    row = torch.arange(nao, device=device)
+    irow = torch.maximum(row.unsqueeze(-1), row)  # (nao, nao)
+    icol = torch.minimum(row.unsqueeze(-1), row)
+    tril2full = (irow * (irow + 1) // 2 + icol).reshape(-1)  # (nao * nao)
+    weights = torch.ones(tril_idxs.shape[-1], dtype=dtype, device=device)
+    weights[tril_idxs[0] == tril_idxs[1]] = 0.5
+    return tril_idxs, tril2full, weights
+
+def _unpack_tril(mat_tril: torch.Tensor, tril2full: torch.Tensor, nao: int) -> torch.Tensor:
+    # unpack the lower triangular packed matrix into a full symmetric matrix
+    # mat_tril: (..., npair)
+    # returns: (..., nao, nao)
+    return mat_tril[..., tril2full].reshape(*mat_tril.shape[:-1], nao, nao)
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from typing import Union, List, Optional, Mapping, Callable, Dict
+from typing import Union, List, Optional, Mapping, Callable, Dict, Tuple, Any
 import torch
 from dqc.grid.base_grid import BaseGrid
 from dqc.grid.radial_grid import RadialGrid, LogM3Transformation, \
@@ -11,7 +11,7 @@ from dqc.hamilton.intor.lattice import Lattice
 from dqc.utils.periodictable import atom_bragg_radii, atom_expected_radii, get_period
 from dqc.utils.misc import get_option
 
-__all__ = ["get_grid", "get_predefined_grid"]
+__all__ = ["get_grid", "get_predefined_grid", "get_predefined_grid_size"]
 
 # list of alphas for de2 transformation from https://onlinelibrary.wiley.com/doi/epdf/10.1002/jcc.24761
 __sg2_dasgupta_alphas = defaultdict(lambda: 1.0, {
@@ -152,14 +152,49 @@ def get_grid(atomzs: Union[List[int], torch.Tensor], atompos: torch.Tensor,
     else:
         atomzs_list = list(atomzs)
 
+    sphgrids, atom_radii_list = _get_atom_grids(
+        atomzs_list, nr=nr, nang=nang, radgrid_generator=radgrid_generator,
+        radgrid_transform=radgrid_transform, atom_radii=atom_radii, truncate=truncate,
+        dtype=dtype, device=device)
+    atomradii = torch.tensor([atom_radii_list[atomz] for atomz in atomzs_list],
+                             dtype=dtype, device=device)
+
+    # get the multi atoms grid
+    # the values are a function to avoid constructing it unnecessarily
+    if lattice is None:
+        multiatoms_options: Mapping[str, Callable[[], BaseGrid]] = {
+            "becke": lambda: BeckeGrid(sphgrids, atompos, atomradii=atomradii),
+            "treutler": lambda: BeckeGrid(sphgrids, atompos, atomradii=atomradii,
+                                          ratom_adjust="treutler"),
+        }
+    else:
+        assert isinstance(lattice, Lattice)
+        multiatoms_options = {
+            "becke": lambda: PBCBeckeGrid(sphgrids, atompos, lattice=lattice),  # type: ignore
+            "treutler": lambda: PBCBeckeGrid(sphgrids, atompos, lattice=lattice,  # type: ignore
+                                             ratom_adjust="treutler"),
+        }
+    grid = get_option("multiatoms scheme", multiatoms_scheme, multiatoms_options)()
+    return grid
+
+def _get_atom_grids(atomzs_list: List[int],
+                    nr: Union[int, Callable[[int], int]],
+                    nang: Union[int, Callable[[int], int]],
+                    radgrid_generator: str,
+                    radgrid_transform: str,
+                    atom_radii: str,
+                    truncate: Optional[str],
+                    dtype: torch.dtype,
+                    device: torch.device) -> Tuple[List[BaseGrid], List[float]]:
+    # construct the spherical grids centered on each atom (the same grid object
+    # for the same atomz), returns the list of the grids and the atom radii list
+
     # get the atom radii list
     atom_radii_options: Mapping[str, Union[List[float]]] = {
         "expected": atom_expected_radii,
         "bragg": atom_bragg_radii,
     }
     atom_radii_list = get_option("atom radii", atom_radii, atom_radii_options)
-    atomradii = torch.tensor([atom_radii_list[atomz] for atomz in atomzs_list],
-                             dtype=dtype, device=device)
 
     # construct the radial grid transformation as a function of atom z
     radgrid_tf_options = {
@@ -221,24 +256,7 @@ def get_grid(atomzs: Union[List[int], torch.Tensor], atompos: torch.Tensor,
             sphgrid = LebedevGrid(radgrid, prec=_get_nr(prec, atz))
         sphgrids_dict[atz] = sphgrid
         sphgrids.append(sphgrid)
-
-    # get the multi atoms grid
-    # the values are a function to avoid constructing it unnecessarily
-    if lattice is None:
-        multiatoms_options: Mapping[str, Callable[[], BaseGrid]] = {
-            "becke": lambda: BeckeGrid(sphgrids, atompos, atomradii=atomradii),
-            "treutler": lambda: BeckeGrid(sphgrids, atompos, atomradii=atomradii,
-                                          ratom_adjust="treutler"),
-        }
-    else:
-        assert isinstance(lattice, Lattice)
-        multiatoms_options = {
-            "becke": lambda: PBCBeckeGrid(sphgrids, atompos, lattice=lattice),  # type: ignore
-            "treutler": lambda: PBCBeckeGrid(sphgrids, atompos, lattice=lattice,  # type: ignore
-                                             ratom_adjust="treutler"),
-        }
-    grid = get_option("multiatoms scheme", multiatoms_scheme, multiatoms_options)()
-    return grid
+    return sphgrids, atom_radii_list
 
 def get_predefined_grid(grid_inp: Union[int, str], atomzs: Union[List[int], torch.Tensor],
                         atompos: torch.Tensor,
@@ -248,27 +266,43 @@ def get_predefined_grid(grid_inp: Union[int, str], atomzs: Union[List[int], torc
     """
     Returns the predefined grid object given the grid name.
     """
+    return get_grid(atomzs, atompos, lattice=lattice, dtype=dtype, device=device,
+                    **_get_predefined_grid_options(grid_inp))
+
+def get_predefined_grid_size(grid_inp: Union[int, str], atomzs: Union[List[int], torch.Tensor]) -> int:
+    """
+    Returns the number of points of the predefined grid without constructing
+    the multi-atoms grid (i.e. without calculating the integration weights).
+    For periodic systems, it is an upper bound of the number of points.
+    """
+    if isinstance(atomzs, torch.Tensor):
+        atomzs_list = [int(a.item()) for a in atomzs]
+    else:
+        atomzs_list = list(atomzs)
+    opts = _get_predefined_grid_options(grid_inp)
+    del opts["multiatoms_scheme"]
+    sphgrids, _ = _get_atom_grids(atomzs_list, dtype=_dtype, device=_device, **opts)
+    return sum([sphgrid.get_rgrid().shape[-2] for sphgrid in sphgrids])
+
+def _get_predefined_grid_options(grid_inp: Union[int, str]) -> Dict[str, Any]:
+    # returns the arguments of get_grid for the predefined grid
     if isinstance(grid_inp, str):
         if grid_inp == "sg2":
-            return get_grid(atomzs, atompos, lattice=lattice,
-                            nr=75, nang=302,
-                            radgrid_generator="uniform",
-                            radgrid_transform="sg2-dasgupta",
-                            # using expected from de2 ref: DOI 10.1007/s00214-012-1169-z
-                            atom_radii="expected",
-                            multiatoms_scheme="becke",
-                            truncate="dasgupta",
-                            dtype=dtype, device=device)
+            return dict(nr=75, nang=302,
+                        radgrid_generator="uniform",
+                        radgrid_transform="sg2-dasgupta",
+                        # using expected from de2 ref: DOI 10.1007/s00214-012-1169-z
+                        atom_radii="expected",
+                        multiatoms_scheme="becke",
+                        truncate="dasgupta")
         elif grid_inp == "sg3":
-            return get_grid(atomzs, atompos, lattice=lattice,
-                            nr=99, nang=590,
-                            radgrid_generator="uniform",
-                            radgrid_transform="sg3-dasgupta",
-                            # using expected from de2 ref: DOI 10.1007/s00214-012-1169-z
-                            atom_radii="expected",
-                            multiatoms_scheme="becke",
-                            truncate="dasgupta",
-                            dtype=dtype, device=device)
+            return dict(nr=99, nang=590,
+                        radgrid_generator="uniform",
+                        radgrid_transform="sg3-dasgupta",
+                        # using expected from de2 ref: DOI 10.1007/s00214-012-1169-z
+                        atom_radii="expected",
+                        multiatoms_scheme="becke",
+                        truncate="dasgupta")
         else:
             raise ValueError(f"Unknown grid name: {grid_inp}")
     elif isinstance(grid_inp, int):
@@ -309,13 +343,11 @@ def get_predefined_grid(grid_inp: Union[int, str], atomzs: Union[List[int], torc
             period = get_period(atz)
             return nang_list2[period - 1]
 
-        return get_grid(atomzs, atompos, lattice=lattice,
-                        nr=get_nr, nang=get_nang,
-                        radgrid_generator="chebyshev2",
-                        radgrid_transform="treutlerm4",
-                        atom_radii="bragg",
-                        multiatoms_scheme="treutler",
-                        truncate="nwchem",
-                        dtype=dtype, device=device)
+        return dict(nr=get_nr, nang=get_nang,
+                    radgrid_generator="chebyshev2",
+                    radgrid_transform="treutlerm4",
+                    atom_radii="bragg",
+                    multiatoms_scheme="treutler",
+                    truncate="nwchem")
     else:
         raise TypeError("Unknown type of grid_inp: %s" % type(grid_inp))
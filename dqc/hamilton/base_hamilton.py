@@ -30,6 +30,15 @@ class BaseHamilton(xt.EditableModule):
         """
         pass
 
+    @property
+    def wkpts(self) -> Optional[torch.Tensor]:
+        """
+        Returns the weights of the k-points in the Hamiltonian, or None if
+        the Hamiltonian does not have k-points.
+        Shape: (nkpts,)
+        """
+        return None
+
     @abstractproperty
     def df(self) -> Optional[BaseDF]:
         """
@@ -94,23 +103,47 @@ class BaseHamilton(xt.EditableModule):
         pass
 
     @overload
-    def get_exchange(self, dm: torch.Tensor) -> xt.LinearOperator:
+    def get_exchange(self, dm: torch.Tensor, omega: float = 0.0) -> xt.LinearOperator:
         ...
 
     @overload
-    def get_exchange(self, dm: SpinParam[torch.Tensor]) -> SpinParam[xt.LinearOperator]:
+    def get_exchange(self, dm: SpinParam[torch.Tensor], omega: float = 0.0) -> SpinParam[xt.LinearOperator]:
         ...
 
     @abstractmethod
-    def get_exchange(self, dm):
+    def get_exchange(self, dm, omega=0.0):
         """
         Obtains the LinearOperator of the exchange operator.
         It is -0.5 * K where K is the K matrix obtained from 2-electron integral.
+        If ``omega`` is non-zero, the K matrix is obtained from the 2-electron
+        integral with the long-range Coulomb operator, erf(omega * r12) / r12,
+        as used in the range-separated hybrid functionals.
         """
         # dm: (*BD, nao, nao)
         # return: (*BDH, nao, nao)
         pass
 
+    @overload
+    def get_elrep_exchange(self, dm: torch.Tensor) -> Tuple[xt.LinearOperator, xt.LinearOperator]:
+        ...
+
+    @overload
+    def get_elrep_exchange(self, dm: SpinParam[torch.Tensor]) -> \
+            Tuple[xt.LinearOperator, SpinParam[xt.LinearOperator]]:
+        ...
+
+    def get_elrep_exchange(self, dm):
+        """
+        Obtains the LinearOperators of the electron repulsion operator of the
+        total density matrix and the exchange operator, i.e. the results of
+        ``get_elrep`` and ``get_exchange``.
+        The Hamiltonian can override this to obtain both operators from a
+        single pass over the 2-electron integrals.
+        """
+        # dm: (*BD, nao, nao)
+        # return: (*BDH, nao, nao), (*BDH, nao, nao)
+        return self.get_elrep(SpinParam.sum(dm)), self.get_exchange(dm)
+
     @abstractmethod
     def get_vext(self, vext: torch.Tensor) -> xt.LinearOperator:
         r"""
@@ -197,6 +230,25 @@ class BaseHamilton(xt.EditableModule):
         # return: (*BDH)
         pass
 
+    @overload
+    def get_e_xc_vxc(self, dm: SpinParam[torch.Tensor]) -> Tuple[torch.Tensor, SpinParam[xt.LinearOperator]]:
+        ...
+
+    @overload
+    def get_e_xc_vxc(self, dm: torch.Tensor) -> Tuple[torch.Tensor, xt.LinearOperator]:
+        ...
+
+    def get_e_xc_vxc(self, dm):
+        """
+        Returns the exchange-correlation energy and the LinearOperator for the
+        exchange-correlation potential, i.e. the results of ``.get_e_xc()``
+        and ``.get_vxc()``, from a single evaluation of the density and the xc
+        if the Hamiltonian supports it.
+        """
+        # dm: (*BD, nao, nao)
+        # return: (*BDH), (*BDH, nao, nao)
+        return self.get_e_xc(dm), self.get_vxc(dm)
+
     ############### free parameters for variational method ###############
     @overload
     def ao_orb_params2dm(self, ao_orb_params: torch.Tensor, ao_orb_coeffs: torch.Tensor,
@@ -1,6 +1,7 @@
-from typing import List, Optional, Union, overload, Tuple, Type
+from typing import List, Optional, Union, overload, Tuple, Type, Iterable, Callable, Any
 import warnings
 import torch
+from torch.utils.checkpoint import checkpoint
 import xitorch as xt
 import dqc.hamilton.intor as intor
 from dqc.df.base_df import BaseDF
@@ -15,6 +16,8 @@ from dqc.utils.cache import Cache
 from dqc.utils.mem import chunkify, get_dtype_memsize
 from dqc.utils.config import config
 from dqc.utils.misc import logger
+from dqc.utils.profiler import stage_timer
+from dqc.utils.autotune import autotune
 
 class HamiltonCGTO(BaseHamilton):
     """
@@ -31,13 +34,18 @@ class HamiltonCGTO(BaseHamilton):
                  vext: Optional[torch.Tensor] = None,
                  cache: Optional[Cache] = None,
                  orthozer: bool = True,
-                 aoparamzer: str = "qr") -> None:
+                 aoparamzer: str = "qr",
+                 grid_dtype: Optional[torch.dtype] = None) -> None:
         self.atombases = atombases
         self.spherical = spherical
         self.libcint_wrapper = intor.LibcintWrapper(atombases, spherical)
         self.dtype = self.libcint_wrapper.dtype
         self.device = self.libcint_wrapper.device
 
+        # data type of the basis values on the grid and the matrix
+        # multiplications with them, the results are accumulated in self.dtype
+        self.grid_dtype = grid_dtype if grid_dtype is not None else self.dtype
+
         # set up the orbital converter
         ovlp = intor.overlap(self.libcint_wrapper)
         if orthozer:
@@ -70,8 +78,19 @@ class HamiltonCGTO(BaseHamilton):
         self.is_grad_ao_set = False
         self.is_lapl_ao_set = False
         self.xc: Optional[BaseXC] = None
+        # fraction of the grid points skipped by the density screening in the
+        # last exchange-correlation calculation
+        self.xc_screened_frac = 0.0
+        # the streamed xc evaluation is only implemented for the molecular basis
+        self._xc_streamable = True
+        # the chunk memory of the contractions with the basis on the grid, it
+        # is config.CHUNK_MEMORY if None
+        self._chunk_memory: Optional[int] = None
         self.xcfamily = 1
         self.is_built = False
+        # omega of the range-separated electron repulsion matrix, it is only
+        # calculated when the exchange with the long-range coulomb is requested
+        self._el_mat_omega: Optional[float] = None
 
         # initialize cache
         self._cache = cache if cache is not None else Cache.get_dummy()
@@ -92,6 +111,7 @@ class HamiltonCGTO(BaseHamilton):
         return self._df
 
     ############# setups #############
+    @stage_timer("build")
     def build(self) -> BaseHamilton:
         # get the matrices (all (nao, nao), except el_mat)
         # these matrices have already been normalized
@@ -149,6 +169,7 @@ class HamiltonCGTO(BaseHamilton):
 
         return self
 
+    @stage_timer("setup_grid")
     def setup_grid(self, grid: BaseGrid, xc: Optional[BaseXC] = None) -> None:
         # save the family and save the xc
         self.xc = xc
@@ -159,15 +180,17 @@ class HamiltonCGTO(BaseHamilton):
 
         # save the grid
         self.grid = grid
+        self._chunk_memory = None
         self.rgrid = grid.get_rgrid()
         assert grid.coord_type == "cart"
 
         # setup the basis as a spatial function
         logger.log("Calculating the basis values in the grid")
         self.is_ao_set = True
-        self.basis = intor.eval_gto(self.libcint_wrapper, self.rgrid, to_transpose=True)  # (ngrid, nao)
+        basis = intor.eval_gto(self.libcint_wrapper, self.rgrid, to_transpose=True)  # (ngrid, nao)
         self.dvolume = self.grid.get_dvolume()
-        self.basis_dvolume = self.basis * self.dvolume.unsqueeze(-1)  # (ngrid, nao)
+        self.basis = basis.to(self.grid_dtype)
+        self.basis_dvolume = (basis * self.dvolume.unsqueeze(-1)).to(self.grid_dtype)  # (ngrid, nao)
 
         if self.xcfamily == 1:  # LDA
             return
@@ -175,15 +198,22 @@ class HamiltonCGTO(BaseHamilton):
         # setup the gradient of the basis
         logger.log("Calculating the basis gradient values in the grid")
         self.is_grad_ao_set = True
-        # (ndim, nao, ngrid)
-        self.grad_basis = intor.eval_gradgto(self.libcint_wrapper, self.rgrid, to_transpose=True)
+        # (ndim, ngrid, nao)
+        grad_basis = intor.eval_gradgto(self.libcint_wrapper, self.rgrid, to_transpose=True)
+        # the basis and its gradient are stacked so the density with its
+        # gradient and the vxc matrix are obtained in a single pass over the
+        # stack, self.basis and self.grad_basis are the views of the stack
+        self.basis_stack = torch.cat((basis.unsqueeze(0), grad_basis), dim=0).to(self.grid_dtype)  # (4, ngrid, nao)
+        self.basis = self.basis_stack[0]
+        self.grad_basis = self.basis_stack[1:]
         if self.xcfamily == 2:  # GGA
             return
 
         # setup the laplacian of the basis
         self.is_lapl_ao_set = True
         logger.log("Calculating the basis laplacian values in the grid")
-        self.lapl_basis = intor.eval_laplgto(self.libcint_wrapper, self.rgrid, to_transpose=True)  # (nao, ngrid)
+        self.lapl_basis = intor.eval_laplgto(self.libcint_wrapper, self.rgrid,
+                                             to_transpose=True).to(self.grid_dtype)  # (nao, ngrid)
 
     ############ fock matrix components ############
     def get_nuclattr(self) -> xt.LinearOperator:
@@ -214,14 +244,14 @@ class HamiltonCGTO(BaseHamilton):
             return elrep
 
     @overload
-    def get_exchange(self, dm: torch.Tensor) -> xt.LinearOperator:
+    def get_exchange(self, dm: torch.Tensor, omega: float = 0.0) -> xt.LinearOperator:
         ...
 
     @overload
-    def get_exchange(self, dm: SpinParam[torch.Tensor]) -> SpinParam[xt.LinearOperator]:
+    def get_exchange(self, dm: SpinParam[torch.Tensor], omega: float = 0.0) -> SpinParam[xt.LinearOperator]:
         ...
 
-    def get_exchange(self, dm):
+    def get_exchange(self, dm, omega=0.0):
         # get the exchange operator
         # dm: (*BD, nao, nao)
         # el_mat: (nao, nao, nao, nao)
@@ -229,22 +259,53 @@ class HamiltonCGTO(BaseHamilton):
         if self._df is not None:
             raise RuntimeError("Exact exchange cannot be computed with density fitting")
         elif isinstance(dm, torch.Tensor):
+            el_mat = self._get_el_mat(omega)
             # the einsum form below is to hack PyTorch's bug #57121
-            # mat = -0.5 * torch.einsum("...jk,ijkl->...il", dm, self.el_mat)  # slower
-            mat = -0.5 * torch.einsum("...il,ijkl->...ijk", dm, self.el_mat).sum(dim=-3)  # faster
+            # mat = -0.5 * torch.einsum("...jk,ijkl->...il", dm, el_mat)  # slower
+            mat = -0.5 * torch.einsum("...il,ijkl->...ijk", dm, el_mat).sum(dim=-3)  # faster
 
             mat = (mat + mat.transpose(-2, -1)) * 0.5  # reduce numerical instability
             return xt.LinearOperator.m(mat, is_hermitian=True)
         else:  # dm is SpinParam
             # using the spin-scaling property of exchange energy
-            return SpinParam(u=self.get_exchange(2 * dm.u),
-                             d=self.get_exchange(2 * dm.d))
+            return SpinParam(u=self.get_exchange(2 * dm.u, omega),
+                             d=self.get_exchange(2 * dm.d, omega))
+
+    @overload
+    def get_elrep_exchange(self, dm: torch.Tensor) -> Tuple[xt.LinearOperator, xt.LinearOperator]:
+        ...
+
+    @overload
+    def get_elrep_exchange(self, dm: SpinParam[torch.Tensor]) -> \
+            Tuple[xt.LinearOperator, SpinParam[xt.LinearOperator]]:
+        ...
+
+    def get_elrep_exchange(self, dm):
+        # get the electron repulsion and the exchange operators from a single
+        # sweep over the electron repulsion matrix
+        # dm: (*BD, nao, nao)
+        # return: (*BD, nao, nao), (*BD, nao, nao)
+        if self._df is not None:
+            return super().get_elrep_exchange(dm)
+
+        if isinstance(dm, torch.Tensor):
+            jmat, kmat = _contract_jk(self.el_mat, dm, dm)
+            exch = xt.LinearOperator.m(-0.5 * kmat, is_hermitian=True)
+        else:
+            # the spin components are contracted together and the exchange
+            # uses the spin-scaling property, i.e. -0.5 * K(2 * dm_s)
+            jmat, kmat = _contract_jk(self.el_mat, dm.u + dm.d, torch.stack((dm.u, dm.d), dim=0))
+            exch = SpinParam(u=xt.LinearOperator.m(-kmat[0], is_hermitian=True),
+                             d=xt.LinearOperator.m(-kmat[1], is_hermitian=True))
+        elrep = xt.LinearOperator.m(jmat, is_hermitian=True)
+        return elrep, exch
 
     def get_vext(self, vext: torch.Tensor) -> xt.LinearOperator:
         # vext: (*BR, ngrid)
         if not self.is_ao_set:
             raise RuntimeError("Please call `setup_grid(grid, xc)` to call this function")
-        mat = torch.einsum("...r,rb,rc->...bc", vext, self.basis_dvolume, self.basis)  # (*BR, nao, nao)
+        mat = torch.einsum("...r,rb,rc->...bc", vext.to(self.grid_dtype), self.basis_dvolume,
+                           self.basis).to(self.dtype)  # (*BR, nao, nao)
         mat = self._orthozer.convert2(mat)
         mat = (mat + mat.transpose(-2, -1)) * 0.5  # ensure the symmetricity and reduce numerical instability
         return xt.LinearOperator.m(mat, is_hermitian=True)
@@ -261,11 +322,18 @@ class HamiltonCGTO(BaseHamilton):
         # dm: (*BD, nao, nao)
         assert self.xc is not None, "Please call .setup_grid with the xc object"
 
-        densinfo = SpinParam.apply_fcn(
-            lambda dm_: self._dm2densinfo(dm_), dm)  # value: (*BD, nr)
-        potinfo = self.xc.get_vxc(densinfo)  # value: (*BD, nr)
-        vxc_linop = SpinParam.apply_fcn(
-            lambda potinfo_: self._get_vxc_from_potinfo(potinfo_), potinfo)
+        if config.STREAM_XC and self._xc_streamable:
+            return self._get_vxc_streamed(dm)
+
+        with stage_timer("density"):
+            densinfo = SpinParam.apply_fcn(
+                lambda dm_: self._dm2densinfo(dm_), dm)  # value: (*BD, nr)
+            densinfo, idxs = self._screen_densinfo(densinfo)
+        with stage_timer("xc_kernel"):
+            potinfo = self._call_xc("get_vxc", densinfo)  # value: (*BD, nr)
+        with stage_timer("vxc_mat"):
+            vxc_linop = SpinParam.apply_fcn(
+                lambda potinfo_: self._get_vxc_from_potinfo(potinfo_, idxs), potinfo)
         return vxc_linop
 
     ############### interface to dm ###############
@@ -320,12 +388,51 @@ class HamiltonCGTO(BaseHamilton):
     def get_e_xc(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> torch.Tensor:
         assert self.xc is not None, "Please call .setup_grid with the xc object"
 
+        if config.STREAM_XC and self._xc_streamable:
+            return self._get_e_xc_streamed(dm)
+
         # obtain the energy density per unit volume
         densinfo = SpinParam.apply_fcn(
             lambda dm_: self._dm2densinfo(dm_), dm)  # (spin) value: (*BD, nr)
-        edens = self.xc.get_edensityxc(densinfo)  # (*BD, nr)
+        densinfo, idxs = self._screen_densinfo(densinfo)
+        edens = self._call_xc("get_edensityxc", densinfo)  # (*BD, nr)
+
+        dvolume = self.grid.get_dvolume()
+        if idxs is not None:
+            dvolume = dvolume[..., idxs]
+        return torch.sum(dvolume * edens, dim=-1)
+
+    @overload
+    def get_e_xc_vxc(self, dm: SpinParam[torch.Tensor]) -> Tuple[torch.Tensor, SpinParam[xt.LinearOperator]]:
+        ...
+
+    @overload
+    def get_e_xc_vxc(self, dm: torch.Tensor) -> Tuple[torch.Tensor, xt.LinearOperator]:
+        ...
+
+    def get_e_xc_vxc(self, dm):
+        # get the xc energy and the vxc linear operator from a single
+        # evaluation of the density and the xc on the grid
+        assert self.xc is not None, "Please call .setup_grid with the xc object"
 
-        return torch.sum(self.grid.get_dvolume() * edens, dim=-1)
+        if config.STREAM_XC and self._xc_streamable:
+            return self._get_e_xc_vxc_streamed(dm)
+
+        with stage_timer("density"):
+            densinfo = SpinParam.apply_fcn(
+                lambda dm_: self._dm2densinfo(dm_), dm)  # (spin) value: (*BD, nr)
+            densinfo, idxs = self._screen_densinfo(densinfo)
+        with stage_timer("xc_kernel"):
+            edens, potinfo = self._call_xc("get_edensityxc_vxc", densinfo)  # value: (*BD, nr)
+
+        dvolume = self.grid.get_dvolume()
+        if idxs is not None:
+            dvolume = dvolume[..., idxs]
+        e_xc = torch.sum(dvolume * edens, dim=-1)
+        with stage_timer("vxc_mat"):
+            vxc_linop = SpinParam.apply_fcn(
+                lambda potinfo_: self._get_vxc_from_potinfo(potinfo_, idxs), potinfo)
+        return e_xc, vxc_linop
 
     ############### free parameters for variational method ###############
     @overload
@@ -376,11 +483,11 @@ class HamiltonCGTO(BaseHamilton):
 
         ngrid = self.basis.shape[-2]
         batchshape = dm.shape[:-2]
-
-        # dm @ ao will be used in every case
-        dmdmt = (dm + dm.transpose(-2, -1)) * 0.5  # (*BD, nao2, nao2)
-        # convert it back to dm in the cgto basis
-        dmdmt = self._orthozer.unconvert_dm(dmdmt)
+        dmdmt = self._get_dmdmt(dm)
+        occ: Optional[torch.Tensor] = None
+        dmfac = self._get_dm_factor(dmdmt)
+        if dmfac is not None:
+            dmdmt, occ = dmfac
 
         # prepare the densinfo components
         dens = torch.empty((*batchshape, ngrid), dtype=self.dtype, device=self.device)
@@ -395,61 +502,219 @@ class HamiltonCGTO(BaseHamilton):
             kindens = torch.empty((*batchshape, ngrid), dtype=self.dtype, device=self.device)
 
         # It is faster to split into chunks than evaluating a single big chunk
-        maxnumel = config.CHUNK_MEMORY // get_dtype_memsize(self.basis)
-        for basis, ioff, iend in chunkify(self.basis, dim=0, maxnumel=maxnumel):
-            # basis: (ngrid2, nao)
+        maxnumel = self._get_chunk_memory() // get_dtype_memsize(self.basis)
+        for _, ioff, iend in chunkify(self.basis, dim=0, maxnumel=maxnumel):
+            densinfo = self._dm2densinfo_at(dmdmt, slice(ioff, iend), occ)
+            dens[..., ioff:iend] = densinfo.value
+            if gdens is not None:
+                assert densinfo.grad is not None
+                gdens[..., ioff:iend] = densinfo.grad
+            if lapldens is not None and kindens is not None:
+                assert densinfo.lapl is not None
+                assert densinfo.kin is not None
+                lapldens[..., ioff:iend] = densinfo.lapl
+                kindens[..., ioff:iend] = densinfo.kin
 
-            dmao = torch.matmul(basis, dmdmt)  # (ngrid2, nao)
-            dens[..., ioff:iend] = torch.einsum("...ri,ri->...r", dmao, basis)
+        # dens: (*BD, ngrid)
+        # gdens: (*BD, ndim, ngrid)
+        res = ValGrad(value=dens, grad=gdens, lapl=lapldens, kin=kindens)
+        return res
 
-            if self.xcfamily == 2 or self.xcfamily == 4:  # GGA or MGGA
-                assert gdens is not None
-                if not self.is_grad_ao_set:
-                    msg = "Please call `setup_grid(grid, gradlevel>=1)` to calculate the density gradient"
-                    raise RuntimeError(msg)
+    def _get_chunk_memory(self) -> int:
+        # returns the memory of the chunks of the basis on the grid, which is
+        # tuned on its first use if config.AUTOTUNE_CHUNK is set
+        if self._chunk_memory is not None:
+            return self._chunk_memory
+        if not config.AUTOTUNE_CHUNK:
+            return config.CHUNK_MEMORY
+
+        # time the density and the vxc matrix calculations on the grid with a
+        # random density matrix, the candidates larger than the whole basis
+        # on the grid are skipped as they are the same as one chunk
+        basis_mem = self.basis.numel() * get_dtype_memsize(self.basis)
+        candidates = [2 ** i * 1024 ** 2 for i in range(8)]
+        candidates = [c for c in candidates if c < 2 * basis_mem] or candidates[:1]
+        dm = torch.rand((self.nao, self.nao), dtype=self.dtype, device=self.device)
+        dm = dm + dm.transpose(-2, -1)
+
+        def bench(chunk_memory: int) -> None:
+            self._chunk_memory = chunk_memory
+            densinfo = self._dm2densinfo(dm)
+            # the density information has the same shape as the potential
+            self._get_vxc_from_potinfo(densinfo)
 
-                # summing it 3 times is faster than applying the d-axis directly
-                grad_basis0 = self.grad_basis[0, ioff:iend, :]  # (ngrid2, nao)
-                grad_basis1 = self.grad_basis[1, ioff:iend, :]
-                grad_basis2 = self.grad_basis[2, ioff:iend, :]
+        nao = self.basis.shape[-1]
+        key = "nao%d-%s-%s-xcfamily%d" % (nao, self.grid_dtype, self.device.type, self.xcfamily)
+        try:
+            with torch.no_grad():
+                chunk_memory = autotune("chunk_memory", key, candidates, bench)
+        finally:
+            self._chunk_memory = None
+        self._chunk_memory = chunk_memory
+        return chunk_memory
+
+    def _get_el_mat(self, omega: float) -> torch.Tensor:
+        # returns the electron repulsion matrix of the full coulomb operator if
+        # omega is 0, otherwise the matrix of the long-range coulomb operator,
+        # erf(omega * r12) / r12, which is calculated on its first use
+        if omega == 0.0:
+            return self.el_mat
+        if self._el_mat_omega != omega:
+            logger.log("Calculating the long-range electron repulsion matrix (omega = %.3e)" % omega)
+            el_mat_lr = intor.elrep(self.libcint_wrapper, omega=omega)  # (nao^4)
+            self.el_mat_lr = self._orthozer.convert4(el_mat_lr)
+            self._el_mat_omega = omega
+        return self.el_mat_lr
+
+    def _get_dmdmt(self, dm: torch.Tensor) -> torch.Tensor:
+        # returns the symmetrized density matrix in the cgto basis to be
+        # multiplied with the basis values on the grid
+        # dm: (*BD, nao2, nao2)
+        # returns: (*BD, nao, nao)
 
-                gdens[..., 0, ioff:iend] = torch.einsum("...ri,ri->...r", dmao, grad_basis0) * 2
-                gdens[..., 1, ioff:iend] = torch.einsum("...ri,ri->...r", dmao, grad_basis1) * 2
-                gdens[..., 2, ioff:iend] = torch.einsum("...ri,ri->...r", dmao, grad_basis2) * 2
+        # dm @ ao will be used in every case
+        dmdmt = (dm + dm.transpose(-2, -1)) * 0.5  # (*BD, nao2, nao2)
+        # convert it back to dm in the cgto basis
+        return self._orthozer.unconvert_dm(dmdmt).to(self.grid_dtype)
+
+    def _get_dm_factor(self, dmdmt: torch.Tensor) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        # returns the factors of the output of self._get_dmdmt,
+        # D = C.diag(occ).C^T with C: (*BD, nao, nocc) and occ: (*BD, nocc),
+        # keeping only the non-zero occupations, if the density on the grid is
+        # cheaper from C than from D, otherwise returns None.
+        # The backward of the eigendecomposition is unstable for the degenerate
+        # occupations, so the factors are only used without the gradient, e.g.
+        # in the forward SCF iterations
+        if torch.is_grad_enabled() and dmdmt.requires_grad:
+            return None
+
+        # the occupations can be negative for the difference or the
+        # extrapolation of the density matrices
+        occ, coeff = torch.linalg.eigh(dmdmt.to(self.dtype))
+        absocc = occ.abs()
+        tol = torch.max(absocc, dim=-1, keepdim=True)[0] * 1e-12
+        nocc = max(int(torch.max(torch.sum(absocc > tol, dim=-1))), 1)
+
+        # number of the products of the basis on the grid with the columns of
+        # D (i.e. nao) or C (i.e. nocc) in self._dm2densinfo_at, including the
+        # basis gradient for GGA and the basis laplacian for MGGA
+        nao = dmdmt.shape[-1]
+        nfull = 4 if self.xcfamily == 4 else 1
+        nfac = {2: 4, 4: 5}.get(self.xcfamily, 1)
+        if nfac * nocc >= nfull * nao:
+            return None
+
+        idx = torch.argsort(absocc, dim=-1, descending=True)[..., :nocc]  # (*BD, nocc)
+        occ = torch.gather(occ, -1, idx)
+        coeff = torch.gather(coeff, -1, idx.unsqueeze(-2).expand(*coeff.shape[:-1], nocc))
+        return coeff.to(self.grid_dtype), occ.to(self.grid_dtype)
+
+    def _dm2densinfo_at(self, dmdmt: torch.Tensor, gidx: Union[slice, torch.Tensor],
+                        occ: Optional[torch.Tensor] = None) -> ValGrad:
+        # calculate the density information at the grid points selected by
+        # gidx (slice or indices) from the output of self._get_dmdmt, or from
+        # the factors of self._get_dm_factor if occ is given
+        # dmdmt: (*BD, nao, nao), or the factor C (*BD, nao, nocc) if occ is given
+        # occ: (*BD, nocc)
+        # returns: value (*BD, nr), grad (*BD, ndim, nr)
+        if occ is not None:
+            return self._dmfactor2densinfo_at(dmdmt, occ, gidx)
 
-            if self.xcfamily == 4:
-                assert lapldens is not None
-                assert kindens is not None
-                # calculate the laplacian of the density and kinetic energy density at the grid
-                if not self.is_lapl_ao_set:
-                    msg = "Please call `setup_grid(grid, gradlevel>=2)` to calculate the density gradient"
-                    raise RuntimeError(msg)
-
-                lapl_basis_cat = self.lapl_basis[ioff:iend, :]
-                lapl_basis = torch.einsum("...ri,ri->...r", dmao, lapl_basis_cat)
-                grad_grad = torch.einsum("...ri,ri->...r", torch.matmul(grad_basis0, dmdmt), grad_basis0)
-                grad_grad += torch.einsum("...ri,ri->...r", torch.matmul(grad_basis1, dmdmt), grad_basis1)
-                grad_grad += torch.einsum("...ri,ri->...r", torch.matmul(grad_basis2, dmdmt), grad_basis2)
-                # pytorch's "...ij,ir,jr->...r" is really slow for large matrix
-                # grad_grad = torch.einsum("...ij,ir,jr->...r", dmdmt, self.grad_basis[0], self.grad_basis[0])
-                # grad_grad += torch.einsum("...ij,ir,jr->...r", dmdmt, self.grad_basis[1], self.grad_basis[1])
-                # grad_grad += torch.einsum("...ij,ir,jr->...r", dmdmt, self.grad_basis[2], self.grad_basis[2])
-                lapldens[..., ioff:iend] = (lapl_basis + grad_grad) * 2
-                kindens[..., ioff:iend] = grad_grad * 0.5
+        gdens: Optional[torch.Tensor] = None
+        lapldens: Optional[torch.Tensor] = None
+        kindens: Optional[torch.Tensor] = None
 
-        # dens: (*BD, ngrid)
-        # gdens: (*BD, ndim, ngrid)
-        res = ValGrad(value=dens, grad=gdens, lapl=lapldens, kin=kindens)
-        return res
+        if self.xcfamily == 2 or self.xcfamily == 4:  # GGA or MGGA
+            if not self.is_grad_ao_set:
+                msg = "Please call `setup_grid(grid, gradlevel>=1)` to calculate the density gradient"
+                raise RuntimeError(msg)
+
+            # the density and its gradient from a single contraction with the
+            # stacked basis and its gradient
+            basis_stack = self.basis_stack[:, gidx, :]  # (4, nr, nao)
+            dmao = torch.matmul(basis_stack[0], dmdmt)  # (*BD, nr, nao)
+            dens_stack = torch.einsum("...ri,dri->...dr", dmao, basis_stack).to(self.dtype)  # (*BD, 4, nr)
+            dens = dens_stack[..., 0, :]
+            gdens = dens_stack[..., 1:, :] * 2  # (*BD, ndim, nr)
+        else:
+            basis = self.basis[gidx]  # (nr, nao)
+            dmao = torch.matmul(basis, dmdmt)  # (*BD, nr, nao)
+            dens = torch.einsum("...ri,ri->...r", dmao, basis).to(self.dtype)
+
+        if self.xcfamily == 4:
+            # calculate the laplacian of the density and kinetic energy density at the grid
+            if not self.is_lapl_ao_set:
+                msg = "Please call `setup_grid(grid, gradlevel>=2)` to calculate the density gradient"
+                raise RuntimeError(msg)
+
+            lapl_basis_cat = self.lapl_basis[gidx, :]
+            lapl_basis = torch.einsum("...ri,ri->...r", dmao, lapl_basis_cat)
+            # all the gradient directions in one contraction, pytorch's
+            # "...ij,ir,jr->...r" is really slow for large matrix
+            grad_basis = basis_stack[1:]  # (ndim, nr, nao)
+            grad_dm = torch.matmul(grad_basis, dmdmt.unsqueeze(-3))  # (*BD, ndim, nr, nao)
+            grad_grad = torch.einsum("...dri,dri->...r", grad_dm, grad_basis)
+            lapldens = ((lapl_basis + grad_grad) * 2).to(self.dtype)
+            kindens = (grad_grad * 0.5).to(self.dtype)
+
+        return ValGrad(value=dens, grad=gdens, lapl=lapldens, kin=kindens)
+
+    def _dmfactor2densinfo_at(self, coeff: torch.Tensor, occ: torch.Tensor,
+                              gidx: Union[slice, torch.Tensor]) -> ValGrad:
+        # calculate the density information at the grid points selected by
+        # gidx from the factors of the density matrix, D = C.diag(occ).C^T,
+        # i.e. rho = sum_k occ_k (phi.C_k)^2, so the basis is only multiplied
+        # with the nocc columns of C instead of the nao columns of D
+        # coeff: (*BD, nao, nocc)
+        # occ: (*BD, nocc)
+        # returns: value (*BD, nr), grad (*BD, ndim, nr)
+        gdens: Optional[torch.Tensor] = None
+        lapldens: Optional[torch.Tensor] = None
+        kindens: Optional[torch.Tensor] = None
+        occ = occ.unsqueeze(-2)  # (*BD, 1, nocc)
 
-    def _get_vxc_from_potinfo(self, potinfo: ValGrad) -> xt.LinearOperator:
+        if self.xcfamily == 2 or self.xcfamily == 4:  # GGA or MGGA
+            if not self.is_grad_ao_set:
+                msg = "Please call `setup_grid(grid, gradlevel>=1)` to calculate the density gradient"
+                raise RuntimeError(msg)
+
+            # the orbitals and their gradients from the stacked basis
+            basis_stack = self.basis_stack[:, gidx, :]  # (4, nr, nao)
+            orb_stack = torch.matmul(basis_stack, coeff.unsqueeze(-3))  # (*BD, 4, nr, nocc)
+            orbw = orb_stack[..., 0, :, :] * occ  # (*BD, nr, nocc)
+            dens_stack = torch.sum(orb_stack * orbw.unsqueeze(-3), dim=-1).to(self.dtype)  # (*BD, 4, nr)
+            dens = dens_stack[..., 0, :]
+            gdens = dens_stack[..., 1:, :] * 2  # (*BD, ndim, nr)
+        else:
+            orb = torch.matmul(self.basis[gidx], coeff)  # (*BD, nr, nocc)
+            orbw = orb * occ
+            dens = torch.sum(orb * orbw, dim=-1).to(self.dtype)
+
+        if self.xcfamily == 4:
+            if not self.is_lapl_ao_set:
+                msg = "Please call `setup_grid(grid, gradlevel>=2)` to calculate the density gradient"
+                raise RuntimeError(msg)
+
+            lapl_orb = torch.matmul(self.lapl_basis[gidx, :], coeff)  # (*BD, nr, nocc)
+            lapl_basis = torch.sum(lapl_orb * orbw, dim=-1)
+            grad_orb = orb_stack[..., 1:, :, :]  # (*BD, ndim, nr, nocc)
+            grad_grad = torch.sum(grad_orb * grad_orb * occ.unsqueeze(-3), dim=(-3, -1))
+            lapldens = ((lapl_basis + grad_grad) * 2).to(self.dtype)
+            kindens = (grad_grad * 0.5).to(self.dtype)
+
+        return ValGrad(value=dens, grad=gdens, lapl=lapldens, kin=kindens)
+
+    def _get_vxc_from_potinfo(self, potinfo: ValGrad,
+                              idxs: Optional[torch.Tensor] = None) -> xt.LinearOperator:
         # obtain the vxc operator from the potential information
         # potinfo.value: (*BD, nr)
         # potinfo.grad: (*BD, ndim, nr)
         # potinfo.lapl: (*BD, nr)
         # potinfo.kin: (*BD, nr)
-        # self.basis: (nr, nao)
-        # self.grad_basis: (ndim, nr, nao)
+        # idxs: (nr,) indices of the grid points of the potinfo if the grid
+        #       has been screened, otherwise None
+        # self.basis: (ngrid, nao)
+        # self.grad_basis: (ndim, ngrid, nao)
 
         # prepare the fock matrix component from vxc
         nao = self.basis.shape[-1]
@@ -457,43 +722,261 @@ class HamiltonCGTO(BaseHamilton):
 
         # Split the r-dimension into several parts, it is usually faster than
         # evaluating all at once
-        maxnumel = config.CHUNK_MEMORY // get_dtype_memsize(self.basis)
-        for basis, ioff, iend in chunkify(self.basis, dim=0, maxnumel=maxnumel):
-            # basis: (nr, nao)
-            vb = potinfo.value[..., ioff:iend].unsqueeze(-1) * basis  # (*BD, nr, nao)
-            if self.xcfamily in [2, 4]:  # GGA or MGGA
-                assert potinfo.grad is not None  # (..., ndim, nr)
-                vgrad = potinfo.grad[..., ioff:iend] * 2
-                grad_basis0 = self.grad_basis[0, ioff:iend, :]  # (nr, nao)
-                grad_basis1 = self.grad_basis[1, ioff:iend, :]
-                grad_basis2 = self.grad_basis[2, ioff:iend, :]
-                vb += torch.einsum("...r,ra->...ra", vgrad[..., 0, :], grad_basis0)
-                vb += torch.einsum("...r,ra->...ra", vgrad[..., 1, :], grad_basis1)
-                vb += torch.einsum("...r,ra->...ra", vgrad[..., 2, :], grad_basis2)
-            if self.xcfamily == 4:  # MGGA
-                assert potinfo.lapl is not None  # (..., nrgrid)
-                assert potinfo.kin is not None
-                lapl = potinfo.lapl[..., ioff:iend]
-                kin = potinfo.kin[..., ioff:iend]
-                vb += 2 * lapl.unsqueeze(-1) * self.lapl_basis[ioff:iend, :]
-
-            # calculating the matrix from multiplication with the basis
-            mat += torch.matmul(self.basis_dvolume[ioff:iend, :].transpose(-2, -1), vb)
-
-            if self.xcfamily == 4:  # MGGA
-                assert potinfo.lapl is not None  # (..., nrgrid)
-                assert potinfo.kin is not None
-                lapl_kin_dvol = (2 * lapl + 0.5 * kin) * self.dvolume[..., ioff:iend]
-                mat += torch.einsum("...r,rb,rc->...bc", lapl_kin_dvol, grad_basis0, grad_basis0)
-                mat += torch.einsum("...r,rb,rc->...bc", lapl_kin_dvol, grad_basis1, grad_basis1)
-                mat += torch.einsum("...r,rb,rc->...bc", lapl_kin_dvol, grad_basis2, grad_basis2)
-
-        # construct the Hermitian linear operator
+        # ioff and iend are the indices in potinfo, while gidx is the indices
+        # of the grid points
+        maxnumel = self._get_chunk_memory() // get_dtype_memsize(self.basis)
+        if idxs is None:
+            chunks: Iterable[Tuple[Union[slice, torch.Tensor], int, int]] = \
+                ((slice(ioff, iend), ioff, iend)
+                 for (_, ioff, iend) in chunkify(self.basis, dim=0, maxnumel=maxnumel))
+        elif idxs.shape[0] > 0:
+            chunks = chunkify(idxs, dim=0, maxnumel=max(maxnumel // nao, 1))
+        else:
+            chunks = []  # all the grid points are screened
+        for gidx, ioff, iend in chunks:
+            mat = mat + self._potinfo2mat_at(_select_grid(potinfo, slice(ioff, iend)), gidx)
+
+        return self._mat2vxc_linop(mat)
+
+    def _potinfo2mat_at(self, potinfo: ValGrad, gidx: Union[slice, torch.Tensor]) -> torch.Tensor:
+        # calculate the contribution of the grid points selected by gidx
+        # (slice or indices) to the vxc matrix in the cgto basis
+        # potinfo.value: (*BD, nr)
+        # returns: (*BD, nao, nao)
+        # self.basis is a view of self.basis_stack for GGA and MGGA
+        if self.xcfamily in [2, 4]:
+            basis_stack = self.basis_stack[:, gidx, :]  # (4, nr, nao)
+            basis = basis_stack[0]
+        else:
+            basis = self.basis[gidx]  # (nr, nao)
+
+        # the potentials are converted to the grid dtype for the products
+        # with the basis, then the matrix is accumulated in self.dtype
+        value = potinfo.value.to(self.grid_dtype)
+        vb = value.unsqueeze(-1) * basis  # (*BD, nr, nao)
+        if self.xcfamily in [2, 4]:  # GGA or MGGA
+            assert potinfo.grad is not None  # (..., ndim, nr)
+            vgrad = (potinfo.grad * 2).to(self.grid_dtype)
+            # accumulate the gradient terms in-place from the stacked basis
+            # gradient, it is faster than the batched contraction over the
+            # stack and avoids the temporaries of the separate products
+            for i in range(3):
+                vb.addcmul_(vgrad[..., i, :].unsqueeze(-1), basis_stack[i + 1])
+        if self.xcfamily == 4:  # MGGA
+            assert potinfo.lapl is not None  # (..., nrgrid)
+            assert potinfo.kin is not None
+            lapl = potinfo.lapl.to(self.grid_dtype)
+            kin = potinfo.kin.to(self.grid_dtype)
+            vb += 2 * lapl.unsqueeze(-1) * self.lapl_basis[gidx, :]
+
+        # calculating the matrix from multiplication with the basis, the LDA
+        # matrix is symmetric, but not the gradient and laplacian terms
+        if self.xcfamily in [2, 4]:
+            mat = torch.matmul(self.basis_dvolume[gidx, :].transpose(-2, -1), vb).to(self.dtype)
+        else:
+            mat = _symm_matmul(self.basis_dvolume[gidx, :], vb).to(self.dtype)
+
+        if self.xcfamily == 4:  # MGGA
+            lapl_kin_dvol = (2 * lapl + 0.5 * kin) * self.dvolume[..., gidx].to(self.grid_dtype)
+            # all the gradient directions in a single matrix multiplication
+            nao = basis.shape[-1]
+            grad_basis = basis_stack[1:]  # (ndim, nr, nao)
+            wgrad_basis = grad_basis * lapl_kin_dvol.unsqueeze(-1).unsqueeze(-3)  # (*BD, ndim, nr, nao)
+            mat_kin = _symm_matmul(wgrad_basis.reshape(*wgrad_basis.shape[:-3], -1, nao),
+                                   grad_basis.reshape(-1, nao))
+            mat = mat + mat_kin.to(self.dtype)
+        return mat
+
+    def _mat2vxc_linop(self, mat: torch.Tensor) -> xt.LinearOperator:
+        # construct the Hermitian linear operator from the vxc matrix in the
+        # cgto basis
         mat = self._orthozer.convert2(mat)
         mat = (mat + mat.transpose(-2, -1)) * 0.5
         vxc_linop = xt.LinearOperator.m(mat, is_hermitian=True)
         return vxc_linop
 
+    def _stream_xc(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]],
+                   chunk_fcn: Callable[[Union[ValGrad, SpinParam[ValGrad]], Union[slice, torch.Tensor]],
+                                       Tuple[torch.Tensor, ...]]) -> Tuple[torch.Tensor, ...]:
+        # evaluate the density information and chunk_fcn(densinfo, gidx) chunk
+        # by chunk of the grid points, then returns the sum of the outputs of
+        # chunk_fcn over the chunks, so the grid-sized quantities (density,
+        # potential) are never constructed for the whole grid.
+        # if gradient is required, the chunks are checkpointed, i.e. the
+        # intermediate values are not kept, but recalculated in the backward
+        dmdmt = SpinParam.apply_fcn(lambda dm_: self._get_dmdmt(dm_), dm)
+        polarized = isinstance(dmdmt, SpinParam)
+        if isinstance(dmdmt, SpinParam):
+            dmdmts: Tuple[torch.Tensor, ...] = (dmdmt.u, dmdmt.d)
+        else:
+            dmdmts = (dmdmt,)
+
+        # the factors of the density matrices are only used without the
+        # gradient, so they are never the inputs of the checkpointed chunks
+        occs: List[Optional[torch.Tensor]] = [None] * len(dmdmts)
+        if not torch.is_grad_enabled():
+            dmfacs = [self._get_dm_factor(dmdmt_) for dmdmt_ in dmdmts]
+            dmdmts = tuple(dmdmt_ if dmfac is None else dmfac[0] for (dmdmt_, dmfac) in zip(dmdmts, dmfacs))
+            occs = [None if dmfac is None else dmfac[1] for dmfac in dmfacs]
+
+        # the number of skipped points are only recorded in the forward
+        ngrid = self.basis.shape[-2]
+        nskips: List[int] = []
+
+        def calc_chunk(ioff: int, iend: int, *dmdmts: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+            gidx: Union[slice, torch.Tensor] = slice(ioff, iend)
+            densinfos = [self._dm2densinfo_at(dmdmt_, gidx, occ) for (dmdmt_, occ) in zip(dmdmts, occs)]
+            densinfo: Union[ValGrad, SpinParam[ValGrad]] = \
+                SpinParam(u=densinfos[0], d=densinfos[1]) if polarized else densinfos[0]
+            idxs = self._get_screen_idxs(densinfo)
+            if idxs is not None:
+                nr = min(iend, ngrid) - ioff
+                nskips.append(nr - idxs.shape[0])
+                densinfo = SpinParam.apply_fcn(lambda vg: _select_grid(vg, idxs), densinfo)
+                gidx = idxs + ioff
+            return chunk_fcn(densinfo, gidx)
+
+        res: Optional[Tuple[torch.Tensor, ...]] = None
+        maxnumel = self._get_chunk_memory() // get_dtype_memsize(self.basis)
+        for _, ioff, iend in chunkify(self.basis, dim=0, maxnumel=maxnumel):
+            if torch.is_grad_enabled():
+                res_chunk = checkpoint(calc_chunk, ioff, iend, *dmdmts, use_reentrant=False)
+            else:
+                res_chunk = calc_chunk(ioff, iend, *dmdmts)
+            res = res_chunk if res is None else tuple(r + rc for (r, rc) in zip(res, res_chunk))
+
+        self.xc_screened_frac = sum(nskips) / ngrid
+        if config.XC_DENS_THRESHOLD > 0:
+            logger.log("Density screening skips %d of %d grid points (%.1f%%)" %
+                       (sum(nskips), ngrid, self.xc_screened_frac * 100), vlevel=1)
+        assert res is not None
+        return res
+
+    def _get_vxc_streamed(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) \
+            -> Union[xt.LinearOperator, SpinParam[xt.LinearOperator]]:
+        # calculate the vxc linear operator chunk by chunk of the grid points
+        assert self.xc is not None
+
+        def vxc_chunk(densinfo: Union[ValGrad, SpinParam[ValGrad]],
+                      gidx: Union[slice, torch.Tensor]) -> Tuple[torch.Tensor, ...]:
+            potinfo = self._call_xc("get_vxc", densinfo)
+            if isinstance(potinfo, SpinParam):
+                return (self._potinfo2mat_at(potinfo.u, gidx), self._potinfo2mat_at(potinfo.d, gidx))
+            else:
+                return (self._potinfo2mat_at(potinfo, gidx),)
+
+        mats = self._stream_xc(dm, vxc_chunk)
+        if isinstance(dm, SpinParam):
+            return SpinParam(u=self._mat2vxc_linop(mats[0]), d=self._mat2vxc_linop(mats[1]))
+        else:
+            return self._mat2vxc_linop(mats[0])
+
+    def _get_e_xc_streamed(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> torch.Tensor:
+        # calculate the xc energy chunk by chunk of the grid points
+        assert self.xc is not None
+
+        def exc_chunk(densinfo: Union[ValGrad, SpinParam[ValGrad]],
+                      gidx: Union[slice, torch.Tensor]) -> Tuple[torch.Tensor, ...]:
+            edens = self._call_xc("get_edensityxc", densinfo)  # (*BD, nr)
+            return (torch.sum(self.grid.get_dvolume()[..., gidx] * edens, dim=-1),)
+
+        return self._stream_xc(dm, exc_chunk)[0]
+
+    def _get_e_xc_vxc_streamed(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) \
+            -> Tuple[torch.Tensor, Union[xt.LinearOperator, SpinParam[xt.LinearOperator]]]:
+        # calculate the xc energy and the vxc linear operator chunk by chunk of
+        # the grid points
+        assert self.xc is not None
+
+        def exc_vxc_chunk(densinfo: Union[ValGrad, SpinParam[ValGrad]],
+                          gidx: Union[slice, torch.Tensor]) -> Tuple[torch.Tensor, ...]:
+            edens, potinfo = self._call_xc("get_edensityxc_vxc", densinfo)
+            exc = torch.sum(self.grid.get_dvolume()[..., gidx] * edens, dim=-1)
+            if isinstance(potinfo, SpinParam):
+                return (exc, self._potinfo2mat_at(potinfo.u, gidx), self._potinfo2mat_at(potinfo.d, gidx))
+            else:
+                return (exc, self._potinfo2mat_at(potinfo, gidx))
+
+        res = self._stream_xc(dm, exc_vxc_chunk)
+        if isinstance(dm, SpinParam):
+            return res[0], SpinParam(u=self._mat2vxc_linop(res[1]), d=self._mat2vxc_linop(res[2]))
+        else:
+            return res[0], self._mat2vxc_linop(res[1])
+
+    def _call_xc(self, methodname: str, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> Any:
+        # call the method of self.xc ("get_edensityxc", "get_vxc", or
+        # "get_edensityxc_vxc") with the density information, except if there
+        # is no grid point (e.g. all the points are screened), then the zero
+        # energy density and potential are returned without calling it
+        assert self.xc is not None
+        vg = densinfo.u if isinstance(densinfo, SpinParam) else densinfo
+        if vg.value.shape[-1] > 0:
+            return getattr(self.xc, methodname)(densinfo)
+
+        edens = torch.zeros_like(vg.value)  # (*BD, 0)
+        potinfo = SpinParam.apply_fcn(
+            lambda vg_: ValGrad(value=torch.zeros_like(vg_.value),
+                                grad=torch.zeros_like(vg_.grad) if vg_.grad is not None else None,
+                                lapl=torch.zeros_like(vg_.lapl) if vg_.lapl is not None else None,
+                                kin=torch.zeros_like(vg_.kin) if vg_.kin is not None else None),
+            densinfo)
+        if methodname == "get_edensityxc":
+            return edens
+        elif methodname == "get_vxc":
+            return potinfo
+        else:
+            return edens, potinfo
+
+    def _get_screen_idxs(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> Optional[torch.Tensor]:
+        # returns the indices of the grid points where the total density is
+        # above config.XC_DENS_THRESHOLD for any batch, or None if the
+        # screening is disabled
+        # the mask is obtained from the detached density, so the gradients only
+        # flow through the remaining points
+        threshold = config.XC_DENS_THRESHOLD
+        if threshold <= 0:
+            return None
+
+        if isinstance(densinfo, SpinParam):
+            dens = densinfo.u.value.detach() + densinfo.d.value.detach()
+        else:
+            dens = densinfo.value.detach()
+        ngrid = dens.shape[-1]
+        maxdens = dens.abs().reshape(-1, ngrid).max(dim=0)[0]  # (ngrid,)
+        return torch.nonzero(maxdens >= threshold).squeeze(-1)  # (nr,)
+
+    @overload
+    def _screen_densinfo(self, densinfo: ValGrad) -> Tuple[ValGrad, Optional[torch.Tensor]]:
+        ...
+
+    @overload
+    def _screen_densinfo(self, densinfo: SpinParam[ValGrad]) \
+            -> Tuple[SpinParam[ValGrad], Optional[torch.Tensor]]:
+        ...
+
+    def _screen_densinfo(self, densinfo):
+        # remove the grid points where the total density is below
+        # config.XC_DENS_THRESHOLD for all the batches
+        # returns the screened densinfo and the indices of the remaining grid
+        # points, or None if no points are removed
+        self.xc_screened_frac = 0.0
+        idxs = self._get_screen_idxs(densinfo)
+        if idxs is None:
+            return densinfo, None
+
+        # the number of grid points is taken from the density as the layout
+        # of the basis differs in the periodic Hamiltonian
+        vg = densinfo.u if isinstance(densinfo, SpinParam) else densinfo
+        ngrid = vg.value.shape[-1]
+        nskip = ngrid - idxs.shape[0]
+        self.xc_screened_frac = nskip / ngrid
+        logger.log("Density screening skips %d of %d grid points (%.1f%%)" %
+                   (nskip, ngrid, self.xc_screened_frac * 100), vlevel=1)
+        if nskip == 0:
+            return densinfo, None
+
+        return SpinParam.apply_fcn(lambda vg: _select_grid(vg, idxs), densinfo), idxs
+
     def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
         if methodname == "get_kinnucl":
             return [prefix + "kinnucl_mat"]
@@ -507,7 +990,14 @@ class HamiltonCGTO(BaseHamilton):
             else:
                 return self._df.getparamnames("get_elrep", prefix=prefix + "_df.")
         elif methodname == "get_exchange":
-            return [prefix + "el_mat"]
+            params = [prefix + "el_mat"]
+            if self._el_mat_omega is not None:
+                params += [prefix + "el_mat_lr"]
+            return params
+        elif methodname == "get_elrep_exchange":
+            params = self.getparamnames("get_elrep", prefix=prefix) + \
+                self.getparamnames("get_exchange", prefix=prefix)
+            return list(dict.fromkeys(params))  # remove the duplicates
         elif methodname == "ao_orb2dm":
             return []
         elif methodname == "ao_orb_params2dm":
@@ -524,6 +1014,10 @@ class HamiltonCGTO(BaseHamilton):
             return self.getparamnames("_dm2densinfo", prefix=prefix) + \
                 self.xc.getparamnames("get_edensityxc", prefix=prefix + "xc.") + \
                 self.grid.getparamnames("get_dvolume", prefix=prefix + "grid.")
+        elif methodname == "get_e_xc_vxc":
+            params = self.getparamnames("get_e_xc", prefix=prefix) + \
+                self.getparamnames("get_vxc", prefix=prefix)
+            return list(dict.fromkeys(params))  # remove the duplicates
         elif methodname == "get_vext":
             return [prefix + "basis_dvolume", prefix + "basis"] + \
                 self._orthozer.getparamnames("convert2", prefix=prefix + "_orthozer.")
@@ -538,21 +1032,78 @@ class HamiltonCGTO(BaseHamilton):
                 self.getparamnames("_get_vxc_from_potinfo", prefix=prefix) + \
                 self.xc.getparamnames("get_vxc", prefix=prefix + "xc.")
         elif methodname == "_dm2densinfo":
-            params = [prefix + "basis"] + \
-                self._orthozer.getparamnames("unconvert_dm", prefix=prefix + "_orthozer.")
+            # self.basis is a view of self.basis_stack for GGA and MGGA
             if self.xcfamily == 2 or self.xcfamily == 4:
-                params += [prefix + "grad_basis"]
+                params = [prefix + "basis_stack"]
+            else:
+                params = [prefix + "basis"]
+            params += self._orthozer.getparamnames("unconvert_dm", prefix=prefix + "_orthozer.")
             if self.xcfamily == 4:
                 params += [prefix + "lapl_basis"]
             return params
         elif methodname == "_get_vxc_from_potinfo":
-            params = [prefix + "basis", prefix + "basis_dvolume"] + \
-                self._orthozer.getparamnames("convert2", prefix=prefix + "_orthozer.")
             if self.xcfamily in [2, 4]:
-                params += [prefix + "grad_basis"]
+                params = [prefix + "basis_stack"]
+            else:
+                params = [prefix + "basis"]
+            params += [prefix + "basis_dvolume"] + \
+                self._orthozer.getparamnames("convert2", prefix=prefix + "_orthozer.")
             if self.xcfamily == 4:
                 params += [prefix + "lapl_basis", prefix + "dvolume"]
             return params
         else:
             raise KeyError("getparamnames has no %s method" % methodname)
         # TODO: complete this
+
+def _select_grid(vg: ValGrad, gidx: Union[slice, torch.Tensor]) -> ValGrad:
+    # select the grid points (the last dimension) of the ValGrad
+    return ValGrad(
+        value=vg.value[..., gidx],
+        grad=vg.grad[..., gidx] if vg.grad is not None else None,
+        lapl=vg.lapl[..., gidx] if vg.lapl is not None else None,
+        kin=vg.kin[..., gidx] if vg.kin is not None else None,
+    )
+
+def _symm_matmul(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+    # returns a^T.b that is known to be symmetric, e.g. phi^T.diag(w).phi, by
+    # calculating only the upper blocks of a 2x2 blocks partition and copying
+    # the transpose of the off-diagonal block, i.e. 3/4 of the multiplications.
+    # Small matrices are multiplied at once as the split is not faster.
+    # a: (*BA, nr, nao), b: (*BB, nr, nao)
+    # returns: (*BAB, nao, nao)
+    nao = a.shape[-1]
+    if nao < 512:
+        return torch.matmul(a.transpose(-2, -1), b)
+    h = nao // 2
+    a0 = a[..., :h].transpose(-2, -1)
+    mat00 = torch.matmul(a0, b[..., :h])
+    mat01 = torch.matmul(a0, b[..., h:])
+    mat11 = torch.matmul(a[..., h:].transpose(-2, -1), b[..., h:])
+    mat0 = torch.cat((mat00, mat01), dim=-1)
+    mat1 = torch.cat((mat01.transpose(-2, -1), mat11), dim=-1)
+    return torch.cat((mat0, mat1), dim=-2)
+
+def _contract_jk(el_mat: torch.Tensor, dm_j: torch.Tensor, dm_k: torch.Tensor) -> \
+        Tuple[torch.Tensor, torch.Tensor]:
+    # contract the electron repulsion matrix with the density matrices to get
+    # J_kl = sum_ij dm_j_ij (ij|kl) and K_jk = sum_il dm_k_il (ij|kl) from a
+    # single sweep over the chunks of the first index, so every chunk of the
+    # matrix is only read once for both contractions
+    # el_mat: (nao, nao, nao, nao)
+    # dm_j: (*BJ, nao, nao), dm_k: (*BK, nao, nao)
+    # returns: (*BJ, nao, nao), (*BK, nao, nao)
+    nao = el_mat.shape[-1]
+    maxnumel = max(config.CHUNK_MEMORY // get_dtype_memsize(el_mat), nao ** 3)
+    jmat: Optional[torch.Tensor] = None
+    kmat: Optional[torch.Tensor] = None
+    for el_chunk, ioff, iend in chunkify(el_mat, dim=0, maxnumel=maxnumel):
+        jc = torch.tensordot(dm_j[..., ioff:iend, :], el_chunk, dims=([-2, -1], [0, 1]))
+        kc = torch.tensordot(dm_k[..., ioff:iend, :], el_chunk, dims=([-2, -1], [0, 3]))
+        jmat = jc if jmat is None else jmat + jc
+        kmat = kc if kmat is None else kmat + kc
+    assert jmat is not None and kmat is not None
+
+    # reduce numerical instability
+    jmat = (jmat + jmat.transpose(-2, -1)) * 0.5
+    kmat = (kmat + kmat.transpose(-2, -1)) * 0.5
+    return jmat, kmat
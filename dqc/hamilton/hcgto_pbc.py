@@ -15,6 +15,7 @@ from dqc.grid.base_grid import BaseGrid
 from dqc.xc.base_xc import BaseXC
 from dqc.hamilton.intor.lattice import Lattice
 from dqc.utils.cache import Cache
+from dqc.utils.profiler import stage_timer
 
 class HamiltonCGTO_PBC(HamiltonCGTO):
     """
@@ -74,6 +75,8 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
                              cache=self._cache.add_prefix("df"))
 
         self._is_built = False
+        self.xc_screened_frac = 0.0
+        self._xc_streamable = False
 
     @property
     def nao(self) -> int:
@@ -83,11 +86,16 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
     def kpts(self) -> torch.Tensor:
         return self._kpts
 
+    @property
+    def wkpts(self) -> torch.Tensor:
+        return self._wkpts
+
     @property
     def df(self) -> Optional[BaseDF]:
         return self._df
 
     ############ setups ############
+    @stage_timer("build")
     def build(self) -> BaseHamilton:
         if self._df is None:
             raise NotImplementedError(
@@ -116,6 +124,7 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
         self._is_built = True
         return self
 
+    @stage_timer("setup_grid")
     def setup_grid(self, grid: BaseGrid, xc: Optional[BaseXC] = None) -> None:
         # save the family and save the xc
         self.xc = xc
@@ -173,14 +182,14 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
         return self._df.get_elrep(dm)
 
     @overload
-    def get_exchange(self, dm: torch.Tensor) -> xt.LinearOperator:
+    def get_exchange(self, dm: torch.Tensor, omega: float = 0.0) -> xt.LinearOperator:
         ...
 
     @overload
-    def get_exchange(self, dm: SpinParam[torch.Tensor]) -> SpinParam[xt.LinearOperator]:
+    def get_exchange(self, dm: SpinParam[torch.Tensor], omega: float = 0.0) -> SpinParam[xt.LinearOperator]:
         ...
 
-    def get_exchange(self, dm):
+    def get_exchange(self, dm, omega=0.0):
         msg = "Exact exchange for periodic boundary conditions has not been implemented"
         raise NotImplementedError(msg)
 
@@ -210,10 +219,11 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
         # convert the atomic orbital to the density matrix
 
         # orb: (nkpts, nao, norb)
-        # orb_weight: (norb)
+        # orb_weight: (norb) or (nkpts, norb)
         # return: (nkpts, nao, nao)
         dtype = orb.dtype
-        res = torch.einsum("kao,o,kbo->kab", orb, orb_weight.to(dtype), orb.conj())
+        orb_weight = orb_weight.to(dtype).expand(orb.shape[0], -1)
+        res = torch.einsum("kao,ko,kbo->kab", orb, orb_weight, orb.conj())
         return res
 
     def aodm2dens(self, dm: torch.Tensor, xyz: torch.Tensor) -> torch.Tensor:
@@ -395,33 +405,44 @@ class HamiltonCGTO_PBC(HamiltonCGTO):
             res.append(AtomCGTOBasis(atomz=0, bases=[basis], pos=atb.pos))
         return res
 
-    def _get_vxc_from_potinfo(self, potinfo: ValGrad) -> xt.LinearOperator:
+    def _get_vxc_from_potinfo(self, potinfo: ValGrad,
+                              idxs: Optional[torch.Tensor] = None) -> xt.LinearOperator:
         # overloading from hcgto
 
-        vext = potinfo.value
-        vb = potinfo.value * self.basis
+        # select the grid points if the grid has been screened
+        if idxs is None:
+            basis = self.basis
+            basis_dvolume_conj = self.basis_dvolume_conj
+        else:
+            basis = self.basis[..., idxs]
+            basis_dvolume_conj = self.basis_dvolume_conj[..., idxs]
+
+        vb = potinfo.value * basis
 
         if self.xcfamily in [2, 4]:  # GGA or MGGA
             assert potinfo.grad is not None  # (..., ndim, nrgrid)
+            grad_basis = self.grad_basis if idxs is None else self.grad_basis[..., idxs]
             vgrad = potinfo.grad * 2
-            vb += torch.einsum("...r,kar->...kar", vgrad[..., 0, :], self.grad_basis[0])
-            vb += torch.einsum("...r,kar->...kar", vgrad[..., 1, :], self.grad_basis[1])
-            vb += torch.einsum("...r,kar->...kar", vgrad[..., 2, :], self.grad_basis[2])
+            vb += torch.einsum("...r,kar->...kar", vgrad[..., 0, :], grad_basis[0])
+            vb += torch.einsum("...r,kar->...kar", vgrad[..., 1, :], grad_basis[1])
+            vb += torch.einsum("...r,kar->...kar", vgrad[..., 2, :], grad_basis[2])
         if self.xcfamily == 4:  # MGGA
             assert potinfo.lapl is not None  # (..., nrgrid)
             assert potinfo.kin is not None
-            vb += 2 * potinfo.lapl.unsqueeze(-2).unsqueeze(-2) * self.lapl_basis
+            lapl_basis = self.lapl_basis if idxs is None else self.lapl_basis[..., idxs]
+            vb += 2 * potinfo.lapl.unsqueeze(-2).unsqueeze(-2) * lapl_basis
 
         # calculating the matrix from multiplication with the basis
-        mat = torch.matmul(vb, self.basis_dvolume_conj.transpose(-2, -1))
+        mat = torch.matmul(vb, basis_dvolume_conj.transpose(-2, -1))
 
         if self.xcfamily == 4:  # MGGA
             assert potinfo.lapl is not None  # (..., nrgrid)
             assert potinfo.kin is not None
-            lapl_kin_dvol = (2 * potinfo.lapl + 0.5 * potinfo.kin) * self.dvolume
-            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, self.grad_basis[0], self.grad_basis[0])
-            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, self.grad_basis[1], self.grad_basis[1])
-            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, self.grad_basis[2], self.grad_basis[2])
+            dvolume = self.dvolume if idxs is None else self.dvolume[..., idxs]
+            lapl_kin_dvol = (2 * potinfo.lapl + 0.5 * potinfo.kin) * dvolume
+            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, grad_basis[0], grad_basis[0])
+            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, grad_basis[1], grad_basis[1])
+            mat += torch.einsum("...r,kbr,kcr->...kbc", lapl_kin_dvol, grad_basis[2], grad_basis[2])
 
         mat = (mat + mat.transpose(-2, -1).conj()) * 0.5
         return xt.LinearOperator.m(mat, is_hermitian=True)
@@ -4,9 +4,11 @@ from typing import Tuple, Optional
 import torch
 import numpy as np
 from dqc.hamilton.intor.lcintwrap import LibcintWrapper
-from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, NDIM, CGTO
+from dqc.hamilton.intor.utils import np2ctypes, NDIM, CGTO, \
+    get_intor_nthreads, parallel_map, get_cached_deriv
 from dqc.hamilton.intor.pbcintor import _get_default_kpts, _get_default_options, PBCIntOption
 from dqc.utils.pbc import estimate_ovlp_rcut
+from dqc.utils.profiler import stage_timer
 from dqc.hamilton.intor.molintor import _gather_at_dims
 
 __all__ = ["evl", "eval_gto", "eval_gradgto", "eval_laplgto",
@@ -147,8 +149,8 @@ class _EvalGTO(torch.autograd.Function):
 
                 # get the uncontracted version of the integral
                 # (..., nu_ao, ngrid)
-                dout_dcoeff = _EvalGTO.apply(*u_wrapper.params,
-                                             rgrid, ao_to_atom, u_wrapper, shortname, False)
+                dout_dcoeff = get_cached_deriv(ctx, "coeff", lambda: _EvalGTO.apply(
+                    *u_wrapper.params, rgrid, ao_to_atom, u_wrapper, shortname, False))
 
                 # get the coefficients and spread it on the u_ao-length tensor
                 coeffs_ao = torch.gather(coeffs, dim=-1, index=ao2shl)  # (nu_ao)
@@ -162,8 +164,8 @@ class _EvalGTO(torch.autograd.Function):
 
                 new_sname = _get_evalgto_derivname(shortname, "a")
                 # (..., nu_ao, ngrid)
-                dout_dalpha = _EvalGTO.apply(*u_wrapper.params, rgrid,
-                                             ao_to_atom, u_wrapper, new_sname, False)
+                dout_dalpha = get_cached_deriv(ctx, "rr", lambda: _EvalGTO.apply(
+                    *u_wrapper.params, rgrid, ao_to_atom, u_wrapper, new_sname, False))
 
                 alphas_ao = torch.gather(alphas, dim=-1, index=ao2shl)  # (nu_ao)
                 grad_dalpha = -torch.einsum("...ur,...ur->u", u_grad_res, dout_dalpha)
@@ -175,8 +177,8 @@ class _EvalGTO(torch.autograd.Function):
         grad_rgrid = None
         if rgrid.requires_grad or pos.requires_grad:
             opsname = _get_evalgto_derivname(shortname, "r")
-            dresdr = _EvalGTO.apply(*ctx.saved_tensors,
-                                    ao_to_atom, wrapper, opsname, False)  # (ndim, *, nao, ngrid)
+            dresdr = get_cached_deriv(ctx, "ip", lambda: _EvalGTO.apply(
+                *ctx.saved_tensors, ao_to_atom, wrapper, opsname, False))  # (ndim, *, nao, ngrid)
             grad_r = dresdr * grad_res  # (ndim, *, nao, ngrid)
 
             if rgrid.requires_grad:
@@ -207,30 +209,41 @@ def gto_evaluator(wrapper: LibcintWrapper, shortname: str, rgrid: torch.Tensor,
     opname = _get_evalgto_opname(shortname, wrapper.spherical)
     outshape = _get_evalgto_compshape(shortname) + (nao, ngrid)
 
-    out = np.empty(outshape, dtype=np.float64)
-    non0tab = np.ones(((ngrid + BLKSIZE - 1) // BLKSIZE, nshells),
-                      dtype=np.int8)
-
     # TODO: check if we need to transpose it first?
     rgrid = rgrid.contiguous()
     coords = np.asarray(rgrid, dtype=np.float64, order='F')
-    ao_loc = np.asarray(wrapper.full_shell_to_aoloc, dtype=np.int32)
+    c_ao_loc = wrapper.full_shell_to_aoloc_ctypes
+    c_atm_bas_env = wrapper.atm_bas_env_ctypes
 
     c_shls = (ctypes.c_int * 2)(*wrapper.shell_idxs)
-    c_ngrid = ctypes.c_int(ngrid)
 
     # evaluate the orbital
     operator = getattr(CGTO(), opname)
     operator.restype = ctypes.c_double
-    atm, bas, env = wrapper.atm_bas_env
-    operator(c_ngrid, c_shls,
-             np2ctypes(ao_loc),
-             np2ctypes(out),
-             np2ctypes(coords),
-             np2ctypes(non0tab),
-             np2ctypes(atm), int2ctypes(atm.shape[0]),
-             np2ctypes(bas), int2ctypes(bas.shape[0]),
-             np2ctypes(env))
+
+    def calc(igrids: Tuple[int, int]) -> np.ndarray:
+        ngrid_chunk = igrids[1] - igrids[0]
+        out = np.empty((*outshape[:-1], ngrid_chunk), dtype=np.float64)
+        non0tab = np.ones(((ngrid_chunk + BLKSIZE - 1) // BLKSIZE, nshells),
+                          dtype=np.int8)
+        coords_chunk = np.asarray(coords[igrids[0]:igrids[1]], order='F')
+        operator(ctypes.c_int(ngrid_chunk), c_shls,
+                 c_ao_loc,
+                 np2ctypes(out),
+                 np2ctypes(coords_chunk),
+                 np2ctypes(non0tab),
+                 *c_atm_bas_env)
+        return out
+
+    # split the grid points into the thread pool with the chunk size of
+    # multiple of the block size of the library
+    nthreads = get_intor_nthreads()
+    nblocks = (ngrid + BLKSIZE - 1) // BLKSIZE
+    chunksize = max((nblocks + nthreads - 1) // nthreads, 1) * BLKSIZE
+    igrids_lst = [(i, min(i + chunksize, ngrid)) for i in range(0, ngrid, chunksize)]
+    with stage_timer("eval_gto"):
+        outs = parallel_map(calc, igrids_lst)
+    out = outs[0] if len(outs) == 1 else np.concatenate(outs, axis=-1)
 
     if to_transpose:
         out = np.ascontiguousarray(np.moveaxis(out, -1, -2))
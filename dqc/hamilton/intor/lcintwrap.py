@@ -1,11 +1,12 @@
 from __future__ import annotations
 from contextlib import contextmanager
+import ctypes
 from typing import List, Tuple, Iterator, Optional, Dict
 import copy
 import torch
 import numpy as np
 from dqc.utils.datastruct import AtomCGTOBasis, CGTOBasis
-from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, NDIM, CINT
+from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, NDIM, CINT, CGTO
 from dqc.hamilton.intor.lattice import Lattice
 from dqc.utils.misc import memoize_method
 
@@ -19,6 +20,7 @@ __all__ = ["LibcintWrapper", "SubsetLibcintWrapper"]
 #       e.g. p-shell is splitted into 3 components for cartesian (x, y, z)
 
 PTR_RINV_ORIG = 4  # from libcint/src/cint_const.h
+PTR_RANGE_OMEGA = 8  # from libcint/src/cint_const.h
 
 class LibcintWrapper(object):
     def __init__(self, atombases: List[AtomCGTOBasis], spherical: bool = True,
@@ -122,6 +124,20 @@ class LibcintWrapper(object):
         self._ao_to_shell = torch.tensor(ao_to_shell, dtype=torch.long, device=self.device)
         self._ao_to_atom = torch.tensor(ao_to_atom, dtype=torch.long, device=self.device)
 
+        # the libcint optimizers of the operators and the ctypes arguments are
+        # cached here to avoid constructing them for every integral
+        self._intgl_optimizers: Dict[str, ctypes.c_void_p] = {}
+        self._atm_bas_env_ctypes = (
+            np2ctypes(self._atm), int2ctypes(self._atm.shape[0]),
+            np2ctypes(self._bas), int2ctypes(self._bas.shape[0]),
+            np2ctypes(self._env))
+        self._shell_to_aoloc_ctypes = np2ctypes(self._shell_to_aoloc)
+
+        # the uncontracted wrappers and their ao mappings of the subsets are
+        # cached here with the shell indices as the key, so they are shared
+        # among the subsets with the same shells
+        self._uncontr_subsets: Dict[Tuple[int, int], Tuple[LibcintWrapper, torch.Tensor]] = {}
+
     @property
     def parent(self) -> LibcintWrapper:
         # parent is defined as the full LibcintWrapper where it takes the full
@@ -158,6 +174,13 @@ class LibcintWrapper(object):
         # this shouldn't change in the sliced wrapper
         return self._atm, self._bas, self._env
 
+    @property
+    def atm_bas_env_ctypes(self) -> Tuple[ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                          ctypes.c_int, ctypes.c_void_p]:
+        # returns the ctypes arguments of the triplet lists for libcint, i.e.
+        # atm, natm, bas, nbas, env
+        return self._atm_bas_env_ctypes
+
     @property
     def full_angmoms(self) -> torch.Tensor:
         return self._allangmoms
@@ -182,6 +205,11 @@ class LibcintWrapper(object):
         # if this object is a subset, then returns the complete mapping
         return self._shell_to_aoloc
 
+    @property
+    def full_shell_to_aoloc_ctypes(self) -> ctypes.c_void_p:
+        # returns the ctypes pointer to the full_shell_to_aoloc array
+        return self._shell_to_aoloc_ctypes
+
     @property
     def full_gauss_to_shell(self) -> torch.Tensor:
         # returns the full index mapping from gaussian to shell tensor
@@ -266,6 +294,12 @@ class LibcintWrapper(object):
         # returns the uncontracted LibcintWrapper as well as the mapping from
         # uncontracted atomic orbital (relative index) to the relative index
         # of the atomic orbital
+
+        # if all the shells are already uncontracted (e.g. when calculating
+        # the higher order derivatives), then just returns itself
+        if all([ngauss == 1 for ngauss in self.ngauss_at_shell]):
+            return self, torch.arange(self.nao(), dtype=torch.long, device=self.device)
+
         new_atombases = []
         for atombasis in self.atombases:
             atomz = atombasis.atomz
@@ -295,6 +329,17 @@ class LibcintWrapper(object):
         uao2ao_res = torch.tensor(uao2ao, dtype=torch.long, device=self.device)
         return uncontr_wrapper, uao2ao_res
 
+    def get_intgl_optimizer(self, opname: str) -> ctypes.c_void_p:
+        # returns the libcint optimizer of the integral operator for the
+        # environment of this object
+        # the optimizer is cached in the parent, so it is shared among the
+        # subsets and freed when the parent is deleted
+        optimizers = self.parent._intgl_optimizers
+        if opname not in optimizers:
+            atm, bas, env = self.atm_bas_env
+            optimizers[opname] = _get_intgl_optimizer(opname, atm, bas, env)
+        return optimizers[opname]
+
     @staticmethod
     def concatenate(*wrappers: LibcintWrapper) \
             -> Tuple[LibcintWrapper, ...]:
@@ -401,12 +446,19 @@ class SubsetLibcintWrapper(LibcintWrapper):
     def shell_idxs(self) -> Tuple[int, int]:
         return self._shell_idxs
 
-    @memoize_method
     def get_uncontracted_wrapper(self):
         # returns the uncontracted LibcintWrapper as well as the mapping from
         # uncontracted atomic orbital (relative index) to the relative index
         # of the atomic orbital of the contracted wrapper
+        # the results are cached in the parent because the subsets are usually
+        # constructed again for every integral
+        cache = self._parent._uncontr_subsets
+        shell_idxs = self.shell_idxs
+        if shell_idxs not in cache:
+            cache[shell_idxs] = self._get_uncontracted_wrapper()
+        return cache[shell_idxs]
 
+    def _get_uncontracted_wrapper(self) -> Tuple[LibcintWrapper, torch.Tensor]:
         pu_wrapper, p_uao2ao = self._parent.get_uncontracted_wrapper()
 
         # determine the corresponding shell indices in the new uncontracted wrapper
@@ -431,3 +483,26 @@ class SubsetLibcintWrapper(LibcintWrapper):
 
     def __getattr__(self, name):
         return getattr(self._parent, name)
+
+# Optimizer class
+class _cintoptHandler(ctypes.c_void_p):
+    def __del__(self):
+        try:
+            CGTO().CINTdel_optimizer(ctypes.byref(self))
+        except AttributeError:
+            pass
+
+def _get_intgl_optimizer(opname: str,
+                         atm: np.ndarray, bas: np.ndarray, env: np.ndarray)\
+                         -> ctypes.c_void_p:
+    # get the optimizer of the integrals
+    # setup the optimizer
+    cintopt = ctypes.POINTER(ctypes.c_void_p)()
+    optname = opname.replace("_cart", "").replace("_sph", "") + "_optimizer"
+    copt = getattr(CINT(), optname)
+    copt(ctypes.byref(cintopt),
+         np2ctypes(atm), int2ctypes(atm.shape[0]),
+         np2ctypes(bas), int2ctypes(bas.shape[0]),
+         np2ctypes(env))
+    opt = ctypes.cast(cintopt, _cintoptHandler)
+    return opt
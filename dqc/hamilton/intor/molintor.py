@@ -5,9 +5,13 @@ import operator
 from functools import reduce
 import numpy as np
 import torch
-from dqc.hamilton.intor.lcintwrap import LibcintWrapper
-from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, NDIM, CINT, CGTO
+from dqc.hamilton.intor.lcintwrap import LibcintWrapper, PTR_RINV_ORIG, PTR_RANGE_OMEGA
+from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, NDIM, CINT, CGTO, \
+    get_intor_nthreads, split_shells, parallel_map, get_cached_deriv
+from dqc.hamilton.intor.symmetry import BaseSymmetry, S1Symmetry, S2ijSymmetry, S2klSymmetry, \
+    S4Symmetry
 from dqc.hamilton.intor.namemgr import IntorNameManager
+from dqc.utils.profiler import stage_timer
 
 __all__ = ["int1e", "int3c2e", "int2e",
            "overlap", "kinetic", "nuclattr", "elrep", "coul2c", "coul3c"]
@@ -74,13 +78,17 @@ def int3c2e(shortname: str, wrapper: LibcintWrapper,
 def int2e(shortname: str, wrapper: LibcintWrapper,
           other1: Optional[LibcintWrapper] = None,
           other2: Optional[LibcintWrapper] = None,
-          other3: Optional[LibcintWrapper] = None) -> torch.Tensor:
+          other3: Optional[LibcintWrapper] = None, *,
+          omega: float = 0.0) -> torch.Tensor:
     """
     4-centre 2-electron integrals where the `wrapper` and `other1` correspond
     to the first electron, and `other2` and `other3` correspond to another
     electron.
     The returned indices are sorted based on `wrapper`, `other1`, `other2`, and `other3`.
     The available shortname: "ar12b"
+    If `omega` is non-zero, the Coulomb operator is replaced by the range-separated
+    one, i.e. erf(omega * r12) / r12 for positive `omega` (long-range) and
+    erfc(|omega| * r12) / r12 for negative `omega` (short-range).
     """
 
     # check and set the others
@@ -90,7 +98,7 @@ def int2e(shortname: str, wrapper: LibcintWrapper,
     return _Int4cFunction.apply(
         *wrapper.params,
         [wrapper, other1w, other2w, other3w],
-        IntorNameManager("int2e", shortname))
+        IntorNameManager("int2e", shortname), omega)
 
 # shortcuts
 def overlap(wrapper: LibcintWrapper, other: Optional[LibcintWrapper] = None) -> torch.Tensor:
@@ -103,20 +111,22 @@ def nuclattr(wrapper: LibcintWrapper, other: Optional[LibcintWrapper] = None) ->
     if not wrapper.fracz:
         return int1e("nuc", wrapper, other=other)
     else:
-        res = torch.tensor([])
+        # calculate the rinv integrals centred on all atoms at once
         allpos_params = wrapper.params[-1]
-        for i in range(wrapper.natoms):
-            y = int1e("rinv", wrapper, other=other, rinv_pos=allpos_params[i]) * \
-                (-wrapper.atombases[i].atomz)
-            res = y if (i == 0) else (res + y)
-        return res
+        y = int1e("rinv", wrapper, other=other, rinv_pos=allpos_params)  # (natoms, ..., nao, nao)
+        atomzs = torch.stack([
+            (atb.atomz if isinstance(atb.atomz, torch.Tensor) else
+             torch.tensor(atb.atomz)).to(dtype=y.dtype, device=y.device)
+            for atb in wrapper.atombases])  # (natoms,)
+        return torch.tensordot(-atomzs, y, dims=([0], [0]))
 
 def elrep(wrapper: LibcintWrapper,
           other1: Optional[LibcintWrapper] = None,
           other2: Optional[LibcintWrapper] = None,
-          other3: Optional[LibcintWrapper] = None,
+          other3: Optional[LibcintWrapper] = None, *,
+          omega: float = 0.0,
           ) -> torch.Tensor:
-    return int2e("ar12b", wrapper, other1, other2, other3)
+    return int2e("ar12b", wrapper, other1, other2, other3, omega=omega)
 
 def coul2c(wrapper: LibcintWrapper,
            other: Optional[LibcintWrapper] = None,
@@ -156,16 +166,21 @@ class _Int2cFunction(torch.autograd.Function):
         # allcoeffs: (ngauss_tot,)
         # allalphas: (ngauss_tot,)
         # allposs: (natom, ndim)
-        # rinv_pos: (ndim,) if contains "rinv"
+        # rinv_pos: (ndim,) or (ncentres, ndim) if contains "rinv"
         #           rinv_pos is only meaningful if shortname contains "rinv"
-        # In "rinv", rinv_pos becomes the centre
+        # In "rinv", rinv_pos becomes the centre. If there are multiple centres,
+        # the integrals for all centres are calculated at once and the
+        # centres become the first dimension of the output
         # Wrapper0 and wrapper1 must have the same _atm, _bas, and _env.
         # The check should be done before calling this function.
         # Those tensors are not used directly in the forward calculation, but
         #   required for backward propagation
         assert len(wrappers) == 2
 
-        if int_nmgr.rawopname == "rinv":
+        if int_nmgr.rawopname == "rinv" and rinv_pos.ndim == 2:
+            assert rinv_pos.shape[-1] == NDIM
+            out_tensor = Intor(int_nmgr, wrappers).calc_rinv(rinv_pos)
+        elif int_nmgr.rawopname == "rinv":
             assert rinv_pos.ndim == 1 and rinv_pos.shape[0] == NDIM
             with wrappers[0].centre_on_r(rinv_pos):
                 out_tensor = Intor(int_nmgr, wrappers).calc()
@@ -173,11 +188,11 @@ class _Int2cFunction(torch.autograd.Function):
             out_tensor = Intor(int_nmgr, wrappers).calc()
         ctx.save_for_backward(allcoeffs, allalphas, allposs, rinv_pos)
         ctx.other_info = (wrappers, int_nmgr)
-        return out_tensor  # (..., nao0, nao1)
+        return out_tensor  # ([ncentres], ..., nao0, nao1)
 
     @staticmethod
     def backward(ctx, grad_out: torch.Tensor) -> Tuple[Optional[torch.Tensor], ...]:  # type: ignore
-        # grad_out: (..., nao0, nao1)
+        # grad_out: ([ncentres], ..., nao0, nao1)
         allcoeffs, allalphas, allposs, \
             rinv_pos = ctx.saved_tensors
         wrappers, int_nmgr = ctx.other_info
@@ -195,7 +210,8 @@ class _Int2cFunction(torch.autograd.Function):
             int_fcn = lambda wrappers, namemgr: _Int2cFunction.apply(
                 *ctx.saved_tensors, wrappers, namemgr)
             # list of tensors with shape: (ndim, ..., nao0, nao1)
-            dout_dposs = _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos)
+            dout_dposs = get_cached_deriv(
+                ctx, "ip", lambda: _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos))
 
             ndim = dout_dposs[0].shape[0]
             shape = (ndim, -1, *dout_dposs[0].shape[-2:])
@@ -212,7 +228,6 @@ class _Int2cFunction(torch.autograd.Function):
             grad_allpossT.scatter_add_(dim=-1, index=ao_to_atom0, src=grad_dpos_i)
             grad_allpossT.scatter_add_(dim=-1, index=ao_to_atom1, src=grad_dpos_j)
 
-            grad_allposs_nuc = torch.zeros_like(grad_allposs)
             if "nuc" == int_nmgr.rawopname:
                 # allposs: (natoms, ndim)
                 natoms = allposs.shape[0]
@@ -220,20 +235,20 @@ class _Int2cFunction(torch.autograd.Function):
                 int_nmgr_rinv = IntorNameManager(int_nmgr.int_type, sname_rinv)
                 sname_derivs = [int_nmgr_rinv.get_intgl_deriv_namemgr("ip", ib) for ib in (0, 1)]
                 new_axes_pos = [int_nmgr_rinv.get_intgl_deriv_newaxispos("ip", ib) for ib in (0, 1)]
+                atomzs = torch.tensor([float(atb.atomz) for atb in wrappers[0].atombases],
+                                      dtype=allposs.dtype, device=allposs.device)  # (natoms,)
 
-                for i in range(natoms):
-                    atomz = wrappers[0].atombases[i].atomz
+                # get the rinv integrals centred on all atoms at once
+                int_fcn = lambda wrappers, namemgr: _Int2cFunction.apply(
+                    allcoeffs, allalphas, allposs, allposs,
+                    wrappers, namemgr)
+                dout_datposs = get_cached_deriv(
+                    ctx, "ipnuc", lambda: _get_integrals(sname_derivs, wrappers, int_fcn,
+                                                         new_axes_pos))  # (ndim, natoms, ..., nao, nao)
 
-                    # get the integrals
-                    int_fcn = lambda wrappers, namemgr: _Int2cFunction.apply(
-                        allcoeffs, allalphas, allposs, allposs[i],
-                        wrappers, namemgr)
-                    dout_datposs = _get_integrals(sname_derivs, wrappers, int_fcn,
-                                                  new_axes_pos)  # (ndim, ..., nao, nao)
-
-                    grad_datpos = grad_out * (dout_datposs[0] + dout_datposs[1])
-                    grad_datpos = grad_datpos.reshape(grad_datpos.shape[0], -1).sum(dim=-1)
-                    grad_allposs_nuc[i] = (-atomz) * grad_datpos
+                grad_datpos = grad_out * (dout_datposs[0] + dout_datposs[1])
+                grad_datpos = grad_datpos.reshape(ndim, natoms, -1).sum(dim=-1)  # (ndim, natoms)
+                grad_allposs_nuc = ((-atomzs) * grad_datpos).transpose(-2, -1)  # (natoms, ndim)
 
                 grad_allposs += grad_allposs_nuc
 
@@ -247,10 +262,14 @@ class _Int2cFunction(torch.autograd.Function):
             new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("ip", ib) for ib in (0, 1)]
             int_fcn = lambda wrappers, namemgr: _Int2cFunction.apply(
                 *ctx.saved_tensors, wrappers, namemgr)
-            dout_datposs = _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos)
+            dout_datposs = get_cached_deriv(
+                ctx, "iprinv", lambda: _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos))
 
+            # (ndim, [ncentres])
             grad_datpos = grad_out * (dout_datposs[0] + dout_datposs[1])
-            grad_rinv_pos = grad_datpos.reshape(grad_datpos.shape[0], -1).sum(dim=-1)
+            ndim = grad_datpos.shape[0]
+            grad_datpos = grad_datpos.reshape(ndim, *rinv_pos.shape[:-1], -1).sum(dim=-1)
+            grad_rinv_pos = torch.movedim(grad_datpos, 0, -1)  # ([ncentres], ndim)
 
         # gradient for the basis coefficients
         grad_allcoeffs: Optional[torch.Tensor] = None
@@ -275,8 +294,8 @@ class _Int2cFunction(torch.autograd.Function):
                 grad_allcoeffs = torch.zeros_like(allcoeffs)  # (ngauss)
 
                 # get the uncontracted version of the integral
-                dout_dcoeff = _Int2cFunction.apply(
-                    *u_params, rinv_pos, u_wrappers, int_nmgr)  # (..., nu_ao0, nu_ao1)
+                dout_dcoeff = get_cached_deriv(ctx, "coeff", lambda: _Int2cFunction.apply(
+                    *u_params, rinv_pos, u_wrappers, int_nmgr))  # (..., nu_ao0, nu_ao1)
 
                 # get the coefficients and spread it on the u_ao-length tensor
                 coeffs_ao0 = torch.gather(allcoeffs, dim=-1, index=ao2shl0)  # (nu_ao0)
@@ -307,7 +326,8 @@ class _Int2cFunction(torch.autograd.Function):
                 # get the uncontracted integrals
                 sname_derivs = [int_nmgr.get_intgl_deriv_namemgr("rr", ib) for ib in (0, 1)]
                 new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("rr", ib) for ib in (0, 1)]
-                dout_dalphas = _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos)
+                dout_dalphas = get_cached_deriv(
+                    ctx, "rr", lambda: _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos))
 
                 # (nu_ao)
                 # negative because the exponent is negative alpha * (r-ra)^2
@@ -355,7 +375,8 @@ class _Int3cFunction(torch.autograd.Function):
             new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("ip", ib) for ib in (0, 1, 2)]
             int_fcn = lambda wrappers, int_nmgr: _Int3cFunction.apply(
                 *ctx.saved_tensors, wrappers, int_nmgr)
-            dout_dposs = _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos)
+            dout_dposs = get_cached_deriv(
+                ctx, "ip", lambda: _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos))
 
             # negative because the integral calculates the nabla w.r.t. the
             # spatial coordinate, not the basis central position
@@ -397,7 +418,8 @@ class _Int3cFunction(torch.autograd.Function):
                 grad_allcoeffs = torch.zeros_like(allcoeffs)
 
                 # (..., nu_ao0, nu_ao1, nu_ao2)
-                dout_dcoeff = _Int3cFunction.apply(*u_params, u_wrappers, int_nmgr)
+                dout_dcoeff = get_cached_deriv(
+                    ctx, "coeff", lambda: _Int3cFunction.apply(*u_params, u_wrappers, int_nmgr))
 
                 # get the coefficients and spread it on the u_ao-length tensor
                 coeffs_ao0 = torch.gather(allcoeffs, dim=-1, index=ao2shl0)  # (nu_ao0)
@@ -428,7 +450,8 @@ class _Int3cFunction(torch.autograd.Function):
                 new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("rr", ib) for ib in (0, 1, 2)]
                 u_int_fcn = lambda u_wrappers, int_nmgr: _Int3cFunction.apply(
                     *u_params, u_wrappers, int_nmgr)
-                dout_dalphas = _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos)
+                dout_dalphas = get_cached_deriv(
+                    ctx, "rr", lambda: _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos))
 
                 # (nu_ao)
                 # negative because the exponent is negative alpha * (r-ra)^2
@@ -451,20 +474,21 @@ class _Int4cFunction(torch.autograd.Function):
     def forward(ctx,  # type: ignore
                 allcoeffs: torch.Tensor, allalphas: torch.Tensor, allposs: torch.Tensor,
                 wrappers: List[LibcintWrapper],
-                int_nmgr: IntorNameManager) -> torch.Tensor:
+                int_nmgr: IntorNameManager,
+                omega: float = 0.0) -> torch.Tensor:
 
         assert len(wrappers) == 4
 
-        out_tensor = Intor(int_nmgr, wrappers).calc()
+        out_tensor = Intor(int_nmgr, wrappers, omega=omega).calc()
         ctx.save_for_backward(allcoeffs, allalphas, allposs)
-        ctx.other_info = (wrappers, int_nmgr)
+        ctx.other_info = (wrappers, int_nmgr, omega)
         return out_tensor  # (..., nao0, nao1, nao2, nao3)
 
     @staticmethod
     def backward(ctx, grad_out) -> Tuple[Optional[torch.Tensor], ...]:  # type: ignore
         # grad_out: (..., nao0, nao1, nao2, nao3)
         allcoeffs, allalphas, allposs = ctx.saved_tensors
-        wrappers, int_nmgr = ctx.other_info
+        wrappers, int_nmgr, omega = ctx.other_info
         naos = grad_out.shape[-4:]
 
         # calculate the gradient w.r.t. positions
@@ -476,8 +500,9 @@ class _Int4cFunction(torch.autograd.Function):
             sname_derivs = [int_nmgr.get_intgl_deriv_namemgr("ip", ib) for ib in range(4)]
             new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("ip", ib) for ib in range(4)]
             int_fcn = lambda wrappers, int_nmgr: _Int4cFunction.apply(
-                *ctx.saved_tensors, wrappers, int_nmgr)
-            dout_dposs = _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos)
+                *ctx.saved_tensors, wrappers, int_nmgr, omega)
+            dout_dposs = get_cached_deriv(
+                ctx, "ip", lambda: _get_integrals(sname_derivs, wrappers, int_fcn, new_axes_pos))
 
             # negative because the integral calculates the nabla w.r.t. the
             # spatial coordinate, not the basis central position
@@ -523,7 +548,8 @@ class _Int4cFunction(torch.autograd.Function):
                 grad_allcoeffs = torch.zeros_like(allcoeffs)
 
                 # (..., nu_ao0, nu_ao1, nu_ao2, nu_ao3)
-                dout_dcoeff = _Int4cFunction.apply(*u_params, u_wrappers, int_nmgr)
+                dout_dcoeff = get_cached_deriv(
+                    ctx, "coeff", lambda: _Int4cFunction.apply(*u_params, u_wrappers, int_nmgr, omega))
 
                 # get the coefficients and spread it on the u_ao-length tensor
                 coeffs_ao0 = torch.gather(allcoeffs, dim=-1, index=ao2shl0)  # (nu_ao0)
@@ -557,8 +583,9 @@ class _Int4cFunction(torch.autograd.Function):
                 sname_derivs = [int_nmgr.get_intgl_deriv_namemgr("rr", ib) for ib in range(4)]
                 new_axes_pos = [int_nmgr.get_intgl_deriv_newaxispos("rr", ib) for ib in range(4)]
                 u_int_fcn = lambda u_wrappers, int_nmgr: _Int4cFunction.apply(
-                    *u_params, u_wrappers, int_nmgr)
-                dout_dalphas = _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos)
+                    *u_params, u_wrappers, int_nmgr, omega)
+                dout_dalphas = get_cached_deriv(
+                    ctx, "rr", lambda: _get_integrals(sname_derivs, u_wrappers, u_int_fcn, new_axes_pos))
 
                 # (nu_ao)
                 # negative because the exponent is negative alpha * (r-ra)^2
@@ -579,20 +606,23 @@ class _Int4cFunction(torch.autograd.Function):
 
 ################### integrator (direct interface to libcint) ###################
 
-# Optimizer class
-class _cintoptHandler(ctypes.c_void_p):
-    def __del__(self):
-        try:
-            CGTO().CINTdel_optimizer(ctypes.byref(self))
-        except AttributeError:
-            pass
-
 class Intor(object):
-    def __init__(self, int_nmgr: IntorNameManager, wrappers: List[LibcintWrapper]):
+    def __init__(self, int_nmgr: IntorNameManager, wrappers: List[LibcintWrapper],
+                 omega: float = 0.0):
         assert len(wrappers) > 0
         wrapper0 = wrappers[0]
         self.int_type = int_nmgr.int_type
-        self.atm, self.bas, self.env = wrapper0.atm_bas_env
+        self.c_atm_bas_env = wrapper0.atm_bas_env_ctypes
+        if omega != 0.0:
+            # range-separated coulomb operator is set in a copy of env, so the
+            # integrals of the wrapper elsewhere are not affected
+            atm, bas, env = wrapper0.atm_bas_env
+            self._env = env.copy()
+            self._env[PTR_RANGE_OMEGA] = omega
+            self.c_atm_bas_env = (np2ctypes(atm), int2ctypes(atm.shape[0]),
+                                  np2ctypes(bas), int2ctypes(bas.shape[0]),
+                                  np2ctypes(self._env))
+        self.c_ao_loc = wrapper0.full_shell_to_aoloc_ctypes
         self.wrapper0 = wrapper0
         self.int_nmgr = int_nmgr
         self.wrapper_uniqueness = _get_uniqueness([id(w) for w in wrappers])
@@ -600,74 +630,202 @@ class Intor(object):
         # get the operator
         opname = int_nmgr.get_intgl_name(wrapper0.spherical)
         self.op = getattr(CINT(), opname)
-        self.optimizer = _get_intgl_optimizer(opname, self.atm, self.bas, self.env)
+        self.optimizer = wrapper0.get_intgl_optimizer(opname)
 
         # prepare the output
         comp_shape = int_nmgr.get_intgl_components_shape()
         self.outshape = comp_shape + tuple(w.nao() for w in wrappers)
         self.ncomp = reduce(operator.mul, comp_shape, 1)
-        self.shls_slice = sum((w.shell_idxs for w in wrappers), ())
+        self.shls_slice: Tuple[int, ...] = sum((w.shell_idxs for w in wrappers), ())
         self.integral_done = False
 
     def calc(self) -> torch.Tensor:
         assert not self.integral_done
         self.integral_done = True
-        if self.int_type == "int1e" or self.int_type == "int2c2e":
-            return self._int2c()
-        elif self.int_type == "int3c2e":
-            return self._int3c()
-        elif self.int_type == "int2e":
-            return self._int4c()
-        else:
-            raise ValueError("Unknown integral type: %s" % self.int_type)
+        with stage_timer("intor"):
+            if self.int_type == "int1e" or self.int_type == "int2c2e":
+                return self._to_tensor(self._int2c())
+            elif self.int_type == "int3c2e":
+                return self._int3c()
+            elif self.int_type == "int2e":
+                return self._int4c()
+            else:
+                raise ValueError("Unknown integral type: %s" % self.int_type)
+
+    def calc_rinv(self, rinv_poss: torch.Tensor) -> torch.Tensor:
+        # calculate the 2-centre rinv-type integrals for all the centres in
+        # rinv_poss: (ncentres, ndim) at once
+        # returns: (ncentres, ..., nao0, nao1)
+        assert not self.integral_done
+        assert self.int_type == "int1e"
+        assert rinv_poss.ndim == 2 and rinv_poss.shape[-1] == NDIM
+        self.integral_done = True
 
-    def _int2c(self) -> torch.Tensor:
+        # every centre has its own copy of env with the centre set at the
+        # rinv origin, so the centres can be evaluated concurrently
+        atm, bas, env0 = self.wrapper0.atm_bas_env
+        poss = rinv_poss.detach().cpu().numpy()
+
+        def calc(pos: np.ndarray) -> np.ndarray:
+            env = env0.copy()
+            env[PTR_RINV_ORIG: PTR_RINV_ORIG + NDIM] = pos
+            c_atm_bas_env = (np2ctypes(atm), int2ctypes(atm.shape[0]),
+                             np2ctypes(bas), int2ctypes(bas.shape[0]),
+                             np2ctypes(env))
+            return self._int2c(c_atm_bas_env, split=False)
+
+        with stage_timer("intor"):
+            outs = parallel_map(calc, list(poss))
+        out = np.stack(outs, axis=0) if len(outs) > 0 else \
+            np.empty((0, *self.outshape), dtype=np.float64)
+        return self._to_tensor(out)
+
+    def _int2c(self, c_atm_bas_env: Optional[Tuple] = None, split: bool = True) -> np.ndarray:
         # performing 2-centre integrals with libcint
+        # the calculation is split along the shells of the second basis, which
+        # is the slowest index of the output
         drv = CGTO().GTOint2c
         outshape = self.outshape
-        out = np.empty((*outshape[:-2], outshape[-1], outshape[-2]), dtype=np.float64)
-        drv(self.op,
-            out.ctypes.data_as(ctypes.c_void_p),
-            ctypes.c_int(self.ncomp),
-            ctypes.c_int(0),  # do not assume hermitian
-            (ctypes.c_int * len(self.shls_slice))(*self.shls_slice),
-            np2ctypes(self.wrapper0.full_shell_to_aoloc),
-            self.optimizer,
-            np2ctypes(self.atm), int2ctypes(self.atm.shape[0]),
-            np2ctypes(self.bas), int2ctypes(self.bas.shape[0]),
-            np2ctypes(self.env))
-
+        ao_loc = self.wrapper0.full_shell_to_aoloc
+        i0, i1, j0, j1 = self.shls_slice
+        if c_atm_bas_env is None:
+            c_atm_bas_env = self.c_atm_bas_env
+
+        def calc(jshls: Tuple[int, int]) -> np.ndarray:
+            nj = ao_loc[jshls[1]] - ao_loc[jshls[0]]
+            out = np.empty((*outshape[:-2], nj, outshape[-2]), dtype=np.float64)
+            shls_slice = (i0, i1, *jshls)
+            drv(self.op,
+                out.ctypes.data_as(ctypes.c_void_p),
+                ctypes.c_int(self.ncomp),
+                ctypes.c_int(0),  # do not assume hermitian
+                (ctypes.c_int * len(shls_slice))(*shls_slice),
+                self.c_ao_loc,
+                self.optimizer,
+                *c_atm_bas_env)
+            return out
+
+        if split:
+            out = _concat(parallel_map(calc, split_shells(j0, j1, ao_loc)), axis=-2)
+        else:
+            out = calc((j0, j1))
         out = np.swapaxes(out, -2, -1)
         # TODO: check if we need to do the lines below for 3rd order grad and higher
         # if out.ndim > 2:
         #     out = np.moveaxis(out, -3, 0)
-        return self._to_tensor(out)
+        return out
 
     def _int3c(self) -> torch.Tensor:
         # performing 3-centre integrals with libcint
+        # the calculation is split along the shells of the third basis, which
+        # is the slowest index of the output
         drv = CGTO().GTOnr3c_drv
         fill = CGTO().GTOnr3c_fill_s1
         # TODO: create optimizer without the 3rd index like in
         # https://github.com/pyscf/pyscf/blob/e833b9a4fd5fb24a061721e5807e92c44bb66d06/pyscf/gto/moleintor.py#L538
         outsh = self.outshape
-        out = np.empty((*outsh[:-3], outsh[-1], outsh[-2], outsh[-3]), dtype=np.float64)
-        drv(self.op, fill,
-            out.ctypes.data_as(ctypes.c_void_p),
-            int2ctypes(self.ncomp),
-            (ctypes.c_int * len(self.shls_slice))(*self.shls_slice),
-            np2ctypes(self.wrapper0.full_shell_to_aoloc),
-            self.optimizer,
-            np2ctypes(self.atm), int2ctypes(self.atm.shape[0]),
-            np2ctypes(self.bas), int2ctypes(self.bas.shape[0]),
-            np2ctypes(self.env))
-
+        ao_loc = self.wrapper0.full_shell_to_aoloc
+        k0, k1 = self.shls_slice[4:6]
+
+        def calc(kshls: Tuple[int, int]) -> np.ndarray:
+            nk = ao_loc[kshls[1]] - ao_loc[kshls[0]]
+            out = np.empty((*outsh[:-3], nk, outsh[-2], outsh[-3]), dtype=np.float64)
+            shls_slice = (*self.shls_slice[:4], *kshls)
+            drv(self.op, fill,
+                out.ctypes.data_as(ctypes.c_void_p),
+                int2ctypes(self.ncomp),
+                (ctypes.c_int * len(shls_slice))(*shls_slice),
+                self.c_ao_loc,
+                self.optimizer,
+                *self.c_atm_bas_env)
+            return out
+
+        out = _concat(parallel_map(calc, split_shells(k0, k1, ao_loc)), axis=-3)
         out = np.swapaxes(out, -3, -1)
         return self._to_tensor(out)
 
     def _int4c(self) -> torch.Tensor:
         # performing 4-centre integrals with libcint
         symm = self.int_nmgr.get_intgl_symmetry(self.wrapper_uniqueness)
-        outshape = symm.get_reduced_shape(self.outshape)
+        if get_intor_nthreads() > 1 and symm.code == "s4":
+            return self._to_tensor(self._int4c_s4_blocks())
+
+        # without symmetry, the calculation is split along the shells of the
+        # first basis, which is the slowest index of the output
+        if symm.code == "s1":
+            i0, i1 = self.shls_slice[:2]
+            ishls_lst = split_shells(i0, i1, self.wrapper0.full_shell_to_aoloc)
+            outs = parallel_map(
+                lambda ishls: self._int4c_fill(symm, (*ishls, *self.shls_slice[2:])),
+                ishls_lst)
+            out = _concat(outs, axis=-4)
+        else:
+            out = self._int4c_fill(symm, self.shls_slice)
+        out = symm.reconstruct_array(out, self.outshape)
+        return self._to_tensor(out)
+
+    def _int4c_s4_blocks(self) -> np.ndarray:
+        # performing 4-centre integrals with (ij|kl) = (ji|kl) = (ij|lk) = (ji|lk)
+        # symmetry in the thread pool by splitting the shells into blocks and
+        # only calculating the blocks with I >= J and K >= L. The diagonal
+        # blocks (I == J or K == L) use the symmetry within the block, so the
+        # total work is the same as the single s4 call.
+        ao_loc = self.wrapper0.full_shell_to_aoloc
+        i0, i1 = self.shls_slice[:2]
+        k0, k1 = self.shls_slice[4:6]
+
+        # choose the number of blocks so there are enough tasks for all threads
+        nthreads = get_intor_nthreads()
+        nblocks = 2
+        while ((nblocks * (nblocks + 1)) // 2) ** 2 < 4 * nthreads:
+            nblocks += 1
+        iblocks = split_shells(i0, i1, ao_loc, nblocks)
+        kblocks = split_shells(k0, k1, ao_loc, nblocks)
+        tasks = [(bi, bj, bk, bl)
+                 for bi in range(len(iblocks)) for bj in range(bi + 1)
+                 for bk in range(len(kblocks)) for bl in range(bk + 1)]
+
+        def aoslice(shls: Tuple[int, int], shl0: int) -> slice:
+            return slice(ao_loc[shls[0]] - ao_loc[shl0], ao_loc[shls[1]] - ao_loc[shl0])
+
+        def calc(task: Tuple[int, int, int, int]) -> np.ndarray:
+            bi, bj, bk, bl = task
+            symm: BaseSymmetry
+            if bi == bj and bk == bl:
+                symm = S4Symmetry()
+            elif bi == bj:
+                symm = S2ijSymmetry()
+            elif bk == bl:
+                symm = S2klSymmetry()
+            else:
+                symm = S1Symmetry()
+            shls_slice = (*iblocks[bi], *iblocks[bj], *kblocks[bk], *kblocks[bl])
+            blkshape = (*self.outshape[:-4],
+                        *[ao_loc[shls_slice[2 * i + 1]] - ao_loc[shls_slice[2 * i]] for i in range(4)])
+            return symm.reconstruct_array(self._int4c_fill(symm, shls_slice), blkshape)
+
+        outs = parallel_map(calc, tasks)
+
+        # fill the full array from the blocks
+        out = np.empty(self.outshape, dtype=np.float64)
+        for (bi, bj, bk, bl), blk in zip(tasks, outs):
+            si = aoslice(iblocks[bi], i0)
+            sj = aoslice(iblocks[bj], i0)
+            sk = aoslice(kblocks[bk], k0)
+            sl = aoslice(kblocks[bl], k0)
+            blk_ji = np.swapaxes(blk, -4, -3)
+            out[..., si, sj, sk, sl] = blk
+            out[..., sj, si, sk, sl] = blk_ji
+            out[..., si, sj, sl, sk] = np.swapaxes(blk, -2, -1)
+            out[..., sj, si, sl, sk] = np.swapaxes(blk_ji, -2, -1)
+        return out
+
+    def _int4c_fill(self, symm: BaseSymmetry, shls_slice: Tuple[int, ...]) -> np.ndarray:
+        # performing 4-centre integrals of the given shells slice with libcint
+        ao_loc = self.wrapper0.full_shell_to_aoloc
+        outshape = symm.get_reduced_shape(
+            (*self.outshape[:-4],
+             *[ao_loc[shls_slice[2 * i + 1]] - ao_loc[shls_slice[2 * i]] for i in range(4)]))
 
         out = np.empty(outshape, dtype=np.float64)
 
@@ -677,35 +835,23 @@ class Intor(object):
         drv(self.op, fill, prescreen,
             out.ctypes.data_as(ctypes.c_void_p),
             ctypes.c_int(self.ncomp),
-            (ctypes.c_int * 8)(*self.shls_slice),
-            np2ctypes(self.wrapper0.full_shell_to_aoloc),
+            (ctypes.c_int * 8)(*shls_slice),
+            self.c_ao_loc,
             self.optimizer,
-            np2ctypes(self.atm), int2ctypes(self.atm.shape[0]),
-            np2ctypes(self.bas), int2ctypes(self.bas.shape[0]),
-            np2ctypes(self.env))
-
-        out = symm.reconstruct_array(out, self.outshape)
-        return self._to_tensor(out)
+            *self.c_atm_bas_env)
+        return out
 
     def _to_tensor(self, out: np.ndarray) -> torch.Tensor:
         # convert the numpy array to the appropriate tensor
         return torch.as_tensor(out, dtype=self.wrapper0.dtype,
                                device=self.wrapper0.device)
 
-def _get_intgl_optimizer(opname: str,
-                         atm: np.ndarray, bas: np.ndarray, env: np.ndarray)\
-                         -> ctypes.c_void_p:
-    # get the optimizer of the integrals
-    # setup the optimizer
-    cintopt = ctypes.POINTER(ctypes.c_void_p)()
-    optname = opname.replace("_cart", "").replace("_sph", "") + "_optimizer"
-    copt = getattr(CINT(), optname)
-    copt(ctypes.byref(cintopt),
-         np2ctypes(atm), int2ctypes(atm.shape[0]),
-         np2ctypes(bas), int2ctypes(bas.shape[0]),
-         np2ctypes(env))
-    opt = ctypes.cast(cintopt, _cintoptHandler)
-    return opt
+def _concat(outs: List[np.ndarray], axis: int) -> np.ndarray:
+    # concatenate the results from the thread pool, avoiding the copy if there
+    # is only one result
+    if len(outs) == 1:
+        return outs[0]
+    return np.concatenate(outs, axis=axis)
 
 ############### name derivation manager functions ###############
 def _get_integrals(int_nmgrs: List[IntorNameManager],
@@ -740,7 +886,7 @@ def _get_integrals(int_nmgrs: List[IntorNameManager],
                 if twrappers == wrappers:
                     res_i = _transpose(res[j], transpose_path)
                     permute_path = int_nmgrs[j].get_comp_permute_path(transpose_path)
-                    res_i = res_i.permute(*permute_path)
+                    res_i = _permute_last(res_i, permute_path)
                     break
 
                 # otherwise, use the swapped integral with the swapped wrappers,
@@ -750,7 +896,7 @@ def _get_integrals(int_nmgrs: List[IntorNameManager],
                     res_i = int_fcn(twrappers, int_nmgrs[j])
                     res_i = _transpose(res_i, transpose_path)
                     permute_path = int_nmgrs[j].get_comp_permute_path(transpose_path)
-                    res_i = res_i.permute(*permute_path)
+                    res_i = _permute_last(res_i, permute_path)
                     break
 
                 # if the integral is not available, then continue the searching
@@ -771,10 +917,13 @@ def _get_integrals(int_nmgrs: List[IntorNameManager],
         res.append(res_i)
 
     # move the new axes (if any) to dimension 0
+    # the integrals might have batch dimensions in front of the components
+    # (e.g. the centres of rinv), so the position is shifted by them
     assert res_i is not None
     for i in range(len(res)):
         if new_axes_pos[i] is not None:
-            res[i] = torch.movedim(res[i], new_axes_pos[i], 0)
+            nbatch = res[i].ndim - len(int_nmgrs[i].get_intgl_components_shape()) - len(wrappers)
+            res[i] = torch.movedim(res[i], new_axes_pos[i] + nbatch, 0)
 
     return res
 
@@ -784,6 +933,12 @@ def _transpose(a: torch.Tensor, axes: List[Tuple[int, int]]) -> torch.Tensor:
         a = a.transpose(*axis2)
     return a
 
+def _permute_last(a: torch.Tensor, path: List[int]) -> torch.Tensor:
+    # permute the last len(path) dimensions of the tensor, leaving the batch
+    # dimensions in front unchanged
+    nbatch = a.ndim - len(path)
+    return a.permute(*range(nbatch), *[p + nbatch for p in path])
+
 def _swap_list(a: List, swaps: List[Tuple[int, int]]) -> List:
     # swap the elements according to the swaps input
     res = copy.copy(a)  # shallow copy
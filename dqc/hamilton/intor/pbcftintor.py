@@ -15,6 +15,7 @@ from dqc.utils.types import get_complex_dtype
 from dqc.utils.pbc import estimate_ovlp_rcut
 from dqc.hamilton.intor.lattice import Lattice
 from dqc.hamilton.intor.namemgr import IntorNameManager
+from dqc.utils.profiler import stage_timer
 
 __all__ = ["pbcft_int1e", "pbcft_overlap"]
 
@@ -155,6 +156,7 @@ class PBCFTIntor(object):
         # this class is meant to be used once
         self.integral_done = False
 
+    @stage_timer("intor")
     def calc(self) -> torch.Tensor:
         assert not self.integral_done
         self.integral_done = True
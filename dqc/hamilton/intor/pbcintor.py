@@ -7,14 +7,15 @@ from dataclasses import dataclass
 from functools import reduce
 import numpy as np
 import torch
-from dqc.hamilton.intor.lcintwrap import LibcintWrapper
+from dqc.hamilton.intor.lcintwrap import LibcintWrapper, _get_intgl_optimizer
 from dqc.hamilton.intor.utils import np2ctypes, int2ctypes, CPBC, CGTO, NDIM, \
-                                     c_null_ptr
+                                     c_null_ptr, split_shells, parallel_map
 from dqc.utils.types import get_complex_dtype
 from dqc.utils.pbc import estimate_ovlp_rcut
 from dqc.hamilton.intor.lattice import Lattice
-from dqc.hamilton.intor.molintor import _check_and_set, _get_intgl_optimizer
+from dqc.hamilton.intor.molintor import _check_and_set
 from dqc.hamilton.intor.namemgr import IntorNameManager
+from dqc.utils.profiler import stage_timer
 
 __all__ = ["PBCIntOption", "pbc_int1e", "pbc_int3c2e",
            "pbc_overlap", "pbc_kinetic", "pbc_coul2c", "pbc_coul3c"]
@@ -311,6 +312,7 @@ class PBCIntor(object):
         # this class is meant to be used once
         self.integral_done = False
 
+    @stage_timer("intor")
     def calc(self) -> torch.Tensor:
         assert not self.integral_done
         self.integral_done = True
@@ -341,7 +343,6 @@ class PBCIntor(object):
         # prepare the output
         nkpts = len(self.kpts_inp_np)
         outshape = (nkpts,) + self.comp_shape + tuple(w.nao() for w in self.wrappers)
-        out = np.empty(outshape, dtype=np.complex128)
 
         # TODO: add symmetry here
         fill = CPBC().PBCnr2c_fill_ks1
@@ -358,18 +359,31 @@ class PBCIntor(object):
             warnings.warn("The number of neighbors in the integral is too many, "
                           "it might causes segfault")
 
-        # perform the integration
+        # perform the integration, split along the shells of the first basis
+        # in the thread pool
         drv = CPBC().PBCnr2c_drv
-        drv(fintor, fill, out.ctypes.data_as(ctypes.c_void_p),
-            int2ctypes(nkpts), int2ctypes(self.ncomp), int2ctypes(len(self.ls)),
-            np2ctypes(self.ls),
-            np2ctypes(expkl),
-            (ctypes.c_int * len(shls_slice))(*shls_slice),
-            np2ctypes(ao_loc),
-            cintopt, cpbcopt,
-            np2ctypes(atm), int2ctypes(atm.shape[0]),
-            np2ctypes(bas), int2ctypes(bas.shape[0]),
-            np2ctypes(env), int2ctypes(env.size))
+
+        def calc(ishls: Tuple[int, int]) -> np.ndarray:
+            # libpbc shifts the basis in-place, so every thread needs its own copy
+            atm_t, bas_t, env_t = (atm, bas, env) if ishls == (i0, i1) else \
+                (atm.copy(), bas.copy(), env.copy())
+            ni = ao_loc[ishls[1]] - ao_loc[ishls[0]]
+            out = np.empty((*outshape[:-2], ni, outshape[-1]), dtype=np.complex128)
+            shls_slice_t = (*ishls, *shls_slice[2:])
+            drv(fintor, fill, out.ctypes.data_as(ctypes.c_void_p),
+                int2ctypes(nkpts), int2ctypes(self.ncomp), int2ctypes(len(self.ls)),
+                np2ctypes(self.ls),
+                np2ctypes(expkl),
+                (ctypes.c_int * len(shls_slice_t))(*shls_slice_t),
+                np2ctypes(ao_loc),
+                cintopt, cpbcopt,
+                np2ctypes(atm_t), int2ctypes(atm_t.shape[0]),
+                np2ctypes(bas_t), int2ctypes(bas_t.shape[0]),
+                np2ctypes(env_t), int2ctypes(env_t.size))
+            return out
+
+        outs = parallel_map(calc, split_shells(i0, i1, ao_loc))
+        out = outs[0] if len(outs) == 1 else np.concatenate(outs, axis=-2)
 
         out_tensor = torch.as_tensor(out, dtype=get_complex_dtype(self.dtype),
                                      device=self.device)
@@ -397,7 +411,6 @@ class PBCIntor(object):
         # kpts is actually kpts_ij in this function
         nkpts_ij = len(self.kpts_inp_np)
         outshape = (nkpts_ij,) + self.comp_shape + tuple(w.nao() for w in self.wrappers)
-        out = np.empty(outshape, dtype=np.complex128)
 
         # get the unique k-points
         kpts_i = self.kpts_inp_np[:, 0, :]  # (nkpts, NDIM)
@@ -422,23 +435,36 @@ class PBCIntor(object):
         cintopt = c_null_ptr()  # _get_intgl_optimizer(self.opname, atm, bas, env)
         cpbcopt = c_null_ptr()
 
-        # do the integration
+        # do the integration, split along the shells of the first basis in the
+        # thread pool
         drv = CPBC().PBCnr3c_drv
         fill = CPBC().PBCnr3c_fill_kks1  # TODO: optimize the kk-type and symmetry
         fintor = getattr(CPBC(), self.opname)
-        drv(fintor, fill, np2ctypes(out),
-            int2ctypes(nkpts_ij),
-            int2ctypes(nkpts),
-            int2ctypes(self.ncomp), int2ctypes(len(self.ls)),
-            np2ctypes(self.ls),
-            np2ctypes(expkl),
-            np2ctypes(kpts_ij_idxs),
-            (ctypes.c_int * len(shls_slice))(*shls_slice),
-            np2ctypes(ao_loc),
-            cintopt, cpbcopt,
-            np2ctypes(atm), int2ctypes(atm.shape[0]),
-            np2ctypes(bas), int2ctypes(bas.shape[0]),
-            np2ctypes(env), int2ctypes(env.size))
+
+        def calc(ishls: Tuple[int, int]) -> np.ndarray:
+            # libpbc shifts the basis in-place, so every thread needs its own copy
+            atm_t, bas_t, env_t = (atm, bas, env) if ishls == (i0, i1) else \
+                (atm.copy(), bas.copy(), env.copy())
+            ni = ao_loc[ishls[1]] - ao_loc[ishls[0]]
+            out = np.empty((*outshape[:-3], ni, *outshape[-2:]), dtype=np.complex128)
+            shls_slice_t = (*ishls, *shls_slice[2:])
+            drv(fintor, fill, np2ctypes(out),
+                int2ctypes(nkpts_ij),
+                int2ctypes(nkpts),
+                int2ctypes(self.ncomp), int2ctypes(len(self.ls)),
+                np2ctypes(self.ls),
+                np2ctypes(expkl),
+                np2ctypes(kpts_ij_idxs),
+                (ctypes.c_int * len(shls_slice_t))(*shls_slice_t),
+                np2ctypes(ao_loc),
+                cintopt, cpbcopt,
+                np2ctypes(atm_t), int2ctypes(atm_t.shape[0]),
+                np2ctypes(bas_t), int2ctypes(bas_t.shape[0]),
+                np2ctypes(env_t), int2ctypes(env_t.size))
+            return out
+
+        outs = parallel_map(calc, split_shells(i0, i1, ao_loc))
+        out = outs[0] if len(outs) == 1 else np.concatenate(outs, axis=-3)
 
         out_tensor = torch.as_tensor(out, dtype=get_complex_dtype(self.dtype),
                                      device=self.device)
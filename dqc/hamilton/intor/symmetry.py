@@ -67,3 +67,45 @@ class S4Symmetry(BaseSymmetry):
         assert len(orig_shape) >= 4
         assert orig_shape[-4] == orig_shape[-3]
         assert orig_shape[-2] == orig_shape[-1]
+
+class S2ijSymmetry(BaseSymmetry):
+    # (...ijkl) == (...jikl)
+    def get_reduced_shape(self, orig_shape: Tuple[int, ...]) -> Tuple[int, ...]:
+        # the returned shape would be (..., i(j+1)/2, k, l)
+        assert len(orig_shape) >= 4
+        assert orig_shape[-4] == orig_shape[-3]
+        ijshape = orig_shape[-4] * (orig_shape[-3] + 1) // 2
+        return (*orig_shape[:-4], ijshape, *orig_shape[-2:])
+
+    @property
+    def code(self) -> str:
+        return "s2ij"
+
+    def reconstruct_array(self, arr: np.ndarray, orig_shape: Tuple[int, ...]) -> np.ndarray:
+        # arr: (..., ij/2, k, l), the pairs are the row-major lower triangle
+        out = np.empty(orig_shape, dtype=arr.dtype)
+        idx0, idx1 = np.tril_indices(orig_shape[-4])
+        out[..., idx0, idx1, :, :] = arr
+        out[..., idx1, idx0, :, :] = arr
+        return out
+
+class S2klSymmetry(BaseSymmetry):
+    # (...ijkl) == (...ijlk)
+    def get_reduced_shape(self, orig_shape: Tuple[int, ...]) -> Tuple[int, ...]:
+        # the returned shape would be (..., i, j, k(l+1)/2)
+        assert len(orig_shape) >= 4
+        assert orig_shape[-2] == orig_shape[-1]
+        klshape = orig_shape[-2] * (orig_shape[-1] + 1) // 2
+        return (*orig_shape[:-2], klshape)
+
+    @property
+    def code(self) -> str:
+        return "s2kl"
+
+    def reconstruct_array(self, arr: np.ndarray, orig_shape: Tuple[int, ...]) -> np.ndarray:
+        # arr: (..., i, j, kl/2), the pairs are the row-major lower triangle
+        out = np.empty(orig_shape, dtype=arr.dtype)
+        idx0, idx1 = np.tril_indices(orig_shape[-2])
+        out[..., idx0, idx1] = arr
+        out[..., idx1, idx0] = arr
+        return out
@@ -1,13 +1,21 @@
 import ctypes
 import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
 import dqclibs
 import numpy as np
+import torch
+from dqc.utils.config import config
 
 # contains functions and constants that are used specifically for
 # dqc.hamilton.intor files (no dependance on other files in dqc.hamilton.intor
 # is required)
 
-__all__ = ["NDIM", "CINT", "CGTO", "CPBC", "CSYMM", "c_null_ptr", "np2ctypes", "int2ctypes"]
+__all__ = ["NDIM", "CINT", "CGTO", "CPBC", "CSYMM", "c_null_ptr", "np2ctypes", "int2ctypes",
+           "get_intor_nthreads", "split_shells", "parallel_map", "get_cached_deriv"]
+
+T = TypeVar("T")
+P = TypeVar("P")
 
 # CONSTANTS
 NDIM = 3
@@ -27,3 +35,70 @@ def np2ctypes(a: np.ndarray) -> ctypes.c_void_p:
 def int2ctypes(a: int) -> ctypes.c_int:
     # convert the python's integer to ctypes' integer
     return ctypes.c_int(a)
+
+################### threading ###################
+# the thread pools are kept alive to avoid the overhead of creating the threads
+# for every integral, the calls to the libraries release the GIL so the
+# threads can run concurrently
+_thread_pools: Dict[int, ThreadPoolExecutor] = {}
+
+def get_intor_nthreads() -> int:
+    # returns the number of threads to evaluate the integrals
+    nthreads = config.INTOR_NTHREADS
+    if nthreads <= 0:
+        nthreads = torch.get_num_threads()
+    return max(nthreads, 1)
+
+def split_shells(shl0: int, shl1: int, ao_loc: np.ndarray,
+                 nparts: Optional[int] = None) -> List[Tuple[int, int]]:
+    # split the shell range [shl0, shl1) into at most nparts contiguous ranges
+    # with roughly the same number of atomic orbitals
+    # if nparts is not given, then it is chosen to be more than the number of
+    # threads to balance the load in the thread pool
+    if nparts is None:
+        nthreads = get_intor_nthreads()
+        nparts = 1 if nthreads <= 1 else 4 * nthreads
+    nparts = max(min(nparts, shl1 - shl0), 1)
+    ao0 = ao_loc[shl0]
+    nao = ao_loc[shl1] - ao0
+    res: List[Tuple[int, int]] = []
+    istart = shl0
+    for ipart in range(1, nparts):
+        # the first shell which starts after the ao boundary of this part
+        ao_bound = ao0 + (nao * ipart) // nparts
+        iend = int(np.searchsorted(ao_loc[shl0:shl1 + 1], ao_bound, side="left")) + shl0
+        iend = min(max(iend, istart + 1), shl1)
+        if iend >= shl1:
+            break
+        res.append((istart, iend))
+        istart = iend
+    res.append((istart, shl1))
+    return res
+
+def parallel_map(fcn: Callable[[P], T], args: Sequence[P]) -> List[T]:
+    # apply the function to all the arguments in the thread pool and returns
+    # the results in the same order as the arguments
+    nthreads = min(get_intor_nthreads(), len(args))
+    if nthreads <= 1:
+        return [fcn(arg) for arg in args]
+    if nthreads not in _thread_pools:
+        _thread_pools[nthreads] = ThreadPoolExecutor(max_workers=nthreads)
+    return list(_thread_pools[nthreads].map(fcn, args))
+
+################### derivative caching ###################
+def get_cached_deriv(ctx: Any, key: str, fcn: Callable[[], T]) -> T:
+    # returns the derivative integrals calculated by fcn in the backward of
+    # autograd function. If config.CACHE_DERIV_INTEGRALS is set, the results
+    # are stored in the autograd context, ctx, with the given key, so they
+    # are only calculated once for the same forward calculation.
+    # The derivatives calculated without the graph (e.g. in the first order
+    # backward) must not be used in the backward that builds the graph for
+    # the higher order derivatives, so the grad mode is part of the key
+    if not config.CACHE_DERIV_INTEGRALS:
+        return fcn()
+    if not hasattr(ctx, "deriv_cache"):
+        ctx.deriv_cache = {}
+    cache_key = (key, torch.is_grad_enabled())
+    if cache_key not in ctx.deriv_cache:
+        ctx.deriv_cache[cache_key] = fcn()
+    return ctx.deriv_cache[cache_key]
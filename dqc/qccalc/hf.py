@@ -6,9 +6,28 @@ import xitorch.optimize
 from dqc.system.base_system import BaseSystem
 from dqc.qccalc.scf_qccalc import SCF_QCCalc, BaseSCFEngine
 from dqc.utils.datastruct import SpinParam
+from dqc.utils.misc import set_default_option, logger
+from dqc.utils.profiler import stage_timer
+from dqc.utils.smearing import get_smearing_occ
 
 __all__ = ["HF"]
 
+# default options for the "lobpcg" method in eigen_options
+_LOBPCG_DEFOPT: Dict[str, Any] = {
+    "tol": 1e-9,  # maximum residual norm of the eigenvectors
+    "max_niter": 100,  # maximum number of iterations before falling back to dense
+    "min_nao": 200,  # the dense eigendecomposition is used below this size
+}
+
+# default options for the "purification" method in eigen_options
+_PURIFICATION_DEFOPT: Dict[str, Any] = {
+    "scheme": "trs4",  # "trs4" (trace-resetting), "canonical", or "mcweeny"
+    "tol": 1e-11,  # maximum idempotency error, tr(P - P^2)
+    "max_niter": 100,  # maximum number of iterations before falling back to diagonalization
+    "threshold": 0.0,  # the matrix elements below this are truncated to zero
+    "mu": None,  # the chemical potential, required for the "mcweeny" scheme
+}
+
 class HF(SCF_QCCalc):
     """
     Performing Restricted or Unrestricted Kohn-Sham DFT calculation.
@@ -64,10 +83,15 @@ class _HFEngine(BaseSCFEngine):
         self._orb_weight = system.get_orbweight(polarized=self._polarized)  # (norb,)
         self._norb = SpinParam.apply_fcn(lambda orb_weight: int(orb_weight.shape[-1]),
                                          self._orb_weight)
+        self._smearing = system.get_smearing()
 
         # set up the 1-electron linear operator
         self._core1e_linop = self._hamilton.get_kinnucl()  # kinetic and nuclear
 
+        # eigenvectors of the last diagonalization of every spin channel, used
+        # as the initial guess of the iterative eigensolver
+        self._eigvecs_guess: Dict[str, torch.Tensor] = {}
+
     def get_system(self) -> BaseSystem:
         return self._system
 
@@ -92,25 +116,27 @@ class _HFEngine(BaseSCFEngine):
 
     def dm2scp(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> torch.Tensor:
         # convert from density matrix to a self-consistent parameter (scp)
-        if isinstance(dm, torch.Tensor):  # unpolarized
-            # scp is the fock matrix
-            return self.__dm2fock(dm).fullmatrix()
-        else:  # polarized
-            # scp is the concatenated fock matrix
-            fock = self.__dm2fock(dm)
-            mat_u = fock.u.fullmatrix().unsqueeze(0)
-            mat_d = fock.d.fullmatrix().unsqueeze(0)
-            return torch.cat((mat_u, mat_d), dim=0)
+        with stage_timer("fock"):
+            if isinstance(dm, torch.Tensor):  # unpolarized
+                # scp is the fock matrix
+                return self.__dm2fock(dm).fullmatrix()
+            else:  # polarized
+                # scp is the concatenated fock matrix
+                fock = self.__dm2fock(dm)
+                mat_u = fock.u.fullmatrix().unsqueeze(0)
+                mat_d = fock.d.fullmatrix().unsqueeze(0)
+                return torch.cat((mat_u, mat_d), dim=0)
 
     def scp2dm(self, scp: torch.Tensor) -> Union[torch.Tensor, SpinParam[torch.Tensor]]:
         # scp is like KS, using the concatenated Fock matrix
-        if not self._polarized:
-            fock = xt.LinearOperator.m(_symm(scp), is_hermitian=True)
-            return self.__fock2dm(fock)
-        else:
-            fock_u = xt.LinearOperator.m(_symm(scp[0]), is_hermitian=True)
-            fock_d = xt.LinearOperator.m(_symm(scp[1]), is_hermitian=True)
-            return self.__fock2dm(SpinParam(u=fock_u, d=fock_d))
+        with stage_timer("diag"):
+            if not self._polarized:
+                fock = xt.LinearOperator.m(_symm(scp), is_hermitian=True)
+                return self.__fock2dm(fock)
+            else:
+                fock_u = xt.LinearOperator.m(_symm(scp[0]), is_hermitian=True)
+                fock_d = xt.LinearOperator.m(_symm(scp[1]), is_hermitian=True)
+                return self.__fock2dm(SpinParam(u=fock_u, d=fock_d))
 
     def scp2scp(self, scp: torch.Tensor) -> torch.Tensor:
         # self-consistent iteration step from a self-consistent parameter (scp)
@@ -162,6 +188,7 @@ class _HFEngine(BaseSCFEngine):
     def set_eigen_options(self, eigen_options: Dict[str, Any]) -> None:
         # set the eigendecomposition (diagonalization) option
         self.eigen_options = eigen_options
+        self._eigvecs_guess = {}
 
     def dm2energy(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> torch.Tensor:
         # calculate the energy given the density matrix
@@ -195,8 +222,8 @@ class _HFEngine(BaseSCFEngine):
     def __dm2vhf(self, dm):
         # from density matrix, returns the linear operator on electron-electron
         # coulomb and exchange
-        elrep = self._hamilton.get_elrep(SpinParam.sum(dm))
-        exch = self._hamilton.get_exchange(dm)
+        with stage_timer("JK"):
+            elrep, exch = self._hamilton.get_elrep_exchange(dm)
         vhf = SpinParam.apply_fcn(lambda exch: elrep + exch, exch)
         return vhf
 
@@ -210,11 +237,69 @@ class _HFEngine(BaseSCFEngine):
 
     def __fock2dm(self, fock):
         # diagonalize the fock matrix and obtain the density matrix
+        if self._smearing is not None:
+            if isinstance(fock, SpinParam):
+                assert isinstance(self._orb_weight, SpinParam)
+                return SpinParam(u=self.__smeared_fock2dm(fock.u, self._orb_weight.u, "u"),
+                                 d=self.__smeared_fock2dm(fock.d, self._orb_weight.d, "d"))
+            return self.__smeared_fock2dm(fock, self._orb_weight, "")
+        if self.eigen_options.get("method", None) == "purification":
+            return SpinParam.apply_fcn(self.__purify_fock2dm, fock, self._orb_weight)
         eigvals, eigvecs = self.diagonalize(fock, self._norb)
         dm = SpinParam.apply_fcn(lambda eivecs, orb_weights: self._hamilton.ao_orb2dm(eivecs, orb_weights),
                                  eigvecs, self._orb_weight)
         return dm
 
+    def __smeared_fock2dm(self, fock: xt.LinearOperator, orb_weight: torch.Tensor,
+                          key: str) -> torch.Tensor:
+        # obtain the density matrix of a spin channel with the smeared
+        # occupations of all the orbitals. The chemical potential is chosen
+        # such that the number of electrons in the spin channel is kept and it
+        # is shared by all the k-points (if any).
+        assert self._smearing is not None
+        method, width = self._smearing
+        nao = fock.shape[-1]
+        eivals, eivecs = self.__symeig(fock, nao, self._hamilton.get_overlap(), key)
+        maxocc = 1.0 if self._polarized else 2.0
+        occ = get_smearing_occ(eivals, orb_weight.sum(), maxocc, method, width, wkpts=self._hamilton.wkpts)
+        return self._hamilton.ao_orb2dm(eivecs, occ)
+
+    def __purify_fock2dm(self, fock: xt.LinearOperator, orb_weight: torch.Tensor) -> torch.Tensor:
+        # obtain the density matrix of a spin channel by the purification of
+        # the fock matrix in the orthonormal basis, without diagonalization.
+        # The purification is made of matrix products only, so the density
+        # matrix stays differentiable w.r.t. the fock matrix.
+        # It falls back to the diagonalization if the occupations are not
+        # uniform, the matrix is batched or complex, or it does not converge
+        # (e.g. if there is no gap between the occupied and virtual orbitals).
+        ovlp = self._hamilton.get_overlap()
+        norb = int(orb_weight.shape[-1])
+        nao = fock.shape[-1]
+        uniform = len(orb_weight.shape) == 1 and 0 < norb < nao and \
+            bool(torch.all(orb_weight == orb_weight[0]))
+        if uniform and len(fock.shape) == 2 and not fock.dtype.is_complex:
+            opts = set_default_option(_PURIFICATION_DEFOPT, self.eigen_options)
+            f = fock.fullmatrix()
+            s = ovlp.fullmatrix()
+            # the basis of the hamiltonian is normally already orthonormalized,
+            # otherwise use the Lowdin orthogonalization
+            if torch.allclose(s, torch.eye(nao, dtype=s.dtype, device=s.device)):
+                x: Optional[torch.Tensor] = None
+            else:
+                s_evals, s_evecs = torch.linalg.eigh(s)
+                x = torch.matmul(s_evecs * s_evals.rsqrt(), s_evecs.transpose(-2, -1))
+                f = torch.matmul(x, torch.matmul(f, x))
+            p = _purify(f, norb, scheme=opts["scheme"], tol=opts["tol"], max_niter=opts["max_niter"],
+                        threshold=opts["threshold"], mu=opts["mu"])
+            if p is not None:
+                if x is not None:
+                    p = torch.matmul(x, torch.matmul(p, x))
+                return p * orb_weight[0]
+            logger.log("Purification does not converge, falling back to the diagonalization")
+
+        eivals, eivecs = xitorch.linalg.lsymeig(A=fock, neig=norb, M=ovlp, method="exacteig")
+        return self._hamilton.ao_orb2dm(eivecs, orb_weight)
+
     @overload
     def diagonalize(self, fock: xt.LinearOperator, norb: int) -> Tuple[torch.Tensor, torch.Tensor]:
         ...
@@ -228,23 +313,46 @@ class _HFEngine(BaseSCFEngine):
         ovlp = self._hamilton.get_overlap()
         if isinstance(fock, SpinParam):
             assert isinstance(self._norb, SpinParam)
-            eivals_u, eivecs_u = xitorch.linalg.lsymeig(
-                A=fock.u,
-                neig=norb.u,
-                M=ovlp,
-                **self.eigen_options)
-            eivals_d, eivecs_d = xitorch.linalg.lsymeig(
-                A=fock.d,
-                neig=norb.d,
-                M=ovlp,
-                **self.eigen_options)
+            eivals_u, eivecs_u = self.__symeig(fock.u, norb.u, ovlp, "u")
+            eivals_d, eivecs_d = self.__symeig(fock.d, norb.d, ovlp, "d")
             return SpinParam(u=eivals_u, d=eivals_d), SpinParam(u=eivecs_u, d=eivecs_d)
         else:
-            return xitorch.linalg.lsymeig(
-                A=fock,
-                neig=norb,
-                M=ovlp,
-                **self.eigen_options)
+            return self.__symeig(fock, norb, ovlp, "")
+
+    def __symeig(self, fock: xt.LinearOperator, norb: int, ovlp: xt.LinearOperator,
+                 key: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        # get the lowest norb eigenpairs of the fock matrix.
+        # With the "lobpcg" method, the eigenpairs in the self-consistent
+        # iterations are obtained iteratively starting from the eigenvectors
+        # of the previous iteration (with some buffer vectors above the occupied
+        # states). The dense eigendecomposition is used if the gradient is
+        # required, there is no initial guess, the matrix is small, or the
+        # iterations do not converge.
+        method = self.eigen_options.get("method", None)
+        if method == "purification":
+            # the orbitals are only obtained by the explicit diagonalization
+            return xitorch.linalg.lsymeig(A=fock, neig=norb, M=ovlp, method="exacteig")
+        elif method != "lobpcg":
+            return xitorch.linalg.lsymeig(A=fock, neig=norb, M=ovlp, **self.eigen_options)
+
+        opts = set_default_option(_LOBPCG_DEFOPT, self.eigen_options)
+        nao = fock.shape[-1]
+        nguess = min(norb + max(norb // 4, 4), nao)
+        if torch.is_grad_enabled() or len(fock.shape) > 2 or norb == 0:
+            return xitorch.linalg.lsymeig(A=fock, neig=norb, M=ovlp, method="exacteig")
+
+        guess = self._eigvecs_guess.get(key, None)
+        if nao >= opts["min_nao"] and guess is not None and guess.shape == (nao, nguess):
+            res = _lobpcg(fock.fullmatrix(), ovlp.fullmatrix(), guess, norb,
+                          tol=opts["tol"], max_niter=opts["max_niter"])
+            if res is not None:
+                self._eigvecs_guess[key] = res[2]
+                return res[0], res[1]
+            logger.log("LOBPCG does not converge, falling back to the dense eigendecomposition")
+
+        eivals, eivecs = xitorch.linalg.lsymeig(A=fock, neig=nguess, M=ovlp, method="exacteig")
+        self._eigvecs_guess[key] = eivecs
+        return eivals[..., :norb], eivecs[..., :norb]
 
     def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
         if methodname == "scp2scp":
@@ -299,3 +407,154 @@ class _HFEngine(BaseSCFEngine):
 def _symm(scp: torch.Tensor):
     # forcely symmetrize the tensor
     return (scp + scp.transpose(-2, -1)) * 0.5
+
+def _lobpcg(a: torch.Tensor, b: torch.Tensor, x: torch.Tensor, neig: int,
+            tol: float, max_niter: int) -> Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+    # locally optimal block preconditioned conjugate gradient for the lowest
+    # neig eigenpairs of a.x = b.x.e starting from the initial guess x, the
+    # columns of x above neig are buffer vectors to speed up the convergence.
+    # The search space is the block, its residuals preconditioned with the
+    # diagonal of a - e * b (Davidson's correction), and the conjugate directions.
+    # a, b: (nao, nao), x: (nao, nguess)
+    # returns the eigenvalues (neig,), the eigenvectors (nao, neig), and the
+    # whole block (nao, nguess), or None if it does not converge
+    diag_a = torch.diagonal(a)
+    diag_b = torch.diagonal(b)
+    x = _borthogonalize(x, b)
+    nguess = x.shape[-1]
+    if nguess < neig:
+        return None
+    p: Optional[torch.Tensor] = None
+    for i in range(max_niter):
+        # Rayleigh-Ritz in the block
+        ax = torch.matmul(a, x)
+        bx = torch.matmul(b, x)
+        evals, c = torch.linalg.eigh(_symm(torch.matmul(x.transpose(-2, -1), ax)))
+        x = torch.matmul(x, c)
+        ax = torch.matmul(ax, c)
+        bx = torch.matmul(bx, c)
+
+        # check the convergence of the wanted eigenpairs
+        resid = ax - bx * evals
+        if float(resid[:, :neig].norm(dim=0).max()) < tol:
+            return evals[:neig], x[:, :neig], x
+
+        # preconditioned residuals, avoiding the division by 0
+        denom = diag_a.unsqueeze(-1) - diag_b.unsqueeze(-1) * evals
+        denom = torch.where(denom.abs() < 1e-4, torch.full_like(denom, 1e-4), denom)
+        w = resid / denom
+        wp = w if p is None else torch.cat((w, p), dim=-1)
+
+        # orthogonalize the new directions against the block and themselves
+        for _ in range(2):
+            wp = wp - torch.matmul(x, torch.matmul(bx.transpose(-2, -1), wp))
+        wp = _borthogonalize(wp, b)
+
+        # Rayleigh-Ritz in the search space, taking the conjugate directions as
+        # the components of the new block from the new directions
+        s = torch.cat((x, wp), dim=-1)
+        _, c = torch.linalg.eigh(_symm(torch.matmul(s.transpose(-2, -1), torch.matmul(a, s))))
+        c = c[:, :nguess]
+        p = torch.matmul(wp, c[nguess:])
+        x = torch.matmul(s, c)
+    return None
+
+def _borthogonalize(v: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+    # orthonormalize the columns of v w.r.t. the metric b, the linearly
+    # dependent columns are removed. It is done twice for numerical stability.
+    for _ in range(2):
+        v = v / v.norm(dim=0, keepdim=True).clamp(min=1e-300)
+        gram = _symm(torch.matmul(v.transpose(-2, -1), torch.matmul(b, v)))
+        evals, evecs = torch.linalg.eigh(gram)
+        idx = evals > evals.max() * 1e-10
+        v = torch.matmul(v, evecs[:, idx] / evals[idx].sqrt())
+    return v
+
+def _purify(f: torch.Tensor, nocc: int, scheme: str, tol: float, max_niter: int,
+            threshold: float = 0.0, mu: Optional[float] = None) -> Optional[torch.Tensor]:
+    # density matrix purification: returns the projector to the subspace of
+    # the lowest nocc eigenvectors of the symmetric matrix f (in an orthonormal
+    # basis) from matrix polynomials, or None if it does not converge.
+    # The schemes are:
+    # * "trs4": trace-resetting quartic purification (Niklasson, et al.,
+    #   J. Chem. Phys. 118 (2003) 8611)
+    # * "canonical": canonical purification (Palser & Manolopoulos, Phys. Rev.
+    #   B 58 (1998) 12704)
+    # * "mcweeny": grand-canonical McWeeny purification at the given chemical
+    #   potential, mu, which must lie in the gap
+    # The polynomial coefficients are taken as constants, so the derivative of
+    # the projector converges to the derivative of the exact projector.
+    # If threshold > 0, the small elements of the matrix products are set to
+    # zero to keep the matrices sparse.
+    # f: (n, n)
+    n = f.shape[-1]
+    eye = torch.eye(n, dtype=f.dtype, device=f.device)
+
+    def trace(a: torch.Tensor) -> float:
+        return float(torch.trace(a.detach()))
+
+    def matmul(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+        c = torch.matmul(a, b)
+        if threshold > 0:
+            c = torch.where(c.abs() < threshold, torch.zeros_like(c), c)
+        return c
+
+    # the bounds of the spectrum from the Gershgorin's circles
+    fdiag = torch.diagonal(f.detach())
+    radius = f.detach().abs().sum(dim=-1) - fdiag.abs()
+    emin = float((fdiag - radius).min())
+    emax = float((fdiag + radius).max())
+    if emax - emin <= 0:
+        return None
+
+    # initial guess whose eigenvalues are within [0, 1] with the occupied
+    # states having the larger values
+    if scheme == "trs4":
+        p = (emax * eye - f) / (emax - emin)
+    elif scheme == "canonical":
+        fmean = trace(f) / n
+        lmbda = min(nocc / max(emax - fmean, 1e-300), (n - nocc) / max(fmean - emin, 1e-300))
+        p = (lmbda / n) * (fmean * eye - f) + (nocc / n) * eye
+    elif scheme == "mcweeny":
+        if mu is None:
+            raise ValueError("The chemical potential, mu, must be given for the mcweeny purification")
+        if not (emin < mu < emax):
+            return None
+        beta = 1.0 / max(emax - mu, mu - emin)
+        p = 0.5 * eye + (0.5 * beta) * (mu * eye - f)
+    else:
+        raise ValueError("Unknown purification scheme: %s" % scheme)
+
+    for i in range(max_niter):
+        p2 = matmul(p, p)
+        idem_err = trace(p - p2)
+        if abs(idem_err) < tol:
+            # the grand-canonical scheme does not conserve the trace, so check
+            # that mu is in the gap
+            if scheme == "mcweeny" and abs(trace(p) - nocc) > 0.5:
+                return None
+            return p
+
+        if scheme == "trs4":
+            p3 = matmul(p2, p)
+            p4 = matmul(p2, p2)
+            fp = 4 * p3 - 3 * p4  # P^2 (4P - 3P^2)
+            gp = p2 - 2 * p3 + p4  # P^2 (1 - P)^2
+            trg = trace(gp)
+            gamma = (nocc - trace(fp)) / trg if trg != 0 else 0.0
+            if gamma > 6:
+                p = 2 * p - p2
+            elif gamma < 0:
+                p = p2
+            else:
+                p = fp + gamma * gp
+        elif scheme == "canonical":
+            p3 = matmul(p2, p)
+            c = trace(p2 - p3) / idem_err
+            if c >= 0.5:
+                p = ((1 + c) * p2 - p3) / c
+            else:
+                p = ((1 - 2 * c) * p + (1 + c) * p2 - p3) / (1 - c)
+        else:  # mcweeny
+            p = 3 * p2 - 2 * matmul(p2, p)
+    return None
@@ -9,6 +9,7 @@ from dqc.qccalc.hf import _HFEngine
 from dqc.xc.base_xc import BaseXC
 from dqc.api.getxc import get_xc
 from dqc.utils.datastruct import SpinParam
+from dqc.utils.profiler import stage_timer
 
 __all__ = ["KS"]
 
@@ -85,6 +86,14 @@ class _KSEngine(BaseSCFEngine):
         # set up the vext linear operator
         self.knvext_linop = self.hamilton.get_kinnucl()  # kinetic, nuclear, and external potential
 
+        # the xc energy and potential of the last density matrix
+        self._xc_cache: Optional[Tuple[Tuple[torch.Tensor, ...], Tuple[int, ...], Any]] = None
+
+        # the exact exchange coefficients (alpha, beta, omega) for the hybrid
+        # functionals, where the exchange operator is alpha * K + beta * K_lr
+        self._exx_coeffs = self.xc.exx_coeffs if self.xc is not None else (0.0, 0.0, 0.0)
+        self._hybrid = bool(self._exx_coeffs[0] != 0 or self._exx_coeffs[1] != 0)
+
     def get_system(self) -> BaseSystem:
         return self._system
 
@@ -109,15 +118,16 @@ class _KSEngine(BaseSCFEngine):
 
     def dm2scp(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> torch.Tensor:
         # convert from density matrix to a self-consistent parameter (scp)
-        if isinstance(dm, torch.Tensor):  # unpolarized
-            # scp is the fock matrix
-            return self.__dm2fock(dm).fullmatrix()
-        else:  # polarized
-            # scp is the concatenated fock matrix
-            fock = self.__dm2fock(dm)
-            mat_u = fock.u.fullmatrix().unsqueeze(0)
-            mat_d = fock.d.fullmatrix().unsqueeze(0)
-            return torch.cat((mat_u, mat_d), dim=0)
+        with stage_timer("fock"):
+            if isinstance(dm, torch.Tensor):  # unpolarized
+                # scp is the fock matrix
+                return self.__dm2fock(dm).fullmatrix()
+            else:  # polarized
+                # scp is the concatenated fock matrix
+                fock = self.__dm2fock(dm)
+                mat_u = fock.u.fullmatrix().unsqueeze(0)
+                mat_d = fock.d.fullmatrix().unsqueeze(0)
+                return torch.cat((mat_u, mat_d), dim=0)
 
     def scp2dm(self, scp: torch.Tensor) -> Union[torch.Tensor, SpinParam[torch.Tensor]]:
         # convert the self-consistent parameter (scp) to the density matrix
@@ -158,9 +168,19 @@ class _KSEngine(BaseSCFEngine):
         # calculate the energy given the density matrix
         dmtot = SpinParam.sum(dm)
         e_core = self.hamilton.get_e_hcore(dmtot)
-        e_elrep = self.hamilton.get_e_elrep(dmtot)
+        if self._hybrid:
+            # the coulomb and the exact exchange energies, 0.5 * tr((J + K) D)
+            vhf = self.__dm2vhf(dm)
+            e_elrep = SpinParam.sum(SpinParam.apply_fcn(
+                lambda vhf_, dm_: 0.5 * torch.einsum("...ij,...ji->...", vhf_.fullmatrix(), dm_),
+                vhf, dm))
+        else:
+            e_elrep = self.hamilton.get_e_elrep(dmtot)
         if self.xc is not None:
-            e_xc: Union[torch.Tensor, float] = self.hamilton.get_e_xc(dm)
+            if torch.is_grad_enabled():
+                e_xc: Union[torch.Tensor, float] = self.hamilton.get_e_xc(dm)
+            else:
+                e_xc = self.__get_e_xc_vxc(dm)[0]
         else:
             e_xc = 0.0
         return e_core + e_elrep + e_xc + self._system.get_nuclei_energy()
@@ -174,17 +194,73 @@ class _KSEngine(BaseSCFEngine):
         ...
 
     def __dm2fock(self, dm):
-        elrep = self.hamilton.get_elrep(SpinParam.sum(dm))  # (..., nao, nao)
-        core_coul = self.knvext_linop + elrep
+        if self._hybrid:
+            vhf = self.__dm2vhf(dm)  # spin param or tensor (..., nao, nao)
+            core_coul = SpinParam.apply_fcn(lambda vhf_: self.knvext_linop + vhf_, vhf)
+        else:
+            with stage_timer("J"):
+                elrep = self.hamilton.get_elrep(SpinParam.sum(dm))  # (..., nao, nao)
+            core_coul = self.knvext_linop + elrep
+            if isinstance(dm, SpinParam):
+                core_coul = SpinParam(u=core_coul, d=core_coul)
 
         if self.xc is not None:
-            vxc = self.hamilton.get_vxc(dm)  # spin param or tensor (..., nao, nao)
-            return SpinParam.apply_fcn(lambda vxc_: vxc_ + core_coul, vxc)
+            with stage_timer("XC"):
+                if torch.is_grad_enabled():
+                    vxc = self.hamilton.get_vxc(dm)  # spin param or tensor (..., nao, nao)
+                else:
+                    vxc = self.__get_e_xc_vxc(dm)[1]
+            return SpinParam.apply_fcn(lambda vxc_, core_coul_: vxc_ + core_coul_, vxc, core_coul)
         else:
-            if isinstance(dm, SpinParam):
-                return SpinParam(u=core_coul, d=core_coul)
-            else:
-                return core_coul
+            return core_coul
+
+    @overload
+    def __dm2vhf(self, dm: torch.Tensor) -> xt.LinearOperator:
+        ...
+
+    @overload
+    def __dm2vhf(self, dm: SpinParam[torch.Tensor]) -> SpinParam[xt.LinearOperator]:
+        ...
+
+    def __dm2vhf(self, dm):
+        # the coulomb and the exact exchange operators of the hybrid functionals,
+        # the coulomb and the full-range exchange are obtained from the same
+        # sweep over the electron repulsion integrals
+        alpha, beta, omega = self._exx_coeffs
+        if alpha != 0:
+            with stage_timer("JK"):
+                elrep, exch = self.hamilton.get_elrep_exchange(dm)
+            vhf = SpinParam.apply_fcn(lambda exch_: elrep + _scale_linop(exch_, alpha), exch)
+        else:
+            with stage_timer("J"):
+                elrep = self.hamilton.get_elrep(SpinParam.sum(dm))
+            vhf = SpinParam(u=elrep, d=elrep) if isinstance(dm, SpinParam) else elrep
+
+        if beta != 0:
+            with stage_timer("K"):
+                exch_lr = self.hamilton.get_exchange(dm, omega=omega)
+            vhf = SpinParam.apply_fcn(lambda vhf_, exch_lr_: vhf_ + _scale_linop(exch_lr_, beta),
+                                      vhf, exch_lr)
+        return vhf
+
+    def __get_e_xc_vxc(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> Tuple[torch.Tensor, Any]:
+        # calculate the xc energy and the vxc linear operator from a single xc
+        # evaluation, the results are memoized for the last density matrix, so
+        # the energy and the fock matrix of the same density matrix only
+        # evaluate the xc once.
+        # This is only used if the gradient is not required, because keeping
+        # the graph in the engine creates a reference cycle with the engine
+        # (see the docstring of this class)
+        dms = (dm.u, dm.d) if isinstance(dm, SpinParam) else (dm,)
+        versions = tuple(dm_._version for dm_ in dms)
+        if self._xc_cache is not None:
+            cdms, cversions, res = self._xc_cache
+            if len(cdms) == len(dms) and all(a is b for (a, b) in zip(cdms, dms)) and cversions == versions:
+                return res
+
+        res = self.hamilton.get_e_xc_vxc(dm)
+        self._xc_cache = (dms, versions, res)
+        return res
 
     def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
         if methodname == "scp2scp":
@@ -208,8 +284,13 @@ class _KSEngine(BaseSCFEngine):
             else:
                 e_xc_params = []
 
+            if self._hybrid:
+                e_elrep_params = self.getparamnames("__dm2vhf", prefix=prefix)
+            else:
+                e_elrep_params = self.hamilton.getparamnames("get_e_elrep", prefix=hprefix)
+
             return self.hamilton.getparamnames("get_e_hcore", prefix=hprefix) + \
-                self.hamilton.getparamnames("get_e_elrep", prefix=hprefix) + \
+                e_elrep_params + \
                 e_xc_params + \
                 self._system.getparamnames("get_nuclei_energy", prefix=sprefix)
         elif methodname == "__dm2fock":
@@ -220,9 +301,22 @@ class _KSEngine(BaseSCFEngine):
             else:
                 vxc_params = []
 
-            return self.hamilton.getparamnames("get_elrep", prefix=hprefix) + \
+            if self._hybrid:
+                vhf_params = self.getparamnames("__dm2vhf", prefix=prefix)
+            else:
+                vhf_params = self.hamilton.getparamnames("get_elrep", prefix=hprefix)
+
+            return vhf_params + \
                 vxc_params + \
                 self.knvext_linop._getparamnames(prefix=prefix + "knvext_linop.")
+        elif methodname == "__dm2vhf":
+            return self.hamilton.getparamnames("get_elrep_exchange", prefix=prefix + "hamilton.")
         else:
             raise KeyError("Method %s has no paramnames set" % methodname)
         return []  # TODO: to complete
+
+def _scale_linop(linop: xt.LinearOperator, fac: Union[float, torch.Tensor]) -> xt.LinearOperator:
+    # scale the hermitian linear operator with the factor which can be a tensor
+    if isinstance(fac, torch.Tensor):
+        return xt.LinearOperator.m(linop.fullmatrix() * fac, is_hermitian=True)
+    return linop * fac
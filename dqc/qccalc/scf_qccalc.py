@@ -1,6 +1,10 @@
 from __future__ import annotations
 from abc import abstractmethod, abstractproperty
-from typing import Optional, Dict, Any, List, Union, Tuple
+from typing import Optional, Dict, Any, List, Union, Tuple, Callable
+from dataclasses import dataclass, field
+import functools
+import time
+import warnings
 import torch
 import xitorch as xt
 import xitorch.linalg
@@ -9,7 +13,56 @@ from dqc.system.base_system import BaseSystem
 from dqc.qccalc.base_qccalc import BaseQCCalc
 from dqc.utils.datastruct import SpinParam
 from dqc.utils.config import config
-from dqc.utils.misc import set_default_option
+from dqc.utils.misc import set_default_option, logger
+from dqc.utils.profiler import stage_timer
+
+# default options for the second-order minimization with ``method="newton"``
+_NEWTON_DEFOPT: Dict[str, Any] = {
+    "maxiter": 200,
+    "gtol": 1e-7,  # maximum absolute gradient w.r.t. the orbital rotations
+    "max_step": 0.5,  # trust radius, the maximum rotation angle in a step
+    "history": 20,  # number of the previous steps kept for the quasi-Newton update
+    "rebase_angle": 0.5,  # the reference orbitals are updated above this angle
+}
+
+# default options for the self-consistent iterations with ``method="diis"``
+_DIIS_DEFOPT: Dict[str, Any] = {
+    "maxiter": 50,
+    "tol": 1e-9,  # maximum absolute commutator error, FDS - SDF
+    "level_shift": 0.0,  # shift of the virtual orbitals before DIIS starts
+    "damping": 0.0,  # fraction of the previous density matrix before DIIS starts
+    "diis_space": 8,  # number of the previous fock matrices in the extrapolation
+    "diis_start_err": 1e-1,  # DIIS starts when the error is below this, or
+    "diis_start_cycle": 20,  # when the iteration reaches this
+}
+
+@dataclass
+class SCFIterInfo:
+    """
+    The information of an iteration of the self-consistent field calculation,
+    which is passed to the ``callback`` of ``SCF_QCCalc.run``.
+    For the variational methods, an iteration is an evaluation of the energy.
+    """
+    niter: int  # the index of the iteration
+    energy: Optional[float]  # the total energy, only calculated if there is a callback
+    grad_norm: Optional[float]  # the maximum absolute orbital gradient, e.g. FDS - SDF
+    error: Optional[float]  # the maximum absolute change of the fock matrix
+    time: float  # the wall time of the iteration in seconds
+    stage_times: Dict[str, float] = field(default_factory=dict)  # e.g. "J", "K", "XC", "diag"
+
+@dataclass
+class SCFStats:
+    """
+    The summary of the last run of the self-consistent field calculation,
+    returned by ``SCF_QCCalc.stats()``.
+    """
+    niter: int  # the number of iterations
+    nfock: int  # the number of the fock matrix builds
+    ndiag: int  # the number of the fock matrix diagonalizations
+    time: float  # the total wall time in seconds
+    stage_times: Dict[str, float] = field(default_factory=dict)  # the total wall time of every stage
+    xc_screened_frac: Optional[float] = None  # the fraction of the xc grid points skipped by the screening
+    iters: List[SCFIterInfo] = field(default_factory=list)
 
 class SCF_QCCalc(BaseQCCalc):
     """
@@ -22,8 +75,21 @@ class SCF_QCCalc(BaseQCCalc):
         The SCF engine
     variational: bool
         If True, then use optimization of the free orbital parameters to find
-        the minimum energy.
-        Otherwise, use self-consistent iterations.
+        the minimum energy. By default, the orbital parameters are optimized
+        with L-BFGS preconditioned by the orbital energy differences.
+        Passing ``fwd_options={"method": "newton"}`` to ``run`` uses the
+        quasi-Newton minimization of the orbital rotations instead, and the
+        other methods are passed to ``xitorch.optimize.minimize``.
+        Otherwise, use self-consistent iterations. Passing
+        ``fwd_options={"method": "diis"}`` to ``run`` uses the Pulay's DIIS
+        iterations, which can be preceded by the iterations with the level
+        shift of the virtual orbitals (``"level_shift"``) and the damping of
+        the density matrix (``"damping"``). Both of them can be a float, a list
+        of the values of every iteration (the last one is used afterwards), or
+        a function of the iteration number. DIIS starts when the commutator
+        error is below ``"diis_start_err"``, the iteration reaches
+        ``"diis_start_cycle"``, or both the level shift and the damping are
+        zero, after which they are no longer applied.
     """
 
     def __init__(self, engine: BaseSCFEngine, variational: bool = False):
@@ -34,14 +100,40 @@ class SCF_QCCalc(BaseQCCalc):
         self.device = self._engine.device
         self._has_run = False
         self._variational = variational
+        self._recorder = _SCFRecorder(None)
 
     def get_system(self) -> BaseSystem:
         return self._engine.get_system()
 
+    @stage_timer("scf")
     def run(self, dm0: Optional[Union[str, torch.Tensor, SpinParam[torch.Tensor]]] = "1e",  # type: ignore
             eigen_options: Optional[Dict[str, Any]] = None,
             fwd_options: Optional[Dict[str, Any]] = None,
-            bck_options: Optional[Dict[str, Any]] = None) -> BaseQCCalc:
+            bck_options: Optional[Dict[str, Any]] = None,
+            callback: Optional[Callable[[SCFIterInfo], None]] = None) -> BaseQCCalc:
+        """
+        Run the self-consistent field calculation.
+
+        Arguments
+        ---------
+        dm0: str, torch.Tensor, SpinParam[torch.Tensor], or None
+            The initial density matrix. If ``"1e"``, it is obtained from the
+            one-electron Hamiltonian. If ``None``, it starts from zeros.
+        eigen_options: dict or None
+            The options of the diagonalization (see ``BaseSCFEngine.set_eigen_options``).
+        fwd_options: dict or None
+            The options of the self-consistent iterations or the minimization.
+        bck_options: dict or None
+            The options of the implicit differentiation in the backward.
+        callback: callable or None
+            If given, it is called with ``SCFIterInfo`` after every iteration,
+            e.g. to monitor the convergence of the calculation.
+
+        Returns
+        -------
+        BaseQCCalc
+            The calculation object itself.
+        """
 
         # get default options
         if not self._variational:
@@ -51,15 +143,32 @@ class SCF_QCCalc(BaseQCCalc):
                 "maxiter": 50,
                 "verbose": config.VERBOSE > 0,
             }
+            if fwd_options is not None and fwd_options.get("method", None) == "diis":
+                # the defaults are set in self._diis_scf
+                fwd_defopt = {"method": "diis"}
         else:
             fwd_defopt = {
-                "method": "gd",
-                "step": 1e-2,
-                "maxiter": 5000,
+                "method": "lbfgs",
+                "maxiter": 200,
+                "gtol": 1e-9,
                 "f_rtol": 1e-10,
                 "x_rtol": 1e-10,
                 "verbose": config.VERBOSE > 0,
             }
+            method = fwd_options.get("method", "lbfgs") if fwd_options is not None else "lbfgs"
+            if method == "newton":
+                # the defaults are set in self._newton_scf
+                fwd_defopt = {"method": "newton"}
+            elif method != "lbfgs":
+                # the minimizers from xitorch
+                fwd_defopt = {
+                    "method": "gd",
+                    "step": 1e-2,
+                    "maxiter": 5000,
+                    "f_rtol": 1e-10,
+                    "x_rtol": 1e-10,
+                    "verbose": config.VERBOSE > 0,
+                }
         bck_defopt = {
             # NOTE: it seems like in most cases the jacobian matrix is posdef
             # if it is not the case, we can just remove the line below
@@ -81,6 +190,11 @@ class SCF_QCCalc(BaseQCCalc):
         # save the eigen_options for use in diagonalization
         self._engine.set_eigen_options(eigen_options)
 
+        # record the iterations through the engine wrapped by the monitor
+        self._recorder = _SCFRecorder(callback)
+        monitor = _SCFMonitor(self._engine, self._recorder,
+                              self.get_system().get_hamiltonian().get_overlap().fullmatrix())
+
         # set up the initial self-consistent param guess
         if dm0 is None:
             dm = self._get_zero_dm()
@@ -104,10 +218,12 @@ class SCF_QCCalc(BaseQCCalc):
 
         if not self._variational:
             scp0 = self._engine.dm2scp(dm)
+            if fwd_options["method"] == "diis":
+                fwd_options = {**fwd_options, "method": self._diis_scf}
 
             # do the self-consistent iteration
             scp = xitorch.optimize.equilibrium(
-                fcn=self._engine.scp2scp,
+                fcn=monitor.scp2scp,
                 y0=scp0,
                 bck_options={**bck_options},
                 **fwd_options)
@@ -141,17 +257,44 @@ class SCF_QCCalc(BaseQCCalc):
                     p, c, orb_weights)
                 return dm
 
-            params0, coeffs0 = dm2params(dm)
-            params0 = params0.detach()
-            coeffs0 = coeffs0.detach()
-            min_params0: torch.Tensor = xitorch.optimize.minimize(
-                fcn=self._engine.aoparams2ene,
-                # random noise to add the chance of it gets to the minimum, not
-                # a saddle point
-                y0=params0 + torch.randn_like(params0) * 0.03 / params0.numel(),
-                params=(coeffs0, None,),  # coeffs & with_penalty
-                bck_options={**bck_options},
-                **fwd_options).detach()
+            def get_precond(params: torch.Tensor) -> Callable[[torch.Tensor], torch.Tensor]:
+                # preconditioner of the gradient w.r.t. the orbital parameters
+                # from the fock matrix of the given parameters
+                scp = self._engine.dm2scp(params2dm(params, coeffs0))
+                fock = SpinParam(u=scp[0], d=scp[1]) if self._polarized else scp
+                orbs = self._engine.unpack_aoparams(params)
+                precs = SpinParam.apply_fcn(_get_orb_precond, fock, orb_weights, orbs)
+
+                def precond(grad: torch.Tensor) -> torch.Tensor:
+                    g = self._engine.unpack_aoparams(grad)
+                    return self._engine.pack_aoparams(SpinParam.apply_fcn(lambda prec, g: prec(g), precs, g))
+                return precond
+
+            if fwd_options["method"] == "newton":
+                # second-order minimization w.r.t. the orbital rotations, the
+                # gradient is then obtained from the orbital parameters below
+                min_dm = self._newton_scf(dm, **fwd_options)
+                min_params0, coeffs0 = dm2params(min_dm)
+                min_params0 = min_params0.detach()
+                coeffs0 = coeffs0.detach()
+            else:
+                params0, coeffs0 = dm2params(dm)
+                params0 = params0.detach()
+                coeffs0 = coeffs0.detach()
+                if fwd_options["method"] == "lbfgs":
+                    # the preconditioner is only available if the parameters
+                    # are the orbitals, i.e. with the QR parameterization
+                    minimizer = functools.partial(_lbfgs_minimize,
+                                                  precond_fcn=get_precond if params0.ndim == 2 else None)
+                    fwd_options = {**fwd_options, "method": minimizer}
+                min_params0 = xitorch.optimize.minimize(
+                    fcn=monitor.aoparams2ene,
+                    # random noise to add the chance of it gets to the minimum, not
+                    # a saddle point
+                    y0=params0 + torch.randn_like(params0) * 0.03 / params0.numel(),
+                    params=(coeffs0, None,),  # coeffs & with_penalty
+                    bck_options={**bck_options},
+                    **fwd_options).detach()
 
             if torch.is_grad_enabled():
                 # If the gradient is required, then put it through the minimization
@@ -173,9 +316,20 @@ class SCF_QCCalc(BaseQCCalc):
 
             self._dm = params2dm(min_params0, coeffs0)
 
+        hamilton = self.get_system().get_hamiltonian()
+        self._stats = self._recorder.get_stats(getattr(hamilton, "xc_screened_frac", None))
         self._has_run = True
         return self
 
+    def stats(self) -> SCFStats:
+        """
+        Returns the summary of the last run, e.g. the number of iterations and
+        fock matrix builds, and the wall time of the stages (``"J"``, ``"K"``,
+        ``"JK"``, ``"XC"``, ``"diag"``, and ``"fock"`` for the whole fock builds).
+        """
+        assert self._has_run
+        return self._stats
+
     def energy(self) -> torch.Tensor:
         # returns the total energy of the system
         assert self._has_run
@@ -192,6 +346,196 @@ class SCF_QCCalc(BaseQCCalc):
             (isinstance(dm, SpinParam) and self._polarized)
         return self._engine.dm2energy(dm)
 
+    def _newton_scf(self, dm: Union[torch.Tensor, SpinParam[torch.Tensor]], **options) \
+            -> Union[torch.Tensor, SpinParam[torch.Tensor]]:
+        # minimize the energy w.r.t. the rotations of the orbitals, starting
+        # from the orbitals of the fock matrix of the given density matrix.
+        # The orbitals are U @ exp(X)[:, :norb] where U is the reference
+        # orbitals and X is antisymmetric. The quasi-Newton (L-BFGS) steps are
+        # preconditioned by the diagonal orbital Hessian from the orbital
+        # energies and restricted within a trust radius.
+        # This assumes the self-consistent parameter is the fock matrix.
+        opts = set_default_option(_NEWTON_DEFOPT, options)
+        system = self.get_system()
+        h = system.get_hamiltonian()
+        ovlp = h.get_overlap()
+        orb_weight = SpinParam.apply_fcn(lambda w: w.detach(), system.get_orbweight(polarized=self._polarized))
+        orb_weights = [orb_weight.u, orb_weight.d] if isinstance(orb_weight, SpinParam) else [orb_weight]
+
+        def get_focks(dm: Union[torch.Tensor, SpinParam[torch.Tensor]]) -> List[torch.Tensor]:
+            scp = self._engine.dm2scp(dm).detach()
+            return [scp[0], scp[1]] if self._polarized else [scp]
+
+        def energy(x: torch.Tensor, refs: List[torch.Tensor]) -> \
+                Tuple[torch.Tensor, Union[torch.Tensor, SpinParam[torch.Tensor]]]:
+            dms: List[torch.Tensor] = []
+            i = 0
+            for (u, w, mask) in zip(refs, orb_weights, masks):
+                nrot = int(mask.sum())
+                rot = torch.zeros_like(u).masked_scatter(mask, x[i:i + nrot])
+                orb = torch.matmul(u, torch.matrix_exp(rot - rot.transpose(-2, -1))[:, :w.shape[-1]])
+                dms.append(h.ao_orb2dm(orb, w))
+                i += nrot
+            dm = SpinParam(u=dms[0], d=dms[1]) if self._polarized else dms[0]
+            return self._engine.dm2energy(dm), dm
+
+        def energy_grad(x: torch.Tensor, refs: List[torch.Tensor]) -> Tuple[float, torch.Tensor]:
+            with torch.enable_grad():
+                x1 = x.clone().requires_grad_()
+                ene = energy(x1, refs)[0]
+                grad, = torch.autograd.grad(ene, x1)
+            return float(ene.detach()), grad
+
+        dm = SpinParam.apply_fcn(lambda dm: dm.detach(), dm)
+        focks = get_focks(dm)
+        refs: List[torch.Tensor] = []
+        masks: List[torch.Tensor] = []
+        for (fock, w) in zip(focks, orb_weights):
+            _, u = xitorch.linalg.lsymeig(xt.LinearOperator.m(_symm(fock), is_hermitian=True),
+                                          M=ovlp, method="exacteig")
+            refs.append(u.detach())
+            masks.append(_get_orbrot_mask(w, u.shape[-1]))
+        hdiag = _get_orbrot_hdiag(refs, focks, orb_weights, masks)
+
+        nparams = sum(int(mask.sum()) for mask in masks)
+        x = torch.zeros(nparams, dtype=self.dtype, device=self.device)
+        ene, grad = energy_grad(x, refs)
+        max_step = opts["max_step"]
+        s_hist: List[torch.Tensor] = []
+        y_hist: List[torch.Tensor] = []
+        converged = False
+        for i in range(opts["maxiter"]):
+            gmax = float(grad.abs().max()) if nparams > 0 else 0.0
+            logger.log("Newton SCF iter %d: energy = %.12e, max |grad| = %.3e" % (i, ene, gmax))
+            self._recorder.record(ene, grad_norm=gmax)
+            if gmax < opts["gtol"]:
+                converged = True
+                break
+
+            # quasi-Newton direction within the trust radius
+            step = -_lbfgs_direction(grad, s_hist, y_hist, lambda g: g / hdiag)
+            if float(torch.dot(step, grad)) >= 0:
+                step = -grad / hdiag
+                s_hist, y_hist = [], []
+            step_max = float(step.abs().max())
+            if step_max > max_step:
+                step = step * (max_step / step_max)
+
+            # backtrack and shrink the trust radius if the energy goes up, near
+            # the convergence where the energy change is within the numerical
+            # noise, the gradient must go down instead
+            gnorm = float(grad.norm())
+            for _ in range(10):
+                ene_new, grad_new = energy_grad(x + step, refs)
+                dene = ene_new - ene
+                if dene <= 1e-4 * float(torch.dot(step, grad)):
+                    break
+                if dene <= 1e-13 * abs(ene) and float(grad_new.norm()) < gnorm:
+                    break
+                step = step * 0.5
+                max_step = float(step.abs().max())
+            else:
+                break
+            max_step = min(max(max_step, 2 * float(step.abs().max())), opts["max_step"])
+
+            y = grad_new - grad
+            if float(torch.dot(step, y)) > 0:
+                s_hist.append(step)
+                y_hist.append(y)
+                if len(s_hist) > opts["history"]:
+                    s_hist.pop(0)
+                    y_hist.pop(0)
+            x = x + step
+            ene, grad = ene_new, grad_new
+
+            # move the reference to the current orbitals if the rotation is large
+            if float(x.abs().max()) > opts["rebase_angle"]:
+                with torch.no_grad():
+                    _, dm = energy(x, refs)
+                    focks = get_focks(dm)
+                    i0 = 0
+                    for j, (u, w, mask) in enumerate(zip(refs, orb_weights, masks)):
+                        nrot = int(mask.sum())
+                        rot = torch.zeros_like(u).masked_scatter(mask, x[i0:i0 + nrot])
+                        u = torch.matmul(u, torch.matrix_exp(rot - rot.transpose(-2, -1)))
+                        refs[j] = _canonicalize_orbs(u, focks[j], w)
+                        i0 += nrot
+                hdiag = _get_orbrot_hdiag(refs, focks, orb_weights, masks)
+                x = torch.zeros_like(x)
+                ene, grad = energy_grad(x, refs)
+                s_hist, y_hist = [], []
+
+        if not converged:
+            warnings.warn("The Newton SCF does not converge after %d iterations" % opts["maxiter"])
+        with torch.no_grad():
+            return energy(x, refs)[1]
+
+    def _diis_scf(self, fcn: Callable[..., torch.Tensor], y0: torch.Tensor, params: List[Any],
+                  **options) -> torch.Tensor:
+        # the self-consistent iterations from the self-consistent parameter
+        # (i.e. the fock matrix) y0 to be used as the method of
+        # xitorch.optimize.equilibrium, so the gradient is still obtained from
+        # the implicit differentiation of the fixed point.
+        # Before DIIS starts, the fock matrix is shifted by
+        # level_shift * (S - S D S / maxocc) to raise the virtual orbitals and
+        # the new density matrix is mixed with the previous one.
+        opts = set_default_option(_DIIS_DEFOPT, options)
+        ovlp = self.get_system().get_hamiltonian().get_overlap().fullmatrix()
+        maxocc = 1.0 if self._polarized else 2.0
+
+        def scp2dm(scp: torch.Tensor) -> torch.Tensor:
+            dm = self._engine.scp2dm(scp)
+            return torch.stack((dm.u, dm.d), dim=0) if isinstance(dm, SpinParam) else dm
+
+        def to_spin(dm: torch.Tensor) -> Union[torch.Tensor, SpinParam[torch.Tensor]]:
+            return SpinParam(u=dm[0], d=dm[1]) if self._polarized else dm
+
+        def dm2scp(dm: torch.Tensor) -> torch.Tensor:
+            return self._engine.dm2scp(to_spin(dm))
+
+        dm = scp2dm(y0)
+        fock = y0
+        focks: List[torch.Tensor] = []
+        errs: List[torch.Tensor] = []
+        use_diis = False
+        converged = False
+        for i in range(opts["maxiter"]):
+            fock_prev = fock
+            fock = dm2scp(dm)
+            err = _get_comm_err(fock, dm, ovlp)
+            errmax = float(err.abs().max())
+            logger.log("DIIS SCF iter %d: max |FDS - SDF| = %.3e" % (i, errmax))
+            self._recorder.record(functools.partial(self._engine.dm2energy, to_spin(dm)),
+                                  grad_norm=errmax, error=float((fock - fock_prev).abs().max()))
+            if errmax < opts["tol"]:
+                converged = True
+                break
+
+            shift = _get_schedule_value(opts["level_shift"], i)
+            damping = _get_schedule_value(opts["damping"], i)
+            use_diis = use_diis or errmax < opts["diis_start_err"] or i >= opts["diis_start_cycle"] or \
+                (shift == 0 and damping == 0)
+            if use_diis:
+                focks.append(fock)
+                errs.append(err)
+                if len(focks) > opts["diis_space"]:
+                    focks.pop(0)
+                    errs.pop(0)
+                dm = scp2dm(_diis_extrapolate(focks, errs))
+            else:
+                if shift != 0:
+                    sds = torch.matmul(ovlp, torch.matmul(dm, ovlp))
+                    fock = fock + shift * (ovlp - sds / maxocc)
+                dm_new = scp2dm(fock)
+                dm = dm_new if damping == 0 else (1 - damping) * dm_new + damping * dm
+
+        if not converged:
+            warnings.warn("The DIIS SCF does not converge after %d iterations" % opts["maxiter"])
+            # the last fock matrix might be level-shifted, so return the
+            # unshifted fock matrix of the last density matrix
+            fock = dm2scp(dm)
+        return fock
+
     def _get_zero_dm(self) -> Union[SpinParam[torch.Tensor], torch.Tensor]:
         # get the initial dm that are all zeros
         if not self._polarized:
@@ -307,6 +651,19 @@ class BaseSCFEngine(xt.EditableModule):
     def set_eigen_options(self, eigen_options: Dict[str, Any]) -> None:
         """
         Set the options for the diagonalization (i.e. eigendecomposition).
+        Besides the methods of ``xitorch.linalg.symeig``, the method can be
+        ``"lobpcg"`` to obtain the occupied orbitals in the self-consistent
+        iterations iteratively, starting from the orbitals of the previous
+        iteration. It falls back to the dense eigendecomposition for small
+        matrices (fewer than ``"min_nao"`` orbitals) and when the gradient is
+        required.
+        The method ``"purification"`` obtains the density matrix without
+        diagonalization by purifying the Fock matrix with the ``"scheme"``
+        ``"trs4"`` (trace-resetting, default), ``"canonical"``, or
+        ``"mcweeny"`` (requires the chemical potential ``"mu"``). The small
+        elements of the matrix products can be truncated with ``"threshold"``.
+        It falls back to the diagonalization for non-uniform occupations or if
+        it does not converge, e.g. when there is no gap.
         """
         pass
 
@@ -316,3 +673,286 @@ class BaseSCFEngine(xt.EditableModule):
         List all the names of parameters used in the given method.
         """
         pass
+
+class _SCFRecorder(object):
+    # records the information of the iterations and passes it to the callback
+    def __init__(self, callback: Optional[Callable[[SCFIterInfo], None]]):
+        self.callback = callback
+        self.iters: List[SCFIterInfo] = []
+        self._t0 = self._tlast = time.perf_counter()
+        self._times0 = dict(stage_timer.times)
+        self._timeslast = self._times0
+        self._counts0 = dict(stage_timer.counts)
+
+    def record(self, energy: Union[float, Callable[[], torch.Tensor], None],
+               grad_norm: Optional[float] = None, error: Optional[float] = None) -> None:
+        # the energy can be given as a function to only calculate it if there
+        # is a callback
+        if callable(energy):
+            energy = float(energy().detach()) if self.callback is not None else None
+        tnow = time.perf_counter()
+        times = dict(stage_timer.times)
+        info = SCFIterInfo(niter=len(self.iters), energy=energy, grad_norm=grad_norm, error=error,
+                           time=tnow - self._tlast, stage_times=_diff_dict(times, self._timeslast))
+        self._tlast = tnow
+        self._timeslast = times
+        self.iters.append(info)
+        if self.callback is not None:
+            self.callback(info)
+
+    def get_stats(self, xc_screened_frac: Optional[float] = None) -> SCFStats:
+        counts = _diff_dict(stage_timer.counts, self._counts0)
+        return SCFStats(niter=len(self.iters), nfock=int(counts.get("fock", 0)),
+                        ndiag=int(counts.get("diag", 0)), time=time.perf_counter() - self._t0,
+                        stage_times=_diff_dict(stage_timer.times, self._times0),
+                        xc_screened_frac=xc_screened_frac, iters=self.iters)
+
+class _SCFMonitor(xt.EditableModule):
+    # wraps the engine to record the iterations, the parameters are the
+    # engine's, so the implicit gradients are unchanged
+    def __init__(self, engine: BaseSCFEngine, recorder: _SCFRecorder, ovlp: torch.Tensor):
+        self.engine = engine
+        self.recorder = recorder
+        self.ovlp = ovlp
+
+    def scp2scp(self, scp: torch.Tensor) -> torch.Tensor:
+        dm = self.engine.scp2dm(scp)
+        scp_new = self.engine.dm2scp(dm)
+        # only the iterations in the forward are recorded, not the ones in the
+        # implicit differentiation
+        if not torch.is_grad_enabled():
+            dmt = torch.stack((dm.u, dm.d), dim=0) if isinstance(dm, SpinParam) else dm
+            self.recorder.record(functools.partial(self.engine.dm2energy, dm),
+                                 grad_norm=float(_get_comm_err(scp_new, dmt, self.ovlp).abs().max()),
+                                 error=float((scp_new - scp).abs().max()))
+        return scp_new
+
+    def aoparams2ene(self, aoparams: torch.Tensor, aocoeffs: torch.Tensor,
+                     with_penalty: Optional[float] = None) -> torch.Tensor:
+        ene = self.engine.aoparams2ene(aoparams, aocoeffs, with_penalty)
+        if with_penalty is None:
+            self.recorder.record(float(ene.detach()))
+        return ene
+
+    def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
+        return self.engine.getparamnames(methodname, prefix=prefix + "engine.")
+
+def _diff_dict(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    # the difference of the accumulated values, a - b, of the nonzero differences
+    res = {key: a[key] - b.get(key, 0) for key in a}
+    return {key: val for (key, val) in res.items() if val != 0}
+
+def _get_comm_err(fock: torch.Tensor, dm: torch.Tensor, ovlp: torch.Tensor) -> torch.Tensor:
+    # the commutator FDS - SDF, which is zero at the self-consistent solution
+    fds = torch.matmul(fock, torch.matmul(dm, ovlp))
+    return fds - fds.transpose(-2, -1).conj()
+
+def _symm(mat: torch.Tensor) -> torch.Tensor:
+    # symmetrize the matrix
+    return (mat + mat.transpose(-2, -1)) * 0.5
+
+def _get_orbrot_mask(orb_weight: torch.Tensor, nao: int) -> torch.Tensor:
+    # mask of the non-redundant rotations (p, q) between the occupied orbital q
+    # and the orbital p > q with a different occupation
+    norb = orb_weight.shape[-1]
+    w = torch.zeros(nao, dtype=orb_weight.dtype, device=orb_weight.device)
+    w[:norb] = orb_weight
+    idx = torch.arange(nao, device=orb_weight.device)
+    return (idx.unsqueeze(-1) > idx) & (idx < norb) & (w.unsqueeze(-1) != w)
+
+def _get_orbrot_hdiag(refs: List[torch.Tensor], focks: List[torch.Tensor],
+                      orb_weights: List[torch.Tensor], masks: List[torch.Tensor]) -> torch.Tensor:
+    # the approximate diagonal Hessian of the energy w.r.t. the rotation (p, q),
+    # 2 * (w_q - w_p) * (e_p - e_q), where e are the orbital energies
+    hdiags: List[torch.Tensor] = []
+    for (u, fock, orb_weight, mask) in zip(refs, focks, orb_weights, masks):
+        nao = u.shape[-1]
+        w = torch.zeros(nao, dtype=u.dtype, device=u.device)
+        w[:orb_weight.shape[-1]] = orb_weight
+        e = torch.diagonal(torch.matmul(u.transpose(-2, -1), torch.matmul(fock, u)))
+        hess = 2 * (w - w.unsqueeze(-1)) * (e.unsqueeze(-1) - e)
+        hdiags.append(hess[mask])
+    return torch.cat(hdiags).abs().clamp(min=1e-2)
+
+def _canonicalize_orbs(u: torch.Tensor, fock: torch.Tensor, orb_weight: torch.Tensor) -> torch.Tensor:
+    # rotate the orbitals with the same occupation (which does not change the
+    # energy) to diagonalize the fock matrix within them
+    nao = u.shape[-1]
+    w = torch.zeros(nao, dtype=u.dtype, device=u.device)
+    w[:orb_weight.shape[-1]] = orb_weight
+    u = u.clone()
+    for wval in torch.unique(w):
+        idx = (w == wval).nonzero().squeeze(-1)
+        sub = u[:, idx]
+        _, c = torch.linalg.eigh(_symm(torch.matmul(sub.transpose(-2, -1), torch.matmul(fock, sub))))
+        u[:, idx] = torch.matmul(sub, c)
+    return u
+
+def _lbfgs_direction(grad: torch.Tensor, s_hist: List[torch.Tensor], y_hist: List[torch.Tensor],
+                     precond: Callable[[torch.Tensor], torch.Tensor]) -> torch.Tensor:
+    # L-BFGS two-loop recursion to get the product of the inverse Hessian and
+    # the gradient with the preconditioner as the initial inverse Hessian
+    q = grad
+    alphas: List[float] = []
+    for (s, y) in zip(reversed(s_hist), reversed(y_hist)):
+        alpha = float(torch.dot(s, q)) / float(torch.dot(y, s))
+        q = q - alpha * y
+        alphas.append(alpha)
+    r = precond(q)
+    for (s, y), alpha in zip(zip(s_hist, y_hist), reversed(alphas)):
+        beta = float(torch.dot(y, r)) / float(torch.dot(y, s))
+        r = r + (alpha - beta) * s
+    return r
+
+def _get_schedule_value(val: Union[float, List[float], Callable[[int], float]], i: int) -> float:
+    # returns the value of a schedule at the i-th iteration, where the schedule
+    # is a constant, a list of values (the last one is used afterwards), or a
+    # function of the iteration
+    if callable(val):
+        return float(val(i))
+    elif isinstance(val, (list, tuple)):
+        return float(val[min(i, len(val) - 1)]) if len(val) > 0 else 0.0
+    return float(val)
+
+def _diis_extrapolate(focks: List[torch.Tensor], errs: List[torch.Tensor]) -> torch.Tensor:
+    # Pulay's DIIS: the linear combination of the fock matrices that minimizes
+    # the norm of the combined errors with the coefficients summed to 1
+    n = len(focks)
+    b = torch.zeros((n + 1, n + 1), dtype=torch.float64)
+    for i in range(n):
+        for j in range(i + 1):
+            b[i, j] = b[j, i] = float(torch.sum(errs[i].conj() * errs[j]).real)
+    b[:n, n] = b[n, :n] = -1.0
+    rhs = torch.zeros(n + 1, dtype=torch.float64)
+    rhs[n] = -1.0
+    # scale the error matrix to reduce the ill-conditioning of the small errors
+    scale = float(b[:n, :n].diagonal().max())
+    if scale > 0:
+        b[:n, :n] /= scale
+    coeffs = torch.linalg.lstsq(b, rhs.unsqueeze(-1), driver="gelsd").solution.squeeze(-1)[:n]
+    fock = focks[0] * float(coeffs[0])
+    for (f, c) in zip(focks[1:], coeffs[1:]):
+        fock = fock + f * float(c)
+    return fock
+
+def _get_orb_precond(fock: torch.Tensor, orb_weight: torch.Tensor,
+                     orb: torch.Tensor) -> Callable[[torch.Tensor], torch.Tensor]:
+    # returns the function to precondition the gradient w.r.t. the orbitals,
+    # (nao, norb), by dividing its components in the basis of the orthonormalized
+    # orbitals and the canonical virtual orbitals, (p, q), by the approximate
+    # diagonal Hessian, 2 * |w_q - w_p| * |e_p - e_q|, where e are the
+    # diagonal elements of the fock matrix in that basis
+    fock = _symm(fock.detach())
+    nao = fock.shape[-1]
+    norb = orb_weight.shape[-1]
+    occ, _ = torch.linalg.qr(orb.detach())
+    # the virtual orbitals diagonalize the fock matrix in the complement space
+    proj = torch.eye(nao, dtype=fock.dtype, device=fock.device) - torch.matmul(occ, occ.transpose(-2, -1))
+    _, vecs = torch.linalg.eigh(proj)
+    virt = vecs[:, norb:]
+    _, c = torch.linalg.eigh(_symm(torch.matmul(virt.transpose(-2, -1), torch.matmul(fock, virt))))
+    u = torch.cat((occ, torch.matmul(virt, c)), dim=-1)
+    e = torch.diagonal(torch.matmul(u.transpose(-2, -1), torch.matmul(fock, u)))
+
+    w = torch.zeros(nao, dtype=u.dtype, device=u.device)
+    w[:norb] = orb_weight.detach()
+    hess = 2 * (w[:norb] - w.unsqueeze(-1)).abs() * (e.unsqueeze(-1) - e[:norb]).abs()
+    hess = hess.clamp(min=1e-1)
+    # the components within the occupied orbitals with the same occupation do
+    # not change the energy, so they are suppressed
+    redundant = w[:norb] == w.unsqueeze(-1)
+    redundant[norb:] = False
+    hess = torch.where(redundant, hess.max(), hess)
+    return lambda grad: torch.matmul(u, torch.matmul(u.transpose(-2, -1), grad) / hess)
+
+def _lbfgs_minimize(fcn: Callable[..., Tuple[torch.Tensor, torch.Tensor]], y0: torch.Tensor,
+                    params: List[Any],
+                    precond_fcn: Optional[Callable[[torch.Tensor], Callable[[torch.Tensor], torch.Tensor]]] = None,
+                    maxiter: int = 200, gtol: float = 1e-9, f_rtol: float = 1e-10, x_rtol: float = 1e-10,
+                    max_step: float = 0.5, history: int = 20, precond_update: int = 10,
+                    verbose: bool = False) -> torch.Tensor:
+    # preconditioned L-BFGS minimization of the function, fcn(y, *params),
+    # which returns the value and the gradient, to be used as the method in
+    # xitorch.optimize.minimize.
+    # precond_fcn(y) returns the preconditioner (the approximate inverse
+    # Hessian) at y, it is updated every precond_update iterations.
+    # The step is bounded by max_step and the energy is decreased by
+    # backtracking. It stops if the maximum absolute gradient is below gtol or
+    # the changes of the function and y are below f_rtol and x_rtol.
+    # Unknown options raise a TypeError instead of being ignored.
+    y = y0
+    fval, g = fcn(y, *params)
+    f = float(fval)
+    s_hist: List[torch.Tensor] = []
+    y_hist: List[torch.Tensor] = []
+    precond: Optional[Callable[[torch.Tensor], torch.Tensor]] = None
+    converged = False
+    for i in range(maxiter):
+        gmax = float(g.abs().max())
+        if verbose:
+            logger.log("L-BFGS iter %d: f = %.12e, max |grad| = %.3e" % (i, f, gmax))
+        if gmax < gtol:
+            converged = True
+            break
+
+        # the initial inverse Hessian, from the preconditioner or the scale of
+        # the last step if there is no preconditioner
+        if precond_fcn is not None and i % precond_update == 0:
+            precond = precond_fcn(y)
+        if precond is not None:
+            prec = precond
+
+            def h0(v: torch.Tensor) -> torch.Tensor:
+                return prec(v.reshape(y.shape)).reshape(-1)
+        else:
+            gamma = float(torch.dot(s_hist[-1], y_hist[-1]) / torch.dot(y_hist[-1], y_hist[-1])) \
+                if len(s_hist) > 0 else 1.0
+
+            def h0(v: torch.Tensor) -> torch.Tensor:
+                return v * gamma
+
+        gflat = g.reshape(-1)
+        step = -_lbfgs_direction(gflat, s_hist, y_hist, h0)
+        if float(torch.dot(step, gflat)) >= 0:
+            step = -h0(gflat)
+            s_hist, y_hist = [], []
+        step_max = float(step.abs().max())
+        if step_max > max_step:
+            step = step * (max_step / step_max)
+
+        # backtracking line search, near the convergence where the change of
+        # the function is within the numerical noise, the gradient must go
+        # down instead
+        gnorm = float(gflat.norm())
+        for _ in range(10):
+            ynew = y + step.reshape(y.shape)
+            fval, gnew = fcn(ynew, *params)
+            fnew = float(fval)
+            if fnew - f <= 1e-4 * float(torch.dot(step, gflat)):
+                break
+            if fnew - f <= 1e-13 * abs(f) and float(gnew.norm()) < gnorm:
+                break
+            step = step * 0.5
+        else:
+            # no progress can be made anymore
+            warnings.warn("The L-BFGS line search fails to decrease the function at iteration %d, "
+                          "the minimization does not converge" % i)
+            return y
+
+        dy = (gnew - g).reshape(-1)
+        if float(torch.dot(step, dy)) > 0:
+            s_hist.append(step)
+            y_hist.append(dy)
+            if len(s_hist) > history:
+                s_hist.pop(0)
+                y_hist.pop(0)
+        fconv = abs(fnew - f) <= f_rtol * abs(f)
+        xconv = float(step.abs().max()) <= x_rtol * float(y.abs().max())
+        y, f, g = ynew, fnew, gnew
+        if fconv and xconv:
+            converged = True
+            break
+
+    if not converged:
+        warnings.warn("The L-BFGS minimization does not converge after %d iterations" % maxiter)
+    return y
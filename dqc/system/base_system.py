@@ -5,7 +5,9 @@ import xitorch as xt
 from typing import List, Union, Optional, Tuple
 from dqc.hamilton.base_hamilton import BaseHamilton
 from dqc.grid.base_grid import BaseGrid
+from dqc.xc.base_xc import BaseXC
 from dqc.utils.datastruct import SpinParam, ZType, BasisInpType
+from dqc.utils.resources import ResourceEstimate
 
 class BaseSystem(xt.EditableModule):
     """
@@ -47,6 +49,41 @@ class BaseSystem(xt.EditableModule):
         # returns: (*BS, norb)
         pass
 
+    def get_smearing(self) -> Optional[Tuple[str, float]]:
+        """
+        Returns the smearing method and width (in Hartree) of the orbital
+        occupations in the self-consistent iterations, or ``None`` if the
+        occupations are fixed by ``get_orbweight``.
+        """
+        return None
+
+    def estimate_resources(self, xc: Union[str, BaseXC, None] = None,
+                           restricted: Optional[bool] = None) -> ResourceEstimate:
+        """
+        Estimate the peak memory and the rough number of floating point
+        operations of every stage of the calculation (integrals, density
+        fitting tensors, basis values on the grid, exchange-correlation,
+        coulomb, and exchange) from the sizes of the system before any of the
+        tensors is allocated. The strategies to keep the memory below
+        ``config.THRESHOLD_MEMORY`` are also chosen
+        (see :class:`~dqc.utils.resources.ResourceEstimate`).
+
+        Arguments
+        ---------
+        xc: str, BaseXC, or None
+            The exchange-correlation functional of the Kohn-Sham calculation.
+            If ``None``, it is the Hartree-Fock calculation.
+        restricted: bool or None
+            Whether the calculation is restricted. If ``None``, it is restricted
+            only for the system with zero spin.
+
+        Returns
+        -------
+        ResourceEstimate
+            The estimated resources and the chosen strategies.
+        """
+        raise NotImplementedError("Resources estimation is not implemented for %s" % type(self).__name__)
+
     @abstractmethod
     def get_nuclei_energy(self) -> torch.Tensor:
         """
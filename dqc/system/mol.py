@@ -5,16 +5,22 @@ from dqc.hamilton.base_hamilton import BaseHamilton
 from dqc.hamilton.hcgto import HamiltonCGTO
 from dqc.system.base_system import BaseSystem
 from dqc.grid.base_grid import BaseGrid
-from dqc.grid.factory import get_predefined_grid
+from dqc.grid.factory import get_predefined_grid, get_predefined_grid_size
+from dqc.xc.base_xc import BaseXC
 from dqc.utils.datastruct import CGTOBasis, AtomCGTOBasis, SpinParam, ZType, \
                                  is_z_float, BasisInpType, DensityFitInfo, \
                                  AtomZsType, AtomPosType
 from dqc.utils.periodictable import get_atomz, get_atom_mass
 from dqc.utils.safeops import occnumber, safe_cdist
+from dqc.utils.smearing import SMEARING_METHODS
+from dqc.utils.resources import ResourceEstimate, estimate_resources, get_nao
 from dqc.api.loadbasis import loadbasis
+from dqc.api.getxc import get_xc
+from dqc.api.auxbasis import get_auxbasis_name, autoaux
 from dqc.api.parser import parse_moldesc
 from dqc.utils.cache import Cache
 from dqc.utils.misc import logger
+from dqc.utils.profiler import stage_timer
 
 __all__ = ["Mol"]
 
@@ -46,6 +52,13 @@ class Mol(BaseSystem):
     * orb_weights: SpinParam[torch.Tensor] or None
         Specifiying the orbital occupancy (or weights) directly. If specified,
         ``spin`` and ``charge`` arguments are ignored.
+    * smearing: str or None
+        If specified, the orbital occupations in the self-consistent iterations
+        are smeared around the chemical potential, keeping the number of
+        electrons of each spin. The options are ``"fermi"``, ``"gaussian"``,
+        and ``"methfessel-paxton"``. If ``None``, the occupations are fixed.
+    * smearing_width: float
+        The width of the smearing in Hartree.
     * vext: tensor or None
         The tensor describing the external potential given in the grid.
         The grid position can be obtained by ``Mol().get_grid().get_rgrid()``.
@@ -71,6 +84,13 @@ class Mol(BaseSystem):
     * ao_parameterizer: str
         (computational option)
         Specifying the atomic orbital parameterizer.
+    * grid_dtype: torch.dtype or None
+        (computational option)
+        The data type of the basis values on the grid and their products in
+        the exchange-correlation calculations. Setting it to ``torch.float32``
+        enables the mixed precision mode, where the grid operations run in
+        single precision while the density, the Fock matrix, and the energy
+        are accumulated in ``dtype``. If ``None``, it is the same as ``dtype``.
     """
 
     def __init__(self,
@@ -79,11 +99,14 @@ class Mol(BaseSystem):
                  *,
                  orthogonalize_basis: bool = True,
                  ao_parameterizer: str = "qr",
+                 grid_dtype: Optional[torch.dtype] = None,
 
                  grid: Union[int, str] = "sg3",
                  spin: Optional[ZType] = None,
                  charge: ZType = 0,
                  orb_weights: Optional[SpinParam[torch.Tensor]] = None,
+                 smearing: Optional[str] = None,
+                 smearing_width: float = 1e-2,
                  efield: Union[torch.Tensor, Tuple[torch.Tensor, ...], None] = None,
                  vext: Optional[torch.Tensor] = None,
                  dtype: torch.dtype = torch.float64,
@@ -95,6 +118,7 @@ class Mol(BaseSystem):
         self._basis_inp = basis
         self._grid: Optional[BaseGrid] = None
         self._vext = vext
+        self._smearing = _get_smearing(smearing, smearing_width)
 
         # make efield a tuple
         self._efield = _normalize_efield(efield)
@@ -113,13 +137,16 @@ class Mol(BaseSystem):
         atombases = [AtomCGTOBasis(atomz=atz, bases=bas, pos=atpos)
                      for (atz, bas, atpos) in zip(atomzs, allbases, atompos)]
         self._atombases = atombases
+        self._atomauxbases: Optional[List[AtomCGTOBasis]] = None
         self._hamilton = HamiltonCGTO(atombases, efield=self._preproc_efield,
                                       vext=self._vext,
                                       cache=self._cache.add_prefix("hamilton"),
                                       orthozer=orthogonalize_basis,
-                                      aoparamzer=ao_parameterizer)
+                                      aoparamzer=ao_parameterizer,
+                                      grid_dtype=grid_dtype)
         self._orthogonalize_basis = orthogonalize_basis
         self._aoparamzer = ao_parameterizer
+        self._grid_dtype = grid_dtype
         self._atompos = atompos  # (natoms, ndim)
         self._atomzs = atomzs  # (natoms,) int-type or dtype if floating point
         self._atomzs_int = atomzs_int  # (natoms,) int-type rounded from atomzs
@@ -183,19 +210,20 @@ class Mol(BaseSystem):
 
         auxbasis: Optional[BasisInpType]
             Auxiliary basis for the density fit. If not specified, then it uses
-            ``"cc-pvtz-jkfit"``.
+            the official fitting basis that matches the orbital basis
+            (see :func:`~dqc.get_auxbasis_name`) or generates one with
+            :func:`~dqc.autoaux` if there is none.
+            If ``"autoaux"``, then the auxiliary basis is always generated.
         """
         if method is None:
             method = "coulomb"
-        if auxbasis is None:
-            # TODO: choose the auxbasis properly
-            auxbasis = "cc-pvtz-jkfit"
 
         # get the auxiliary basis
-        assert auxbasis is not None
-        auxbasis_lst = _parse_basis(self._atomzs_int, auxbasis)
+        auxbasis_lst = _get_auxbasis(self._atomzs_int, self._basis_inp,
+                                     [atb.bases for atb in self._atombases], auxbasis)
         atomauxbases = [AtomCGTOBasis(atomz=atz, bases=bas, pos=atpos)
                         for (atz, bas, atpos) in zip(self._atomzs, auxbasis_lst, self._atompos)]
+        self._atomauxbases = atomauxbases
 
         # change the hamiltonian to have density fit
         df = DensityFitInfo(method=method, auxbases=atomauxbases)
@@ -203,7 +231,8 @@ class Mol(BaseSystem):
                                       vext=self._vext,
                                       cache=self._cache.add_prefix("hamilton"),
                                       orthozer=self._orthogonalize_basis,
-                                      aoparamzer=self._aoparamzer)
+                                      aoparamzer=self._aoparamzer,
+                                      grid_dtype=self._grid_dtype)
         return self
 
     def get_hamiltonian(self) -> BaseHamilton:
@@ -248,6 +277,33 @@ class Mol(BaseSystem):
         else:
             return SpinParam(u=self._orb_weights_u, d=self._orb_weights_d)
 
+    def get_smearing(self) -> Optional[Tuple[str, float]]:
+        return self._smearing
+
+    def estimate_resources(self, xc: Union[str, BaseXC, None] = None,
+                           restricted: Optional[bool] = None) -> ResourceEstimate:
+        if isinstance(xc, str):
+            xc = get_xc(xc)
+        # Hartree-Fock has the full exact exchange without the xc functional
+        exx_coeffs = (1.0, 0.0, 0.0) if xc is None else xc.exx_coeffs
+        nxao = 0 if self._atomauxbases is None else get_nao(self._atomauxbases)
+
+        # use the grid size if it has been constructed, otherwise, count the
+        # points without calculating the integration weights
+        if self._grid is not None:
+            ngrid = self._grid.get_rgrid().shape[-2]
+        elif xc is not None or self.requires_grid():
+            ngrid = get_predefined_grid_size(self._grid_inp, self._atomzs_int)
+        else:
+            ngrid = 0
+
+        polarized = bool(self._spin != 0) if restricted is None else not restricted
+        return estimate_resources(
+            get_nao(self._atombases), nxao, ngrid,
+            xcfamily=0 if xc is None else xc.family,
+            exchange=bool(exx_coeffs[0] != 0), lr_exchange=bool(exx_coeffs[1] != 0),
+            polarized=polarized, dtype=self._dtype, grid_dtype=self._grid_dtype)
+
     def get_nuclei_energy(self) -> torch.Tensor:
         # atomzs: (natoms,)
         # atompos: (natoms, ndim)
@@ -258,6 +314,7 @@ class Mol(BaseSystem):
         q_by_r = z12 / r12
         return q_by_r.sum() * 0.5
 
+    @stage_timer("grid")
     def setup_grid(self) -> None:
         grid_inp = self._grid_inp
         logger.log("Constructing the integration grid")
@@ -361,6 +418,43 @@ def _parse_basis(atomzs: torch.Tensor, basis: BasisInpType) -> List[List[CGTOBas
         else:
             return basis  # type: ignore
 
+def _get_auxbasis(atomzs: torch.Tensor, basis: BasisInpType,
+                  allbases: List[List[CGTOBasis]],
+                  auxbasis: Optional[BasisInpType]) -> List[List[CGTOBasis]]:
+    # returns the list of auxiliary cgto basis for every atoms, choosing the
+    # auxiliary basis from the orbital basis if it is not specified
+    if auxbasis is not None and not (isinstance(auxbasis, str) and auxbasis.lower() == "autoaux"):
+        return _parse_basis(atomzs, auxbasis)
+
+    # get the name of the orbital basis for every atom (None if not given by name)
+    natoms = len(atomzs)
+    if isinstance(basis, str):
+        basis_names: List[Optional[str]] = [basis] * natoms
+    elif isinstance(basis, dict):
+        basis_dict = {int(get_atomz(k)): v for (k, v) in basis.items()}
+        basis_names = [v if isinstance(v, str) else None
+                       for v in [basis_dict[int(atomz)] for atomz in atomzs]]
+    elif len(basis) > 0 and isinstance(basis[0], str):
+        basis_names = list(basis)  # type: ignore
+    else:
+        basis_names = [None] * natoms
+
+    res: List[List[CGTOBasis]] = []
+    for atomz, bname, bases in zip(atomzs, basis_names, allbases):
+        auxname = get_auxbasis_name(bname) if (bname is not None and auxbasis is None) else None
+        if auxname is not None:
+            # the official fitting basis does not cover every element of its
+            # orbital basis (e.g. cc-pvtz-jkfit has no Li), then the auxiliary
+            # basis of that element is generated
+            try:
+                res.append(loadbasis("%d:%s" % (int(atomz), auxname)))
+                continue
+            except KeyError:
+                warnings.warn("The auxiliary basis %s is not available for atomz %d, "
+                              "generating the auxiliary basis with autoaux instead" % (auxname, int(atomz)))
+        res.append(autoaux(int(atomz), bases))
+    return res
+
 def _get_nelecs_spin(nelecs_tot: torch.Tensor, spin: Optional[ZType],
                      charge: ZType) -> Tuple[torch.Tensor, ZType, bool]:
     # get the number of electrons and spins
@@ -411,6 +505,16 @@ def _get_orb_weights(nelecs: torch.Tensor, spin: ZType, frac_mode: bool,
 
     return _orb_weights, _orb_weights_u, _orb_weights_d
 
+def _get_smearing(smearing: Optional[str], width: float) -> Optional[Tuple[str, float]]:
+    # check and returns the smearing method and width
+    if smearing is None:
+        return None
+    if smearing not in SMEARING_METHODS:
+        raise RuntimeError(f"Unknown smearing: {smearing}. Available options are: {SMEARING_METHODS}")
+    if width <= 0:
+        raise ValueError("The smearing width must be positive")
+    return (smearing, width)
+
 def _normalize_efield(efield: Union[torch.Tensor, Tuple[torch.Tensor, ...], None]) \
         -> Optional[Tuple[torch.Tensor, ...]]:
     # making efield a tuple or None
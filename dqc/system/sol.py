@@ -6,9 +6,10 @@ from dqc.hamilton.base_hamilton import BaseHamilton
 from dqc.hamilton.hcgto_pbc import HamiltonCGTO_PBC
 from dqc.system.base_system import BaseSystem
 from dqc.grid.base_grid import BaseGrid
-from dqc.grid.factory import get_predefined_grid
-from dqc.system.mol import _parse_basis, _get_nelecs_spin, \
-                           _get_orb_weights, AtomZsType, AtomPosType
+from dqc.grid.factory import get_predefined_grid, get_predefined_grid_size
+from dqc.xc.base_xc import BaseXC
+from dqc.system.mol import _parse_basis, _get_auxbasis, _get_nelecs_spin, \
+                           _get_orb_weights, _get_smearing, AtomZsType, AtomPosType
 from dqc.utils.datastruct import CGTOBasis, AtomCGTOBasis, ZType, BasisInpType, \
                                  SpinParam, DensityFitInfo
 from dqc.utils.safeops import safe_cdist
@@ -17,6 +18,9 @@ from dqc.api.parser import parse_moldesc
 from dqc.hamilton.intor.lattice import Lattice
 from dqc.hamilton.intor.pbcintor import PBCIntOption
 from dqc.utils.cache import Cache
+from dqc.utils.profiler import stage_timer
+from dqc.utils.resources import ResourceEstimate, estimate_resources, get_nao
+from dqc.api.getxc import get_xc
 
 __all__ = ["Sol"]
 
@@ -48,6 +52,13 @@ class Sol(BaseSystem):
     * orb_weights: SpinParam[torch.Tensor] or None
         Specifiying the orbital occupancy (or weights) directly. If specified,
         ``spin`` and ``charge`` arguments are ignored.
+    * smearing: str or None
+        If specified, the orbital occupations in the self-consistent iterations
+        are smeared around the chemical potential which is shared by all the
+        k-points. The options are ``"fermi"``, ``"gaussian"``, and
+        ``"methfessel-paxton"``. If ``None``, the occupations are fixed.
+    * smearing_width: float
+        The width of the smearing in Hartree.
     * dtype: torch.dtype
         The data type of tensors in this class.
     * device: torch.device
@@ -62,13 +73,17 @@ class Sol(BaseSystem):
                  grid: Union[int, str] = "sg3",
                  spin: Optional[ZType] = None,
                  lattsum_opt: Optional[Union[PBCIntOption, Dict]] = None,
+                 smearing: Optional[str] = None,
+                 smearing_width: float = 1e-2,
                  dtype: torch.dtype = torch.float64,
                  device: torch.device = torch.device('cpu'),
                  ):
         self._dtype = dtype
         self._device = device
         self._grid_inp = grid
+        self._basis_inp = basis
         self._grid: Optional[BaseGrid] = None
+        self._smearing = _get_smearing(smearing, smearing_width)
         charge = 0  # we can't have charged solids for now
 
         # get the AtomCGTOBasis & the hamiltonian
@@ -79,6 +94,7 @@ class Sol(BaseSystem):
         atombases = [AtomCGTOBasis(atomz=atz, bases=bas, pos=atpos)
                      for (atz, bas, atpos) in zip(atomzs, allbases, atompos)]
         self._atombases = atombases
+        self._atomauxbases: Optional[List[AtomCGTOBasis]] = None
         self._atompos = atompos  # (natoms, ndim)
         self._atomzs = atomzs  # (natoms,) int-type
         nelecs_tot: torch.Tensor = torch.sum(atomzs)
@@ -117,19 +133,20 @@ class Sol(BaseSystem):
 
         auxbasis: Optional[BasisInpType]
             Auxiliary basis for the density fit. If not specified, then it uses
-            ``"cc-pvtz-jkfit"``.
+            the official fitting basis that matches the orbital basis
+            (see :func:`~dqc.get_auxbasis_name`) or generates one with
+            :func:`~dqc.autoaux` if there is none.
+            If ``"autoaux"``, then the auxiliary basis is always generated.
         """
         if method is None:
             method = "gdf"
-        if auxbasis is None:
-            # TODO: choose the auxbasis properly
-            auxbasis = "cc-pvtz-jkfit"
 
         # get the auxiliary basis
-        assert auxbasis is not None
-        auxbasis_lst = _parse_basis(self._atomzs, auxbasis)
+        auxbasis_lst = _get_auxbasis(self._atomzs, self._basis_inp,
+                                     [atb.bases for atb in self._atombases], auxbasis)
         atomauxbases = [AtomCGTOBasis(atomz=atz, bases=bas, pos=atpos)
                         for (atz, bas, atpos) in zip(self._atomzs, auxbasis_lst, self._atompos)]
+        self._atomauxbases = atomauxbases
 
         # change the hamiltonian to have density fit
         df = DensityFitInfo(method=method, auxbases=atomauxbases)
@@ -170,6 +187,38 @@ class Sol(BaseSystem):
         else:
             return SpinParam(u=self._orb_weights_u, d=self._orb_weights_d)
 
+    def get_smearing(self) -> Optional[Tuple[str, float]]:
+        return self._smearing
+
+    def estimate_resources(self, xc: Union[str, BaseXC, None] = None,
+                           restricted: Optional[bool] = None) -> ResourceEstimate:
+        if isinstance(xc, str):
+            xc = get_xc(xc)
+        # Hartree-Fock has the full exact exchange without the xc functional
+        exx_coeffs = (1.0, 0.0, 0.0) if xc is None else xc.exx_coeffs
+        if self._atomauxbases is None:
+            nxao = 0
+            nkpts = 1
+        else:
+            nxao = get_nao(self._atomauxbases)
+            nkpts = self._hamilton.kpts.shape[0]
+
+        # the grid size without the integration weights is an upper bound
+        # because only the points inside the lattice are used
+        if self._grid is not None:
+            ngrid = self._grid.get_rgrid().shape[-2]
+        elif xc is not None:
+            ngrid = get_predefined_grid_size(self._grid_inp, self._atomzs)
+        else:
+            ngrid = 0
+
+        polarized = bool(self._spin != 0) if restricted is None else not restricted
+        return estimate_resources(
+            get_nao(self._atombases), nxao, ngrid,
+            xcfamily=0 if xc is None else xc.family, nkpts=nkpts,
+            exchange=bool(exx_coeffs[0] != 0), lr_exchange=bool(exx_coeffs[1] != 0),
+            polarized=polarized, dtype=self._dtype)
+
     def get_nuclei_energy(self) -> torch.Tensor:
         # self._atomzs: (natoms,)
         # self._atompos: (natoms, ndim)
@@ -224,6 +273,7 @@ class Sol(BaseSystem):
         eii = short_range + long_range + vbar
         return eii * 0.5
 
+    @stage_timer("grid")
     def setup_grid(self) -> None:
         self._grid = get_predefined_grid(self._grid_inp, self._atomzs, self._atompos,
                                          lattice=self._lattice,
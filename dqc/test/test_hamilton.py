@@ -178,6 +178,176 @@ def test_cgto_ao_params(system1):
     assert torch.allclose(dm, dm2)
     assert torch.allclose(penalty, torch.zeros_like(penalty))
 
+def test_cgto_elrep_exchange(system1):
+    # test the electron repulsion and the exchange operators from a single
+    # sweep against the separate calculations
+    from dqc.utils.config import config
+    from dqc.utils.datastruct import SpinParam
+    h = system1.get_hamiltonian()
+    nao = h.nao
+    dm = torch.randn((2, nao, nao), dtype=dtype)
+    dm = dm + dm.transpose(-2, -1)
+
+    chunk_mem0 = config.CHUNK_MEMORY
+    try:
+        # small chunks to have multiple chunks in the sweep
+        config.CHUNK_MEMORY = 8 * nao ** 3
+        elrep, exch = h.get_elrep_exchange(dm)
+        assert torch.allclose(elrep.fullmatrix(), h.get_elrep(dm).fullmatrix())
+        assert torch.allclose(exch.fullmatrix(), h.get_exchange(dm).fullmatrix())
+
+        dmspin = SpinParam(u=dm[0], d=dm[1])
+        elrep, exch = h.get_elrep_exchange(dmspin)
+        exch_true = h.get_exchange(dmspin)
+        assert torch.allclose(elrep.fullmatrix(), h.get_elrep(dm[0] + dm[1]).fullmatrix())
+        assert torch.allclose(exch.u.fullmatrix(), exch_true.u.fullmatrix())
+        assert torch.allclose(exch.d.fullmatrix(), exch_true.d.fullmatrix())
+    finally:
+        config.CHUNK_MEMORY = chunk_mem0
+
+def test_cgto_dens_screening_all(system1):
+    # if all the grid points are screened, the xc energy and potential must be
+    # zero without calling the xc with 0 points
+    from dqc.utils.config import config
+    from dqc.utils.datastruct import SpinParam
+    from dqc.api.getxc import get_xc
+    h = system1.get_hamiltonian()
+    h.setup_grid(system1.get_grid(), get_xc("gga_x_pbe"))
+    dm = torch.eye(h.nao, dtype=dtype)
+
+    thresh0 = config.XC_DENS_THRESHOLD
+    stream0 = config.STREAM_XC
+    try:
+        config.XC_DENS_THRESHOLD = 1e10
+        for stream in [False, True]:
+            config.STREAM_XC = stream
+            exc, vxc = h.get_e_xc_vxc(dm)
+            assert torch.allclose(exc, torch.zeros_like(exc))
+            assert torch.allclose(h.get_e_xc(dm), torch.zeros_like(exc))
+            assert torch.allclose(vxc.fullmatrix(), torch.zeros_like(dm))
+            assert torch.allclose(h.get_vxc(dm).fullmatrix(), torch.zeros_like(dm))
+
+            vxc_pol = h.get_vxc(SpinParam(u=dm * 0.5, d=dm * 0.5))
+            assert torch.allclose(vxc_pol.u.fullmatrix(), torch.zeros_like(dm))
+            assert torch.allclose(vxc_pol.d.fullmatrix(), torch.zeros_like(dm))
+            assert h.xc_screened_frac == 1.0
+    finally:
+        config.XC_DENS_THRESHOLD = thresh0
+        config.STREAM_XC = stream0
+
+@pytest.mark.parametrize("xcname", ["gga_x_pbe", "mgga_x_scan"])
+def test_cgto_stacked_basis(system1, xcname):
+    # the density gradient and the vxc matrix from the stacked basis and its
+    # gradient must be the same as the separate contractions
+    from dqc.api.getxc import get_xc
+    from dqc.utils.datastruct import ValGrad
+    h = system1.get_hamiltonian()
+    h.setup_grid(system1.get_grid(), get_xc(xcname))
+    assert torch.allclose(h.basis_stack[0], h.basis)
+    nao = h.nao
+    dm = torch.randn((nao, nao), dtype=dtype)
+    dm = dm + dm.transpose(-2, -1)
+
+    dmdmt = h._get_dmdmt(dm)
+    densinfo = h._dm2densinfo(dm)
+    dmao = h.basis @ dmdmt
+    dens_true = torch.einsum("ri,ri->r", dmao, h.basis)
+    gdens_true = torch.einsum("ri,dri->dr", dmao, h.grad_basis) * 2
+    assert torch.allclose(densinfo.value, dens_true)
+    assert torch.allclose(densinfo.grad, gdens_true)
+
+    # use the density information as the potential information
+    potinfo = ValGrad(value=densinfo.value, grad=densinfo.grad)
+    if h.xcfamily == 4:
+        potinfo.lapl = torch.zeros_like(densinfo.value)
+        potinfo.kin = torch.zeros_like(densinfo.value)
+    mat = h._get_vxc_from_potinfo(potinfo).fullmatrix()
+    vb = potinfo.value.unsqueeze(-1) * h.basis + \
+        torch.einsum("dr,dri->ri", potinfo.grad * 2, h.grad_basis)
+    mat_true = h._orthozer.convert2(h.basis_dvolume.transpose(-2, -1) @ vb)
+    mat_true = (mat_true + mat_true.transpose(-2, -1)) * 0.5
+    assert torch.allclose(mat, mat_true)
+
+@pytest.mark.parametrize(
+    "xcname,use_factor",
+    # the factors of rank 1 are not cheaper for GGA in the small basis
+    [("lda_x", True), ("gga_x_pbe", False), ("mgga_x_scan", True)]
+)
+def test_cgto_dm_factor(system1, xcname, use_factor):
+    # the density information from the factors of a low-rank density matrix
+    # (only used without the gradient) must be the same as from the full
+    # density matrix
+    from dqc.api.getxc import get_xc
+    h = system1.get_hamiltonian()
+    h.setup_grid(system1.get_grid(), get_xc(xcname))
+    nao = h.nao
+    orb = torch.randn((2, nao, 1), dtype=dtype)
+    occ = torch.tensor([[2.0], [-0.5]], dtype=dtype)
+    dm = h.ao_orb2dm(orb, occ)
+
+    with torch.no_grad():
+        dmfac = h._get_dm_factor(h._get_dmdmt(dm))
+        densinfo = h._dm2densinfo(dm)
+    if use_factor:
+        assert dmfac is not None
+        assert dmfac[0].shape == (2, h.basis.shape[-1], 1)
+    else:
+        assert dmfac is None
+
+    # the full density matrix is used if the gradient is required
+    dm_grad = dm.clone().requires_grad_()
+    assert h._get_dm_factor(h._get_dmdmt(dm_grad)) is None
+    densinfo_true = h._dm2densinfo(dm_grad)
+    for comp in ["value", "grad", "lapl", "kin"]:
+        val = getattr(densinfo, comp)
+        if val is not None:
+            assert torch.allclose(val, getattr(densinfo_true, comp))
+
+def test_cgto_autotune_chunk(system1, tmp_path):
+    # the vxc with the autotuned chunk memory must be the same as with the
+    # default chunk memory
+    from dqc.utils.config import config
+    from dqc.api.getxc import get_xc
+    h = system1.get_hamiltonian()
+    h.setup_grid(system1.get_grid(), get_xc("gga_x_pbe"))
+    nao = h.nao
+    dm = torch.randn((nao, nao), dtype=dtype)
+    dm = dm + dm.transpose(-2, -1)
+    vxc0 = h.get_vxc(dm).fullmatrix()
+
+    autotune0 = config.AUTOTUNE_CHUNK
+    fname0 = config.AUTOTUNE_FILE
+    try:
+        config.AUTOTUNE_CHUNK = True
+        config.AUTOTUNE_FILE = str(tmp_path / "autotune.json")
+        vxc1 = h.get_vxc(dm).fullmatrix()
+        assert (tmp_path / "autotune.json").exists()
+    finally:
+        config.AUTOTUNE_CHUNK = autotune0
+        config.AUTOTUNE_FILE = fname0
+    assert torch.allclose(vxc0, vxc1)
+
+def test_cgto_elrep_df_packed():
+    # test the electron repulsion from the packed 3-centre integrals against
+    # the contraction with the full 3-centre integrals
+    poss = torch.tensor([[0.0, 0.0, 0.8], [0.0, 0.0, -0.8]], dtype=dtype)
+    m = Mol(([1, 1], poss), basis="3-21G", dtype=dtype, orthogonalize_basis=False)
+    m.densityfit(method="coulomb", auxbasis="def2-sv(p)-jkfit")
+    h = m.get_hamiltonian()
+    h.build()
+    nao = h.nao
+
+    dm = torch.randn((2, nao, nao), dtype=dtype)
+    dm = dm + dm.transpose(-2, -1)
+    j3c = h.df.j3c  # (nao, nao, nxao)
+    assert tuple(j3c.shape[:2]) == (nao, nao)
+    assert torch.allclose(j3c, j3c.transpose(0, 1))
+
+    coeffs = torch.einsum("...ij,ijk,kl->...l", dm, j3c, torch.inverse(h.df.j2c))
+    mat_true = torch.einsum("...l,ijl->...ij", coeffs, j3c)
+    mat = h.get_elrep(dm).fullmatrix()
+    assert torch.allclose(mat, mat_true)
+
 def test_pbc_cgto_nuclattr(pbc_h1):
     import numpy as np
     # nuc = pbc_h1.get_nuc()
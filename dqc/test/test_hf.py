@@ -1,10 +1,12 @@
 from itertools import product
+import warnings
 import numpy as np
 import torch
 import pytest
 import xitorch as xt
 from dqc.api.loadbasis import loadbasis
 from dqc.qccalc.hf import HF
+from dqc.qccalc.scf_qccalc import _lbfgs_minimize
 from dqc.system.mol import Mol
 from dqc.system.sol import Sol
 from dqc.utils.safeops import safepow, safenorm
@@ -205,6 +207,170 @@ def test_uhf_energy_mols(atomzs, dist, spin, energy_true, variational):
     ene = qc.energy()
     assert torch.allclose(ene, ene * 0 + energy_true, rtol=1e-8, atol=0.0)
 
+@pytest.mark.parametrize(
+    "atomzs,dist,restricted",
+    [(*atomzs_poss[1], True), (*atomzs_poss[4], True), (*atomzs_poss[4], False)]
+)
+def test_hf_energy_lobpcg(atomzs, dist, restricted):
+    # the warm-started iterative eigensolver must give the same energy as the
+    # dense eigendecomposition
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    ene = HF(mol, restricted=restricted).run().energy()
+    qc = HF(mol, restricted=restricted).run(eigen_options={"method": "lobpcg", "min_nao": 0})
+    assert torch.allclose(qc.energy(), ene, rtol=1e-8)
+
+@pytest.mark.parametrize(
+    "atomzs,dist,restricted,scheme",
+    [(*atomzs_poss[1], True, "trs4"), (*atomzs_poss[4], True, "canonical"), (*atomzs_poss[4], False, "trs4")]
+)
+def test_hf_energy_purification(atomzs, dist, restricted, scheme):
+    # the density matrix from the purification must give the same energy and
+    # forces as from the diagonalization
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype, requires_grad=True) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    ene = HF(mol, restricted=restricted).run().energy()
+    qc = HF(mol, restricted=restricted).run(eigen_options={"method": "purification", "scheme": scheme})
+    ene_pur = qc.energy()
+    assert torch.allclose(ene_pur, ene, rtol=1e-8)
+
+    grad, = torch.autograd.grad(ene, poss)
+    grad_pur, = torch.autograd.grad(ene_pur, poss)
+    assert torch.allclose(grad_pur, grad, rtol=1e-6, atol=1e-8)
+
+@pytest.mark.parametrize(
+    "atomzs,dist,spin,energy_true",
+    [(*atomz_pos, 0, energy) for (atomz_pos, energy) in zip(atomzs_poss, energies)] +
+    [(atomzs, dist, spin, energy) for ((atomzs, dist, spin), energy) in zip(u_mols_dists_spins, u_mols_energies)]
+)
+def test_hf_energy_newton(atomzs, dist, spin, energy_true):
+    # the second-order minimization of the orbital rotations must reach the
+    # same energy as pyscf
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype, spin=spin)
+    qc = HF(mol, restricted=(spin == 0), variational=True).run(fwd_options={"method": "newton"})
+    ene = qc.energy()
+    assert torch.allclose(ene, ene * 0 + energy_true, rtol=1e-8, atol=0.0)
+
+@pytest.mark.parametrize(
+    "atomzs,dist,energy_true",
+    [(*atomz_pos, energy) for (atomz_pos, energy) in zip(atomzs_poss, energies)]
+)
+def test_rhf_energy_lbfgs_maxiter(atomzs, dist, energy_true):
+    # the preconditioned L-BFGS in the variational method should converge
+    # within a small number of iterations
+    torch.manual_seed(123)
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter("always")
+        qc = HF(mol, restricted=True, variational=True).run(fwd_options={"maxiter": 100})
+    assert not any("does not converge" in str(w.message) for w in warns)
+    ene = qc.energy()
+    assert torch.allclose(ene, ene * 0 + energy_true, rtol=1e-7)
+
+def test_rhf_lbfgs_options():
+    # unknown options of the L-BFGS must not be ignored, and the minimization
+    # must not be reported as converged if the line search fails
+    atomzs, dist = atomzs_poss[0]
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    with pytest.raises(TypeError, match="max_iter"):
+        HF(mol, restricted=True, variational=True).run(fwd_options={"max_iter": 100})
+
+    def fcn(y):
+        # wrong gradient direction, so the function never decreases
+        return (y * y).sum(), -2 * y
+
+    y0 = torch.ones(3, dtype=dtype)
+    with pytest.warns(UserWarning, match="line search"):
+        _lbfgs_minimize(fcn, y0, [])
+
+@pytest.mark.parametrize(
+    "atomzs,dist,restricted,fwd_options",
+    [(*atomzs_poss[1], True, {"method": "diis"}),
+     (*atomzs_poss[4], True, {"method": "diis", "level_shift": 0.5, "damping": [0.5, 0.3, 0.1]}),
+     (*atomzs_poss[4], False, {"method": "diis", "level_shift": lambda i: 1.0 / (i + 1), "diis_start_err": 1e-2})]
+)
+def test_hf_energy_diis(atomzs, dist, restricted, fwd_options):
+    # the DIIS iterations with the level shift and damping schedules must
+    # converge to the same energy and forces
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype, requires_grad=True) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    ene = HF(mol, restricted=restricted).run().energy()
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter("always")
+        ene_diis = HF(mol, restricted=restricted).run(fwd_options=fwd_options).energy()
+    assert not any("does not converge" in str(w.message) for w in warns)
+    assert torch.allclose(ene_diis, ene, rtol=1e-8)
+
+    grad, = torch.autograd.grad(ene, poss)
+    grad_diis, = torch.autograd.grad(ene_diis, poss)
+    assert torch.allclose(grad_diis, grad, rtol=1e-6, atol=1e-8)
+
+def test_hf_diis_unconverged():
+    # the DIIS iterations stopped before converging must return the fock
+    # matrix of the last density matrix without the level shift
+    atomzs, dist = atomzs_poss[4]
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    qc = HF(mol, restricted=True).run()
+    engine = qc._engine
+    ovlp = mol.get_hamiltonian().get_overlap().fullmatrix()
+
+    # a single level-shifted step from the core hamiltonian guess
+    fock0 = engine.dm2scp(torch.zeros_like(qc.aodm()))
+    options = {"maxiter": 1, "level_shift": 1.0, "diis_start_err": 0.0, "diis_start_cycle": 10}
+    with pytest.warns(UserWarning, match="does not converge"):
+        fock = qc._diis_scf(engine.dm2scp, fock0, [], **options)
+
+    dm0 = engine.scp2dm(fock0)
+    fock_shift = engine.dm2scp(dm0) + (ovlp - torch.matmul(ovlp, torch.matmul(dm0, ovlp)) / 2.0)
+    dm1 = engine.scp2dm(fock_shift)
+    assert torch.allclose(fock, engine.dm2scp(dm1))
+    assert not torch.allclose(fock, fock_shift)
+
+@pytest.mark.parametrize(
+    "atomzs,dist,restricted,smearing",
+    [(*atomzs_poss[0], True, "fermi"), (*atomzs_poss[4], True, "gaussian"),
+     (*atomzs_poss[4], False, "methfessel-paxton")]
+)
+def test_hf_energy_smearing(atomzs, dist, restricted, smearing):
+    # smearing with a small width on a system with a gap must give the same
+    # energy and forces as the integer occupations
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype, requires_grad=True) * dist
+    mol = Mol((atomzs, poss), basis=basis, dtype=dtype)
+    ene = HF(mol, restricted=restricted).run().energy()
+    mol_smear = Mol((atomzs, poss), basis=basis, dtype=dtype, smearing=smearing, smearing_width=1e-3)
+    ene_smear = HF(mol_smear, restricted=restricted).run().energy()
+    assert mol_smear.get_hamiltonian().wkpts is None
+    assert torch.allclose(ene_smear, ene, rtol=1e-8)
+
+    grad, = torch.autograd.grad(ene, poss)
+    grad_smear, = torch.autograd.grad(ene_smear, poss)
+    assert torch.allclose(grad_smear, grad, rtol=1e-6, atol=1e-8)
+
+@pytest.mark.parametrize(
+    "variational,fwd_options",
+    [(False, None), (False, {"method": "diis"}), (True, {"method": "newton"})]
+)
+def test_hf_callback_stats(variational, fwd_options):
+    # the callback must be called every iteration and the statistics must
+    # summarize the iterations
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * 2.0
+    mol = Mol(([6, 8], poss), basis=basis, dtype=dtype)
+    infos = []
+    qc = HF(mol, variational=variational).run(fwd_options=fwd_options, callback=infos.append)
+    stats = qc.stats()
+    assert len(infos) > 0
+    assert stats.niter == len(infos)
+    assert [info.niter for info in infos] == list(range(len(infos)))
+    assert abs(infos[-1].energy - float(qc.energy())) < 1e-6
+    assert infos[-1].grad_norm < 1e-5
+    assert stats.nfock > 0 and stats.ndiag > 0
+    assert "JK" in stats.stage_times and "diag" in stats.stage_times
+    assert stats.time >= sum(info.time for info in infos) * 0.99
+
 ############## Fractional charge ##############
 def test_rhf_frac_energy():
     # test if fraction of atomz produces close/same results with integer atomz
@@ -110,6 +110,118 @@ def test_rks_energy(xc, atomzs, dist, energy_true, grid, variational):
     # < 1 kcal/mol
     assert torch.allclose(ene, ene * 0 + energy_true, atol=1.3e-3, rtol=0)
 
+@pytest.mark.parametrize(
+    "xc,atomzs,dist,restricted",
+    [(xc, *atzpos, True) for (xc, atzpos) in product(["lda_x", "gga_x_pbe", "mgga_x_scan"], atomzs_poss[:3])] +
+    [(xc, *atomzs_poss[1], False) for xc in ["lda_x", "gga_x_pbe", "mgga_x_scan"]]
+)
+def test_ks_energy_mixed_precision(xc, atomzs, dist, restricted):
+    # the energy and the fock matrix with float32 values on the grid must be
+    # close to the one from the full float64 calculation
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis="6-311++G**", dtype=dtype, grid=3)
+    mol32 = Mol((atomzs, poss), basis="6-311++G**", dtype=dtype, grid=3, grid_dtype=torch.float32)
+    qc = KS(mol, xc=xc, restricted=restricted).run()
+    qc32 = KS(mol32, xc=xc, restricted=restricted).run()
+    ene = qc.energy()
+    ene32 = qc32.energy()
+    assert ene32.dtype == dtype
+    assert torch.allclose(ene, ene32, atol=1e-5, rtol=0)
+
+    # fock matrix from the same density matrix
+    dm = qc.aodm()
+    vxc = qc.get_system().get_hamiltonian().get_vxc(dm)
+    vxc32 = qc32.get_system().get_hamiltonian().get_vxc(dm)
+    if restricted:
+        focks = [(vxc.fullmatrix(), vxc32.fullmatrix())]
+    else:
+        focks = [(vxc.u.fullmatrix(), vxc32.u.fullmatrix()), (vxc.d.fullmatrix(), vxc32.d.fullmatrix())]
+    for fock, fock32 in focks:
+        assert fock32.dtype == dtype
+        assert torch.allclose(fock, fock32, atol=1e-5, rtol=0)
+
+# xc and spin cases of the tests on the xc evaluation of the N2 molecule
+xc_restricted_cases = list(product(["lda_x", "gga_x_pbe", "mgga_x_scan"], [True, False]))
+
+def _run_xc_ks(xc, restricted, dist_tensor=None, **config_values):
+    # run the KS calculation of the N2 molecule from atomzs_poss with the
+    # given config values, which are restored afterwards
+    atomzs, dist = atomzs_poss[2]
+    if dist_tensor is None:
+        dist_tensor = torch.tensor(dist, dtype=dtype)
+    vals0 = {key: getattr(config, key) for key in config_values}
+    try:
+        for key, val in config_values.items():
+            setattr(config, key, val)
+        poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist_tensor
+        mol = Mol((atomzs, poss), basis="3-21G", dtype=dtype, grid=3)
+        qc = KS(mol, xc=xc, restricted=restricted).run()
+        ene = qc.energy()
+        grad = None
+        if dist_tensor.requires_grad:
+            grad, = torch.autograd.grad(ene, dist_tensor)
+    finally:
+        for key, val in vals0.items():
+            setattr(config, key, val)
+    return qc, ene, grad
+
+@pytest.mark.parametrize("xc,restricted", xc_restricted_cases)
+def test_ks_energy_dens_screening(xc, restricted):
+    # the grid points with negligible density should not change the energy
+    # and its gradient
+    dist_tensor = torch.tensor(atomzs_poss[2][1], dtype=dtype, requires_grad=True)
+    qc0, ene0, grad0 = _run_xc_ks(xc, restricted, dist_tensor, XC_DENS_THRESHOLD=0.0)
+    qc, ene, grad = _run_xc_ks(xc, restricted, dist_tensor, XC_DENS_THRESHOLD=1e-10)
+
+    assert qc0.get_system().get_hamiltonian().xc_screened_frac == 0.0
+    assert qc.get_system().get_hamiltonian().xc_screened_frac > 0.0
+    assert torch.allclose(ene0, ene, atol=1e-7, rtol=0)
+    assert torch.allclose(grad0, grad, atol=1e-6, rtol=0)
+
+@pytest.mark.parametrize("xc,restricted", xc_restricted_cases)
+def test_ks_energy_streamed_xc(xc, restricted):
+    # evaluating the xc chunk by chunk of the grid points must give the same
+    # energy and gradient as the evaluation on the whole grid
+    dist_tensor = torch.tensor(atomzs_poss[2][1], dtype=dtype, requires_grad=True)
+    _, ene0, grad0 = _run_xc_ks(xc, restricted, dist_tensor, STREAM_XC=False)
+    # small chunks to make sure the grid is split into several chunks
+    _, ene, grad = _run_xc_ks(xc, restricted, dist_tensor, STREAM_XC=True, CHUNK_MEMORY=64 * 1024)
+
+    assert torch.allclose(ene0, ene)
+    assert torch.allclose(grad0, grad)
+
+@pytest.mark.parametrize("xc,restricted", xc_restricted_cases)
+def test_ks_e_xc_vxc(xc, restricted):
+    # the xc energy and potential from a single evaluation must be the same
+    # as the separate evaluations, and the KS engine only evaluates them once
+    # for the same density matrix
+    qc, _, _ = _run_xc_ks(xc, restricted)
+    dm = qc.aodm()
+    engine = qc._engine
+    h = engine.hamilton
+
+    def fullmatrix(vxc):
+        if isinstance(vxc, xt.LinearOperator):
+            return vxc.fullmatrix()
+        return torch.stack((vxc.u.fullmatrix(), vxc.d.fullmatrix()), dim=0)
+
+    e_xc, vxc = h.get_e_xc_vxc(dm)
+    assert torch.allclose(e_xc, h.get_e_xc(dm))
+    assert torch.allclose(fullmatrix(vxc), fullmatrix(h.get_vxc(dm)))
+
+    # count the xc evaluations in the engine
+    ncalls = []
+    get_e_xc_vxc = h.get_e_xc_vxc
+    h.get_e_xc_vxc = lambda dm: ncalls.append(1) or get_e_xc_vxc(dm)
+    with torch.no_grad():
+        ene = engine.dm2energy(dm)
+        fock = engine.dm2scp(dm)
+        ene2 = engine.dm2energy(dm)
+    assert len(ncalls) == 1
+    assert torch.allclose(ene, qc.energy())
+    assert torch.allclose(ene, ene2)
+    assert torch.allclose(fock, engine.dm2scp(dm))
+
 @pytest.mark.parametrize(
     "xc,atomzs,dist,grad2",
     [("lda_x", *atomz_pos, grad2) for (atomz_pos, grad2) in product(atomzs_poss, [False, True])]
@@ -258,6 +370,33 @@ def test_no_xc(atomzs, dist, restricted):
 
         assert torch.allclose(ene1, ene2)
 
+class PseudoHybrid(PseudoLDA):
+    def __init__(self, a, p, exx_coeffs):
+        super().__init__(a, p)
+        self._exx_coeffs = exx_coeffs
+
+    @property
+    def exx_coeffs(self):
+        return self._exx_coeffs
+
+@pytest.mark.parametrize(
+    "exx_coeffs,restricted",
+    product([(1.0, 0.0, 0.0), (0.4, 0.6, 1e3)], [True, False])
+)
+def test_hybrid_full_exchange(exx_coeffs, restricted):
+    # a hybrid with the full exact exchange and without the semilocal part
+    # must give the same energy as Hartree-Fock. The long-range exchange with
+    # a very large omega is the full-range exchange.
+    from dqc.qccalc.hf import HF
+    atomzs, dist = atomzs_poss[0]
+    poss = torch.tensor([[-0.5, 0.0, 0.0], [0.5, 0.0, 0.0]], dtype=dtype) * dist
+    mol = Mol((atomzs, poss), basis="3-21G", dtype=dtype, grid=3)
+
+    xc = PseudoHybrid(0.0, 4. / 3, exx_coeffs)
+    ene = KS(mol, xc=xc, restricted=restricted).run().energy()
+    ene_hf = HF(mol, restricted=restricted).run().energy()
+    assert torch.allclose(ene, ene_hf, atol=1e-6)
+
 @pytest.mark.parametrize(
     "atomzs,dist",
     [atomzs_poss[0]]
@@ -570,6 +709,59 @@ def test_pbc_rks_energy(xc, atomzs, spin, alattice, energy_true, grid):
     # TODO: make a better grid
     assert torch.allclose(ene, energy_true, rtol=1e-3)
 
+@pytest.mark.parametrize(
+    "xc",
+    ["lda_x", "gga_x_pbe"]
+)
+def test_pbc_uks_energy_dens_screening(xc):
+    # the density screening of the periodic systems must not change the
+    # energy and the screened fraction must be of the grid points
+    atomzs, spin, alattice = pbc_atomz_spin_latt[0]
+    alattice = torch.as_tensor(alattice, dtype=dtype)
+    poss = torch.tensor([[0.0, 0.0, 0.0]], dtype=dtype)
+
+    def get_energy():
+        mol = Sol((atomzs, poss), basis="3-21G", spin=spin, alattice=alattice, dtype=dtype, grid="sg3")
+        mol.densityfit(method="gdf", auxbasis="def2-sv(p)-jkfit")
+        qc = KS(mol, xc=xc, restricted=False).run()
+        return qc.energy(), mol.get_hamiltonian().xc_screened_frac
+
+    thresh0 = config.XC_DENS_THRESHOLD
+    try:
+        config.XC_DENS_THRESHOLD = 0.0
+        ene0, frac0 = get_energy()
+        config.XC_DENS_THRESHOLD = 1e-10
+        ene, frac = get_energy()
+    finally:
+        config.XC_DENS_THRESHOLD = thresh0
+
+    assert frac0 == 0.0
+    assert 0.0 <= frac < 1.0
+    assert torch.allclose(ene0, ene, atol=1e-7, rtol=0)
+
+@pytest.mark.parametrize(
+    "smearing",
+    ["fermi", "gaussian"]
+)
+def test_pbc_uks_energy_smearing(smearing):
+    # the occupations smeared over the k-points with a small width must give
+    # the same energy as the integer occupations for a system with a gap
+    atomzs, spin, alattice = pbc_atomz_spin_latt[0]
+    alattice = torch.as_tensor(alattice, dtype=dtype)
+    poss = torch.tensor([[0.0, 0.0, 0.0]], dtype=dtype)
+
+    def get_energy(**kwargs):
+        mol = Sol((atomzs, poss), basis="3-21G", spin=spin, alattice=alattice, dtype=dtype, grid="sg3",
+                  **kwargs)
+        mol.densityfit(method="gdf", auxbasis="def2-sv(p)-jkfit")
+        qc = KS(mol, xc="lda_x", restricted=False).run()
+        assert mol.get_hamiltonian().wkpts is not None
+        return qc.energy()
+
+    ene = get_energy()
+    ene_smear = get_energy(smearing=smearing, smearing_width=1e-3)
+    assert torch.allclose(ene_smear, ene, rtol=1e-8)
+
 if __name__ == "__main__":
     import time
     xc = "lda_x"
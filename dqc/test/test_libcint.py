@@ -198,6 +198,42 @@ def test_integral_with_subset(intc_type):
     else:
         raise RuntimeError("Unknown integral type: %s" % intc_type)
 
+@pytest.mark.parametrize(
+    "nthreads",
+    [2, 5]
+)
+def test_integral_multithreads(nthreads):
+    # check if the integrals evaluated in the thread pool agree with the
+    # integrals evaluated in a single thread
+    from dqc.utils.config import config
+
+    atomenv = get_atom_env(dtype, basis="6-311++G**", ngrid=100)
+    env = get_wrapper(atomenv, spherical=True)
+    env1 = env[: len(env) // 2]
+
+    def calc_all():
+        return [
+            intor.overlap(env),
+            intor.nuclattr(env, other=env1),
+            intor.coul3c(env),
+            intor.elrep(env),
+            intor.elrep(env, other1=env1, other3=env1),
+            intor.eval_gradgto(env, atomenv.rgrid),
+        ]
+
+    nthreads0 = config.INTOR_NTHREADS
+    try:
+        config.INTOR_NTHREADS = 1
+        mats1 = calc_all()
+        config.INTOR_NTHREADS = nthreads
+        mats = calc_all()
+    finally:
+        config.INTOR_NTHREADS = nthreads0
+
+    for mat1, mat in zip(mats1, mats):
+        assert mat1.shape == mat.shape
+        assert torch.allclose(mat1, mat)
+
 def test_nuc_integral_frac_atomz():
     # test the nuclear integral with fractional atomz
     atomenv1 = get_atom_env(dtype, atomz=1)
@@ -227,6 +263,54 @@ def test_nuc_integral_frac_atomz():
     nuc15 = (nuc1 + nuc2) * 0.5
     assert torch.allclose(nuc15, nuc15f)
 
+def test_rinv_integral_batch():
+    # test the rinv integrals centred on multiple positions at once against
+    # the integrals centred on every position individually
+    atomenv = get_atom_env(dtype)
+    env = get_wrapper(atomenv, spherical=True)
+    env1 = env[: len(env) // 2]
+    rinv_poss = torch.tensor([[0.1, 0.2, 0.3], [-0.4, 0.5, -0.2], [0.0, -1.0, 0.7]], dtype=dtype)
+
+    for other in [None, env1]:
+        mat = intor.int1e("rinv", env, other=other, rinv_pos=rinv_poss)
+        mat_true = torch.stack([intor.int1e("rinv", env, other=other, rinv_pos=pos)
+                                for pos in rinv_poss], dim=0)
+        assert mat.shape == mat_true.shape
+        assert torch.allclose(mat, mat_true)
+
+    # check the gradients w.r.t. the centres and the basis positions
+    def get_rinv(rinv_poss, *poss):
+        atomenv = AtomEnv(poss=poss, basis="3-21G", rgrid=None, atomzs=[1, 1, 1])
+        env = get_wrapper(atomenv, spherical=True)
+        return intor.int1e("rinv", env, rinv_pos=rinv_poss)
+
+    rinv_poss = rinv_poss.requires_grad_()
+    torch.autograd.gradcheck(get_rinv, (rinv_poss, *atomenv.poss))
+    torch.autograd.gradgradcheck(get_rinv, (rinv_poss, *atomenv.poss))
+
+@pytest.mark.parametrize("omega", [0.3, -0.3])
+def test_elrep_range_separated(omega):
+    # test the electron repulsion integrals with the range-separated coulomb
+    # operator against pyscf and their gradients w.r.t. the positions
+    atomenv = get_atom_env(dtype)
+    env = get_wrapper(atomenv, spherical=True)
+    mat = intor.elrep(env, omega=omega)
+
+    mol = get_mol_pyscf(dtype)
+    with mol.with_range_coulomb(omega):
+        mat_scf = torch.tensor(mol.intor("int2e_sph"), dtype=dtype)
+    assert torch.allclose(mat_scf, mat)
+
+    # the full coulomb integrals are not affected
+    assert torch.allclose(intor.elrep(env), torch.tensor(mol.intor("int2e_sph"), dtype=dtype))
+
+    def get_elrep(*poss):
+        atomenv = AtomEnv(poss=poss, basis="3-21G", rgrid=None, atomzs=[1, 1, 1])
+        env = get_wrapper(atomenv, spherical=True)
+        return intor.elrep(env, omega=omega)
+
+    torch.autograd.gradcheck(get_elrep, atomenv.poss)
+
 def test_nuc_integral_frac_atomz_grad():
     # test the gradient w.r.t. Z for nuclear integral with fractional Z
 
@@ -1297,3 +1381,88 @@ def test_wrapper_concat():
         assert False
     except AssertionError:  # TODO: change into ValueError
         pass
+
+def test_wrapper_optimizer_cache():
+    # the libcint optimizers should be shared between the subsets and reused
+    # for the integrals with the same operator
+    atomenv = get_atom_env(dtype)
+    env = get_wrapper(atomenv, spherical=True)
+    env1 = env[: len(env) // 2]
+
+    opt = env.get_intgl_optimizer("int1e_ovlp_sph")
+    assert env.get_intgl_optimizer("int1e_ovlp_sph") is opt
+    assert env1.get_intgl_optimizer("int1e_ovlp_sph") is opt
+    assert env.get_intgl_optimizer("int1e_kin_sph") is not opt
+
+    # the integrals using the cached optimizers should still be correct
+    mat_full = intor.overlap(env)
+    mat1 = intor.overlap(env1)
+    assert torch.allclose(mat_full[:env1.nao(), :env1.nao()], mat1)
+    assert torch.allclose(intor.overlap(env), mat_full)
+
+def test_wrapper_uncontracted_cache():
+    # the uncontracted wrappers of the subsets should be cached in the parent
+    atomenv = get_atom_env(dtype)
+    env = get_wrapper(atomenv, spherical=True)
+    nshells = len(env)
+
+    u_env1, uao2ao1 = env[: nshells // 2].get_uncontracted_wrapper()
+    u_env2, uao2ao2 = env[: nshells // 2].get_uncontracted_wrapper()
+    assert u_env1 is u_env2
+    assert uao2ao1 is uao2ao2
+
+    # uncontracting an uncontracted wrapper returns itself
+    u_env, uao2ao = env.get_uncontracted_wrapper()
+    uu_env, uuao2uao = u_env.get_uncontracted_wrapper()
+    assert uu_env is u_env
+    assert torch.all(uuao2uao == torch.arange(u_env.nao()))
+
+def test_integral_grad_basis_cache_deriv():
+    # the gradients with the cached derivative integrals must be the same as
+    # the ones without the cache, even if the backward is called repeatedly
+    from dqc.utils.config import config
+
+    torch.manual_seed(123)
+    atomenv = get_atom_env(dtype, pos_requires_grad=True)
+    alphas = torch.rand((2,), dtype=dtype, requires_grad=True)
+    coeffs = torch.rand((2,), dtype=dtype, requires_grad=True)
+    bases = [CGTOBasis(angmom=1, alphas=alphas, coeffs=coeffs, normalized=True)]
+    atombases = [
+        AtomCGTOBasis(atomz=atomenv.atomzs[i], bases=bases, pos=atomenv.poss[i])
+        for i in range(len(atomenv.poss))
+    ]
+    env = intor.LibcintWrapper(atombases, spherical=True)
+    params = (alphas, coeffs, *atomenv.poss)
+
+    def get_grads(mat):
+        torch.manual_seed(12)
+        w = torch.randn_like(mat)
+        return torch.autograd.grad((mat * w).sum(), params, retain_graph=True)
+
+    def get_grad2(mat):
+        # second derivative w.r.t. the position of the last atom
+        torch.manual_seed(12)
+        w = torch.randn_like(mat)
+        grad = torch.autograd.grad((mat * w).sum(), params[-1], retain_graph=True, create_graph=True)[0]
+        return torch.autograd.grad(grad.sum(), params[-1], retain_graph=True)[0]
+
+    cache0 = config.CACHE_DERIV_INTEGRALS
+    try:
+        for fcn in [intor.overlap, intor.nuclattr, intor.coul3c]:
+            config.CACHE_DERIV_INTEGRALS = False
+            mat0 = fcn(env)
+            grads0 = get_grads(mat0)
+            grad20 = get_grad2(mat0)
+
+            config.CACHE_DERIV_INTEGRALS = True
+            mat = fcn(env)
+            for _ in range(2):
+                grads = get_grads(mat)
+                for g0, g in zip(grads0, grads):
+                    assert torch.allclose(g0, g)
+
+            # the derivatives cached above without the graph must not be used
+            # for the higher order derivatives
+            assert torch.allclose(get_grad2(mat), grad20)
+    finally:
+        config.CACHE_DERIV_INTEGRALS = cache0
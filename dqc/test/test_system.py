@@ -6,6 +6,7 @@ import h5py
 from dqc.system.mol import Mol
 from dqc.system.sol import Sol
 from dqc.hamilton.intor.lattice import Lattice
+from dqc.utils.config import config
 
 # these tests to make sure the systems parse the inputs correctly
 
@@ -77,6 +78,76 @@ def test_mol_nuclei_energy():
     torch.autograd.gradcheck(get_ene_ii, (atomz, atompos))
     torch.autograd.gradgradcheck(get_ene_ii, (atomz, atompos))
 
+def test_mol_auxbasis():
+    # test the automatic selection of the auxiliary basis for density fitting
+    from dqc.api.loadbasis import loadbasis
+    from dqc.api.auxbasis import get_auxbasis_name, autoaux
+
+    assert get_auxbasis_name("cc-pVTZ") == "cc-pvtz-jkfit"
+    assert get_auxbasis_name("cc-pVDZ") == "def2-universal-jkfit"
+    assert get_auxbasis_name("aug-cc-pVDZ") == "def2-universal-jkfit"
+    assert get_auxbasis_name("aug-cc-pVTZ") == "cc-pvtz-jkfit"
+    assert get_auxbasis_name("def2-SV(P)") == "def2-sv(p)-jkfit"
+    assert get_auxbasis_name("3-21G") is None
+
+    # the size of the generated auxiliary basis should follow the orbital basis
+    def get_nauxao(basis):
+        aux = autoaux(6, loadbasis("6:%s" % basis))
+        return sum([2 * b.angmom + 1 for b in aux])
+
+    assert get_nauxao("3-21G") < get_nauxao("cc-pvdz") < get_nauxao("cc-pvtz")
+
+    # basis without the official auxiliary basis uses the generated one
+    m = Mol("H 0 0 0; H 1 0 0", basis="3-21G", dtype=dtype).densityfit()
+    nauxbases = [len(atb.bases) for atb in m.get_hamiltonian().df.dfinfo.auxbases]  # type: ignore
+    assert nauxbases == [len(autoaux(1, loadbasis("1:3-21G")))] * 2
+
+    # elements that are not covered by the official auxiliary basis use the
+    # generated one
+    from dqc.system.mol import _get_auxbasis
+    bases = loadbasis("3:3-21G")
+    with pytest.warns(UserWarning, match="autoaux"):
+        auxbases = _get_auxbasis(torch.tensor([3]), "cc-pvtz", [bases], None)
+    assert len(auxbases[0]) == len(autoaux(3, bases))
+
+def test_mol_estimate_resources():
+    # the estimated sizes should match the constructed ones and the strategies
+    # should follow the memory threshold
+    moldesc = "O 0 0 0; H 1.8 0 0; H 0 1.8 0"
+
+    # Hartree-Fock: exact exchange without the grid
+    m = Mol(moldesc, basis="3-21G", dtype=dtype)
+    res = m.estimate_resources()
+    assert res.nao == m.get_hamiltonian().libcint_wrapper.nao()
+    assert res.ngrid == 0 and res.nxao == 0
+    assert res.strategies["eri"] == "stored"
+    assert "exchange" in res.stages and "xc" not in res.stages
+    assert res.peak_memory >= sum([st.memory for st in res.stages.values()])
+
+    # GGA: the grid size is counted without constructing the grid
+    res = m.estimate_resources(xc="gga_x_pbe")
+    m.setup_grid()
+    assert res.ngrid == m.get_grid().get_rgrid().shape[-2]
+    assert "exchange" not in res.stages
+    assert res.stages["ao_grid"].memory == 5 * res.ngrid * res.nao * 8
+
+    # density fitting
+    m.densityfit()
+    res = m.estimate_resources(xc="lda_x")
+    assert res.nxao > 0
+    assert res.strategies["df_elmat"] == "stored"
+
+    # small threshold memory changes the strategies
+    thresh0 = config.THRESHOLD_MEMORY
+    try:
+        config.THRESHOLD_MEMORY = 1024
+        res = m.estimate_resources(xc="lda_x")
+        assert res.strategies["df_elmat"] == "direct"
+        assert res.strategies["ao_grid"] == "block_sparse"
+        assert res.strategies["stream_xc"]
+    finally:
+        config.THRESHOLD_MEMORY = thresh0
+
 def test_mol_cache():
     # test if cache is stored correctly
     cache_fname = "_temp_cache.h5"
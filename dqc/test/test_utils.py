@@ -1,5 +1,12 @@
+import json
+import time
+import pytest
+import torch
 from dqc.utils.config import config
 from dqc.utils.misc import logger
+from dqc.utils.smearing import get_smearing_occ
+from dqc.utils.profiler import stage_timer, write_profile
+from dqc.utils.autotune import autotune
 
 def test_logger(capsys):
     # test if logger behaves correctly
@@ -19,3 +26,82 @@ def test_logger(capsys):
 
     # restore the verbosity level to 0
     config.VERBOSE = 0
+
+@pytest.mark.parametrize("method", ["fermi", "gaussian", "methfessel-paxton"])
+def test_smearing_occ(method):
+    # the smeared occupations must keep the number of electrons and be
+    # differentiable w.r.t. the eigenvalues
+    dtype = torch.float64
+    eivals = torch.tensor([-1.0, -0.5, -0.02, 0.0, 0.03, 0.8], dtype=dtype, requires_grad=True)
+    nelecs = torch.tensor(5.0, dtype=dtype)
+
+    occ = get_smearing_occ(eivals, nelecs, 2.0, method, 0.05)
+    assert torch.allclose(occ.sum(), nelecs)
+    torch.autograd.gradcheck(lambda e: get_smearing_occ(e, nelecs, 2.0, method, 0.05), (eivals,))
+
+    # small width must give the integer occupations if there is a gap
+    occ = get_smearing_occ(eivals, torch.tensor(4.0, dtype=dtype), 2.0, method, 1e-3)
+    assert torch.allclose(occ, torch.tensor([2.0, 2.0, 0.0, 0.0, 0.0, 0.0], dtype=dtype), atol=1e-8)
+
+    # k-points share the same chemical potential
+    eivals_k = torch.stack((eivals, eivals + 0.1), dim=0)
+    wkpts = torch.tensor([0.25, 0.75], dtype=dtype)
+    occ = get_smearing_occ(eivals_k, nelecs, 2.0, method, 0.05, wkpts=wkpts)
+    assert torch.allclose((occ.sum(dim=-1) * wkpts).sum(), nelecs)
+
+@pytest.mark.parametrize("fmt", ["json", "chrome"])
+def test_profiler(tmp_path, fmt):
+    # the nested stages must be recorded and written in the profile
+    fname = str(tmp_path / "profile.json")
+    stage_timer.reset()
+    config.PROFILE_FILE = fname
+    try:
+        with stage_timer("outer"):
+            for _ in range(2):
+                with stage_timer("inner"):
+                    torch.ones(10).sum()
+        write_profile(fmt=fmt)
+    finally:
+        config.PROFILE_FILE = ""
+    assert stage_timer.counts == {"outer": 1, "inner": 2}
+    assert stage_timer.times["outer"] >= stage_timer.times["inner"]
+
+    with open(fname, "r") as f:
+        res = json.load(f)
+    if fmt == "json":
+        outer = res["stages"]["outer"]
+        assert outer["count"] == 1
+        assert outer["stages"]["inner"]["count"] == 2
+        # the peak memory of a stage includes the stages inside it
+        assert outer["peak_memory"] >= outer["stages"]["inner"]["peak_memory"] >= 0
+    else:
+        names = [ev["name"] for ev in res["traceEvents"] if ev["ph"] == "X"]
+        assert names == ["inner", "inner", "outer"]
+    stage_timer.reset()
+
+def test_autotune(tmp_path):
+    # the fastest candidate must be chosen and saved in the profile file, so
+    # the next call with the same key reads it without running the benchmark
+    fname = str(tmp_path / "autotune" / "profile.json")
+    fname0 = config.AUTOTUNE_FILE
+    config.AUTOTUNE_FILE = fname
+    ncalls = {}
+
+    def bench(cand):
+        ncalls[cand] = ncalls.get(cand, 0) + 1
+        time.sleep(0.002 * abs(cand - 2))
+
+    try:
+        assert autotune("param", "key", [1, 2, 4], bench) == 2
+        assert set(ncalls.keys()) == {1, 2, 4}
+        ncalls.clear()
+        assert autotune("param", "key", [1, 2, 4], bench) == 2
+        assert len(ncalls) == 0
+
+        # a different key is tuned again and kept together with the old one
+        assert autotune("param", "key2", [4, 8], bench) == 4
+        with open(fname, "r") as f:
+            profile = json.load(f)
+        assert len(profile["param"]) == 2
+    finally:
+        config.AUTOTUNE_FILE = fname0
@@ -139,6 +139,64 @@ def test_libxc_mgga_gradcheck():
     torch.autograd.gradgradcheck(get_edens_pol, param_pol)
     torch.autograd.gradgradcheck(get_vxc_pol, param_pol)
 
+@pytest.mark.parametrize(
+    "name",
+    ["lda_x", "gga_x_pbe", "mgga_x_scan"]
+)
+def test_libxc_edensityxc_vxc_gradcheck(name):
+    # check the gradients of the energy density and the potential calculated
+    # together in a single libxc call
+    xc = get_libxc(name)
+    family = xc.family
+
+    torch.manual_seed(123)
+    n = 2
+    rho_u = torch.rand((n,), dtype=torch.float64).requires_grad_()
+    rho_d = torch.rand((n,), dtype=torch.float64).requires_grad_()
+    grad_u = torch.rand((3, n), dtype=torch.float64).requires_grad_()
+    grad_d = torch.rand((3, n), dtype=torch.float64).requires_grad_()
+    lapl_u = torch.rand((n,), dtype=torch.float64).requires_grad_()
+    lapl_d = torch.rand((n,), dtype=torch.float64).requires_grad_()
+    tau_w_u = (torch.norm(grad_u, dim=-2) ** 2 / (8 * rho_u)).detach()
+    tau_w_d = (torch.norm(grad_d, dim=-2) ** 2 / (8 * rho_d)).detach()
+    kin_u = (torch.rand((n,), dtype=torch.float64) + tau_w_u).requires_grad_()
+    kin_d = (torch.rand((n,), dtype=torch.float64) + tau_w_d).requires_grad_()
+
+    def get_densinfo(rho, grad, lapl, kin):
+        return ValGrad(value=rho,
+                       grad=grad if family >= 2 else None,
+                       lapl=lapl if family >= 4 else None,
+                       kin=kin if family >= 4 else None)
+
+    def get_outs(vxc):
+        return (vxc.value,) if vxc.grad is None else (vxc.value, vxc.grad)
+
+    def get_edens_vxc_unpol(xc, rho, grad, lapl, kin):
+        densinfo = get_densinfo(rho, grad, lapl, kin)
+        edens, vxc = xc.get_edensityxc_vxc(densinfo)
+        return (edens, *get_outs(vxc))
+
+    def get_edens_vxc_pol(xc, rho_u, rho_d, grad_u, grad_d, lapl_u, lapl_d, kin_u, kin_d):
+        densinfo_u = get_densinfo(rho_u, grad_u, lapl_u, kin_u)
+        densinfo_d = get_densinfo(rho_d, grad_d, lapl_d, kin_d)
+        edens, vxc = xc.get_edensityxc_vxc(SpinParam(u=densinfo_u, d=densinfo_d))
+        return (edens, *get_outs(vxc.u), *get_outs(vxc.d))
+
+    param_unpol = (xc, rho_u, grad_u, lapl_u, kin_u)
+    param_pol   = (xc, rho_u, rho_d, grad_u, grad_d, lapl_u, lapl_d, kin_u, kin_d)
+
+    # the results must be the same as the separate calculations
+    densinfo = get_densinfo(rho_u, grad_u, lapl_u, kin_u)
+    edens, vxc = xc.get_edensityxc_vxc(densinfo)
+    assert torch.allclose(edens, xc.get_edensityxc(densinfo))
+    assert torch.allclose(vxc.value, xc.get_vxc(densinfo).value)
+
+    torch.autograd.gradcheck(get_edens_vxc_unpol, param_unpol)
+    torch.autograd.gradgradcheck(get_edens_vxc_unpol, param_unpol)
+
+    torch.autograd.gradcheck(get_edens_vxc_pol, param_pol)
+    torch.autograd.gradgradcheck(get_edens_vxc_pol, param_pol)
+
 def test_libxc_lda_value():
     # check if the value is consistent
     xc = get_libxc("lda_x")
@@ -366,6 +424,91 @@ def test_xc_default_vxc(xccls, libxcname):
     assert_valgrad(xcpotinfo_pol.u, lxcpotinfo_pol.u)
     assert_valgrad(xcpotinfo_pol.d, lxcpotinfo_pol.d)
 
+@pytest.mark.parametrize(
+    "xccls",
+    [PseudoLDA, PseudoPBE]
+)
+def test_xc_compiled_vxc(xccls):
+    # test if the compiled vxc gives the same results as the eager one
+    dtype = torch.float64
+    xc = xccls()
+
+    torch.manual_seed(123)
+    n = 100
+    densinfo_u = ValGrad(value=torch.rand((n,), dtype=dtype), grad=torch.rand((3, n), dtype=dtype))
+    densinfo_d = ValGrad(value=torch.rand((n,), dtype=dtype), grad=torch.rand((3, n), dtype=dtype))
+    densinfo_tot = densinfo_u + densinfo_d
+    densinfo = SpinParam(u=densinfo_u, d=densinfo_d)
+
+    def assert_valgrad(vg1, vg2):
+        assert torch.allclose(vg1.value, vg2.value)
+        assert (vg1.grad is None) == (vg2.grad is None)
+        if vg1.grad is not None:
+            assert torch.allclose(vg1.grad, vg2.grad)
+
+    vxc_unpol = xc.get_vxc(densinfo_tot)
+    vxc_pol = xc.get_vxc(densinfo)
+
+    xc.compile_xc()
+    # called twice to make sure the compiled kernel is reused
+    for _ in range(2):
+        assert_valgrad(xc.get_vxc(densinfo_tot), vxc_unpol)
+        vxc_pol_comp = xc.get_vxc(densinfo)
+        assert_valgrad(vxc_pol_comp.u, vxc_pol.u)
+        assert_valgrad(vxc_pol_comp.d, vxc_pol.d)
+
+def test_xc_compiled_vxc_user_error():
+    # errors raised by the functional must not be taken as compilation
+    # failures and silently fall back to the eager mode
+    class ErrorLDA(PseudoLDA):
+        def get_edensityxc(self, densinfo):
+            raise ValueError("invalid density")
+
+    xc = ErrorLDA().compile_xc()
+    densinfo = ValGrad(value=torch.rand((10,), dtype=torch.float64))
+    with pytest.raises(ValueError, match="invalid density"):
+        xc.get_vxc(densinfo)
+    # the compilation is still enabled
+    assert xc._compile_kwargs is not None
+
+@pytest.mark.parametrize(
+    "libxcname",
+    ["lda_x", "gga_x_pbe", "mgga_x_scan"]
+)
+def test_libxc_pol_input_buffers(libxcname):
+    # the results of libxc from the packed input buffers must not be affected
+    # by the other calls with the same or different number of points
+    dtype = torch.float64
+    libxc = get_libxc(libxcname)
+
+    def get_densinfo(n):
+        vgs = []
+        for _ in range(2):
+            value = torch.rand((n,), dtype=dtype) + 0.1
+            grad = torch.rand((3, n), dtype=dtype) if libxc.family >= 2 else None
+            lapl = torch.rand((n,), dtype=dtype) if libxc.family >= 4 else None
+            kin = torch.rand((n,), dtype=dtype) + 1.0 if libxc.family >= 4 else None
+            vgs.append(ValGrad(value=value, grad=grad, lapl=lapl, kin=kin))
+        return SpinParam(u=vgs[0], d=vgs[1])
+
+    torch.manual_seed(123)
+    densinfo1 = get_densinfo(100)
+    densinfo2 = get_densinfo(100)
+    densinfo3 = get_densinfo(50)
+
+    edens1 = libxc.get_edensityxc(densinfo1)
+    edens1_copy = edens1.clone()
+    vxc1 = libxc.get_vxc(densinfo1)
+    vxc1_copy = vxc1.u.value.clone()
+    libxc.get_edensityxc(densinfo2)
+    libxc.get_vxc(densinfo2)
+    libxc.get_edensityxc(densinfo3)
+
+    assert torch.allclose(edens1, edens1_copy)
+    assert torch.allclose(vxc1.u.value, vxc1_copy)
+    assert torch.allclose(libxc.get_edensityxc(densinfo1), edens1_copy)
+    assert torch.allclose(libxc.get_vxc(densinfo1).u.value, vxc1_copy)
+
 def lda_e_true(rho):
     return -0.75 * (3 / np.pi) ** (1. / 3) * rho ** (4. / 3)
 
@@ -0,0 +1,94 @@
+from typing import Callable, Dict, List
+import json
+import os
+import time
+import warnings
+import torch
+from dqc.utils.config import config
+from dqc.utils.misc import logger
+
+__all__ = ["autotune"]
+
+def autotune(name: str, key: str, candidates: List[int], bench: Callable[[int], None],
+             nrepeats: int = 2) -> int:
+    """
+    Returns the fastest value of a tuning parameter among the candidates.
+    The value is read from the profile file, ``config.AUTOTUNE_FILE``, if it
+    has been tuned for the same key and the same number of threads.
+    Otherwise, the candidates are timed with the benchmark function and the
+    fastest one is saved to the profile file to be reused by the next
+    calculations.
+
+    Arguments
+    ---------
+    name: str
+        The name of the tuning parameter, e.g. ``"chunk_memory"``.
+    key: str
+        The key of the problem parameters that affect the best value, e.g. the
+        number of basis and the data type.
+    candidates: list of int
+        The candidate values of the tuning parameter.
+    bench: callable
+        The function to be timed with a candidate value as its argument.
+    nrepeats: int
+        The number of timed runs of every candidate after the warm-up run.
+        The shortest time is used.
+
+    Returns
+    -------
+    int
+        The fastest value of the tuning parameter.
+    """
+    assert len(candidates) > 0
+    key = "%s-nthreads%d" % (key, torch.get_num_threads())
+    fname = config.AUTOTUNE_FILE
+    profile = _read_profile(fname)
+    if key in profile.get(name, {}):
+        return int(profile[name][key])
+
+    logger.log("Autotuning %s for %s" % (name, key))
+    best_time = float("inf")
+    best = candidates[0]
+    for cand in candidates:
+        bench(cand)  # warm-up
+        dt = float("inf")
+        for _ in range(nrepeats):
+            t0 = time.perf_counter()
+            bench(cand)
+            dt = min(dt, time.perf_counter() - t0)
+        logger.log("%s = %d: %.3e s" % (name, cand, dt), vlevel=1)
+        if dt < best_time:
+            best_time = dt
+            best = cand
+    logger.log("Autotuning %s for %s: %d" % (name, key, best))
+
+    # read the file again to keep the values saved by other processes
+    profile = _read_profile(fname)
+    profile.setdefault(name, {})[key] = best
+    _write_profile(fname, profile)
+    return best
+
+def _read_profile(fname: str) -> Dict[str, Dict[str, int]]:
+    # returns the saved profile or an empty profile if the file does not
+    # exist or cannot be read
+    if not os.path.exists(fname):
+        return {}
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        warnings.warn("Cannot read the autotune profile file %s, the values are tuned again" % fname)
+        return {}
+
+def _write_profile(fname: str, profile: Dict[str, Dict[str, int]]) -> None:
+    # write to a temporary file first so the file is never partially written
+    try:
+        dirname = os.path.dirname(fname)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmpfname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tmpfname, "w") as f:
+            json.dump(profile, f, indent=1)
+        os.replace(tmpfname, fname)
+    except OSError:
+        warnings.warn("Cannot write the autotune profile file %s" % fname)
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 
 __all__ = ["config"]
@@ -8,6 +9,40 @@ class _Config(object):
     THRESHOLD_MEMORY: int = 10 * 1024 ** 3  # in B
     # The memory for splitting big tensors into chunks
     CHUNK_MEMORY: int = 16 * 1024 ** 2  # in B
+    # If True, the chunk memory of the contractions with the basis on the grid
+    # is chosen by a one-time benchmark for every number of basis, data type,
+    # xc family, and number of threads instead of using CHUNK_MEMORY.
+    # The tuned values are saved in AUTOTUNE_FILE to be reused.
+    AUTOTUNE_CHUNK: bool = False
+    AUTOTUNE_FILE: str = os.path.join(os.path.expanduser("~"), ".dqc", "autotune.json")
+    # Number of threads to evaluate the integrals with libcint, the shell ranges
+    # are split into a thread pool. If 0, then it follows torch.get_num_threads().
+    # The integrals block the calling thread, so the libcint threads and torch's
+    # BLAS threads do not run at the same time and both use all the cores by
+    # default. Only if several calculations run concurrently (e.g. from python
+    # threads), these two numbers should be set so their sum does not exceed
+    # the number of cores.
+    INTOR_NTHREADS: int = 0
+    # If True, the derivative integrals calculated in the backward propagation
+    # of the integrals are kept in the autograd context, so the next backward
+    # passes through the same graph (e.g. with retain_graph=True or in
+    # calculating the jacobian) reuse them instead of calculating them again
+    CACHE_DERIV_INTEGRALS: bool = False
+    # Grid points where the total density is below this threshold are skipped
+    # in the exchange-correlation calculations. If 0, no points are skipped.
+    XC_DENS_THRESHOLD: float = 0.0
+    # If True, the density, the exchange-correlation potential, and the
+    # exchange-correlation matrix and energy are evaluated chunk by chunk of
+    # the grid points, so the memory scales with the chunk size instead of the
+    # grid size. The intermediate values are recalculated in the backward.
+    STREAM_XC: bool = False
+    # If not empty, the nested stages of the calculations (e.g. the integrals,
+    # the grid, the fock matrix, and the diagonalization) are timed with their
+    # memory high-water marks and written to this file at the exit (or by
+    # dqc.utils.profiler.write_profile) in the format of PROFILE_FORMAT:
+    # "json" for the nested summary or "chrome" for the trace events
+    PROFILE_FILE: str = ""
+    PROFILE_FORMAT: str = "json"
 
     VERBOSE: int = 0  # verbosity level
 
@@ -0,0 +1,156 @@
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+import torch
+from dqc.utils.config import config
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (not available on Windows)
+    resource = None  # type: ignore
+
+__all__ = ["stage_timer", "write_profile"]
+
+class _StageTimer(object):
+    # accumulates the wall time and the number of calls of the named stages of
+    # the calculations (e.g. the coulomb matrix, "J", or the diagonalization,
+    # "diag"). The stages can be nested, so the time of every path of the
+    # stages (e.g. ("scf", "fock", "J")) is also accumulated.
+    # If config.PROFILE_FILE is set, every stage is recorded as an event with
+    # the memory high-water mark to be written by write_profile.
+    # On the cuda device, the peak memory statistics are reset at the entry of
+    # every stage, so the high-water mark is the peak within the stage
+    # (including the stages inside it, and other threads using the device).
+    # On the cpu, the peak resident memory of the process cannot be reset, so
+    # it is the peak of the process up to the end of the stage.
+    def __init__(self):
+        # the inclusive time and the number of calls of every stage name
+        self.times: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        # the time, the number of calls, and the peak memory of every path
+        self.tree: Dict[Tuple[str, ...], List[float]] = {}
+        # (name, path, thread id, start time in s, duration in s, peak memory in B)
+        self.events: List[Tuple[str, Tuple[str, ...], int, float, float, int]] = []
+        self._local = threading.local()  # the stack of the stages in every thread
+        self._t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.peaks = []
+        stack: List[str] = self._local.stack
+        # the cuda peak memory of every stage in the stack before the reset
+        # at the entry of the stages inside it
+        peaks: List[int] = self._local.peaks
+        track_cuda = bool(config.PROFILE_FILE) and _cuda_in_use()
+        if track_cuda:
+            if len(peaks) > 0:
+                peaks[-1] = max(peaks[-1], get_peak_memory())
+            torch.cuda.reset_peak_memory_stats()
+        stack.append(name)
+        peaks.append(0)
+        path = tuple(stack)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            stack.pop()
+            stage_peak = peaks.pop()
+            self.times[name] = self.times.get(name, 0.0) + dt
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if config.PROFILE_FILE:
+                mem = get_peak_memory()
+                if track_cuda:
+                    mem = max(mem, stage_peak)
+                node = self.tree.setdefault(path, [0.0, 0, 0])
+                node[0] += dt
+                node[1] += 1
+                node[2] = max(node[2], mem)
+                self.events.append((name, path, threading.get_ident(), t0 - self._t0, dt, mem))
+
+    def reset(self) -> None:
+        # clear all the records
+        self.__init__()  # type: ignore
+
+stage_timer = _StageTimer()
+
+def get_peak_memory() -> int:
+    # returns the high-water mark of the memory in bytes, i.e. the peak
+    # resident memory of the process or the peak allocated memory of the
+    # cuda device since the last reset if it is used
+    if _cuda_in_use():
+        return int(torch.cuda.max_memory_allocated())
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) * 1024
+
+def _cuda_in_use() -> bool:
+    return torch.cuda.is_available() and torch.cuda.is_initialized()
+
+def write_profile(fname: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """
+    Write the profile of the stages recorded while ``config.PROFILE_FILE`` is
+    set. It is also written automatically to ``config.PROFILE_FILE`` at the
+    exit of the program.
+
+    Arguments
+    ---------
+    fname: str or None
+        The output file name. If ``None``, it is ``config.PROFILE_FILE``.
+    fmt: str or None
+        The output format, ``"json"`` for the nested summary of the stages
+        (wall time, number of calls, and the peak memory, which is the peak
+        within the stage on the cuda device or the peak of the process up to
+        the end of the stage on the cpu), or ``"chrome"`` for
+        the trace events that can be opened in ``chrome://tracing`` or
+        Perfetto. If ``None``, it is ``config.PROFILE_FORMAT``.
+    """
+    fname = fname if fname is not None else config.PROFILE_FILE
+    fmt = fmt if fmt is not None else config.PROFILE_FORMAT
+    if not fname:
+        raise RuntimeError("The file name must be given if config.PROFILE_FILE is not set")
+
+    if fmt == "json":
+        res: Any = _get_summary_tree()
+    elif fmt == "chrome":
+        res = _get_chrome_trace()
+    else:
+        raise RuntimeError("Unknown profile format: %s. Available options are: json, chrome" % fmt)
+    with open(fname, "w") as f:
+        json.dump(res, f, indent=1)
+
+def _get_summary_tree() -> Dict[str, Any]:
+    # nested dictionary of the stages with their time, number of calls,
+    # peak memory, and the stages inside them
+    root: Dict[str, Any] = {"stages": {}}
+    for path in sorted(stage_timer.tree.keys(), key=len):
+        dt, count, mem = stage_timer.tree[path]
+        node = root
+        for name in path:
+            node = node["stages"].setdefault(name, {"stages": {}})
+        node.update({"time": dt, "count": int(count), "peak_memory": int(mem)})
+    return root
+
+def _get_chrome_trace() -> Dict[str, Any]:
+    # the trace events format, the stages are complete events ("X") and the
+    # memory high-water marks are counter events ("C"), with time in us
+    pid = os.getpid()
+    events: List[Dict[str, Any]] = []
+    for (name, path, tid, t0, dt, mem) in stage_timer.events:
+        events.append({"name": name, "cat": "/".join(path), "ph": "X", "ts": t0 * 1e6, "dur": dt * 1e6,
+                       "pid": pid, "tid": tid})
+        events.append({"name": "peak_memory", "ph": "C", "ts": (t0 + dt) * 1e6, "pid": pid,
+                       "args": {"MB": mem / 1024 ** 2}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+@atexit.register
+def _write_profile_at_exit() -> None:
+    if config.PROFILE_FILE and len(stage_timer.events) > 0:
+        write_profile()
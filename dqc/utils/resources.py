@@ -0,0 +1,289 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+import torch
+from dqc.utils.config import config
+from dqc.utils.datastruct import AtomCGTOBasis
+
+__all__ = ["StageEstimate", "ResourceEstimate", "estimate_resources", "get_nao"]
+
+# rough number of floating point operations to calculate an element of the
+# contracted integrals and to evaluate a basis function at a grid point
+_INTOR_FLOPS = 100
+_EVAL_FLOPS = 30
+
+@dataclass
+class StageEstimate:
+    """
+    Estimated resources of a stage of the calculation.
+
+    Arguments
+    ---------
+    memory: int
+        The memory in bytes of the tensors kept by the stage until the end of
+        the calculation.
+    tmp_memory: int
+        The memory in bytes of the temporary tensors that only live while the
+        stage is running.
+    flops: float
+        The rough number of floating point operations of the stage. For the
+        stages repeated in every SCF iteration, it is the number per iteration.
+    per_iter: bool
+        Whether the stage is repeated in every SCF iteration.
+    """
+    memory: int = 0
+    tmp_memory: int = 0
+    flops: float = 0.0
+    per_iter: bool = False
+
+@dataclass
+class ResourceEstimate:
+    """
+    Estimated resources of a calculation before any of its tensors is
+    allocated, returned by :meth:`~dqc.system.BaseSystem.estimate_resources`.
+
+    Arguments
+    ---------
+    nao: int
+        The number of atomic orbitals.
+    nxao: int
+        The number of the auxiliary basis for the density fitting, 0 if not
+        using density fitting.
+    ngrid: int
+        The number of integration grid points, 0 if the grid is not required.
+    nkpts: int
+        The number of k-points, 0 for isolated molecules.
+    stages: dict of StageEstimate
+        The estimated resources of the stages: ``"intor"`` (one-electron
+        integrals), ``"eri"`` (electron repulsion integrals), ``"df"`` (density
+        fitting tensors), ``"ao_grid"`` (the basis values on the grid),
+        ``"xc"``, ``"coulomb"``, ``"exchange"``, and ``"diag"``. Only the stages
+        that are present in the calculation are listed.
+    peak_memory: int
+        The predicted peak memory in bytes, i.e. the memory of all the kept
+        tensors plus the largest temporary memory.
+    strategies: dict
+        The strategies chosen based on ``config.THRESHOLD_MEMORY``. They are
+        advisory, i.e. estimating the resources does not change the
+        calculation. ``"df_elmat"``, ``"grid_chunk"``, and ``"jk_chunk"`` are
+        the choices that the calculation makes by itself with the current
+        config, while the others have to be applied by the user, e.g. by
+        calling ``densityfit`` of the system or setting ``config.STREAM_XC``:
+
+        * ``"eri"``: ``"stored"`` if the 4-centre integrals fit in the memory,
+          otherwise ``"density_fit"`` (the density fitting should be used).
+          Only present if not using the density fitting.
+        * ``"df_elmat"``: ``"stored"`` if the fitted 3-centre matrix is
+          precomputed, otherwise ``"direct"``. Only present if using the
+          density fitting.
+        * ``"ao_grid"``: ``"stored"`` if the dense basis values on the grid fit
+          in the memory, otherwise ``"block_sparse"`` (only the significant
+          basis functions in every block of grid points should be kept, which
+          is not implemented yet).
+        * ``"stream_xc"``: whether ``config.STREAM_XC`` should be set.
+        * ``"grid_chunk"``: the number of grid points in every chunk from
+          ``config.CHUNK_MEMORY``.
+        * ``"jk_chunk"``: the number of rows of the electron repulsion matrix
+          in every chunk of the coulomb and exchange contraction.
+        * ``"exchange"``: ``"unsupported"`` if the exact exchange is required,
+          but it is not available for the chosen integrals.
+    """
+    nao: int
+    nxao: int
+    ngrid: int
+    nkpts: int
+    stages: Dict[str, StageEstimate] = field(default_factory=dict)
+    peak_memory: int = 0
+    strategies: Dict[str, Union[str, int, bool]] = field(default_factory=dict)
+
+    @property
+    def build_flops(self) -> float:
+        """
+        The rough number of floating point operations before the SCF iterations.
+        """
+        return sum([st.flops for st in self.stages.values() if not st.per_iter])
+
+    @property
+    def iter_flops(self) -> float:
+        """
+        The rough number of floating point operations of every SCF iteration.
+        """
+        return sum([st.flops for st in self.stages.values() if st.per_iter])
+
+def estimate_resources(nao: int, nxao: int = 0, ngrid: int = 0, xcfamily: int = 0,
+                       *,
+                       nkpts: int = 0,
+                       exchange: bool = False,
+                       lr_exchange: bool = False,
+                       polarized: bool = False,
+                       dtype: torch.dtype = torch.float64,
+                       grid_dtype: Optional[torch.dtype] = None) -> ResourceEstimate:
+    """
+    Estimate the peak memory and the rough number of floating point operations
+    of every stage of a calculation from the sizes of the system, and choose
+    the strategies to keep the memory below ``config.THRESHOLD_MEMORY``.
+
+    Arguments
+    ---------
+    nao: int
+        The number of atomic orbitals.
+    nxao: int
+        The number of the auxiliary basis for the density fitting. If 0, the
+        4-centre electron repulsion integrals are used.
+    ngrid: int
+        The number of integration grid points. If 0, no grid is used.
+    xcfamily: int
+        The family of the exchange-correlation functional: 1 for LDA, 2 for
+        GGA, and 4 for MGGA. If 0, there is no exchange-correlation functional.
+    nkpts: int
+        The number of k-points for periodic systems. If 0, it is an isolated
+        molecule.
+    exchange: bool
+        Whether the exact exchange is required.
+    lr_exchange: bool
+        Whether the exact exchange with the long-range coulomb is required,
+        i.e. the range-separated hybrid functionals.
+    polarized: bool
+        Whether the calculation is spin-polarized.
+    dtype: torch.dtype
+        The data type of the matrices.
+    grid_dtype: torch.dtype or None
+        The data type of the basis values on the grid. If ``None``, it is
+        ``dtype``.
+
+    Returns
+    -------
+    ResourceEstimate
+        The estimated resources and the chosen strategies.
+    """
+    pbc = nkpts > 0
+    nk = max(nkpts, 1)
+    nspin = 2 if polarized else 1
+    # periodic systems work with complex tensors
+    memsize = torch.empty(0, dtype=dtype).element_size() * (2 if pbc else 1)
+    gmemsize = torch.empty(0, dtype=grid_dtype if grid_dtype is not None else dtype).element_size() * \
+        (2 if pbc else 1)
+    npair = nao * (nao + 1) // 2
+    nao2 = nao * nao
+    nao3 = nao2 * nao
+    nao4 = nao2 * nao2
+    thresh = config.THRESHOLD_MEMORY
+
+    res = ResourceEstimate(nao=nao, nxao=nxao, ngrid=ngrid, nkpts=nkpts)
+    stages = res.stages
+    strategies = res.strategies
+
+    # overlap, kinetic, nuclear attraction, and the core hamiltonian
+    stages["intor"] = StageEstimate(memory=4 * nk * nao2 * memsize,
+                                    flops=3.0 * nk * nao2 * _INTOR_FLOPS)
+
+    neri = 2 if lr_exchange else 1
+    if nxao == 0:
+        eri_mem = neri * nao4 * memsize
+        strategies["eri"] = "stored" if eri_mem <= thresh else "density_fit"
+        # the electron repulsion matrix is copied by the orthogonalization
+        stages["eri"] = StageEstimate(memory=eri_mem, tmp_memory=nao4 * memsize,
+                                      flops=neri * nao4 / 8.0 * _INTOR_FLOPS)
+        jk_rows = max(config.CHUNK_MEMORY // memsize, nao3) // nao3
+        strategies["jk_chunk"] = min(jk_rows, nao)
+        stages["coulomb"] = StageEstimate(memory=nspin * nao2 * memsize,
+                                          tmp_memory=jk_rows * nao3 * memsize,
+                                          flops=2.0 * nao4, per_iter=True)
+        if exchange or lr_exchange:
+            # the exchange contraction keeps a (nao, nao, nao) intermediate
+            stages["exchange"] = StageEstimate(memory=nspin * nao2 * memsize,
+                                               tmp_memory=nspin * nao3 * memsize,
+                                               flops=2.0 * neri * nspin * nao4, per_iter=True)
+    elif not pbc:
+        # j3c is stored in the lower triangular pairs, the full j3c is only
+        # temporary before packing
+        j3c_mem = npair * nxao * memsize
+        stored = j3c_mem <= thresh
+        strategies["df_elmat"] = "stored" if stored else "direct"
+        df_mem = j3c_mem * (2 if stored else 1) + 2 * nxao * nxao * memsize
+        stages["df"] = StageEstimate(memory=df_mem, tmp_memory=nao2 * nxao * memsize,
+                                     flops=npair * nxao * _INTOR_FLOPS + nxao ** 3 +
+                                     (2.0 * npair * nxao * nxao if stored else 0.0))
+        stages["coulomb"] = StageEstimate(memory=nspin * nao2 * memsize,
+                                          flops=4.0 * npair * nxao + (0.0 if stored else 2.0 * nxao * nxao),
+                                          per_iter=True)
+    else:
+        # j3c for every pair of k-points, including the compensating charges
+        # in the temporary tensors
+        nkpts_ij = nk * nk
+        j3c_mem = nkpts_ij * nao2 * nxao * memsize
+        strategies["df_elmat"] = "stored"
+        stages["df"] = StageEstimate(memory=2 * j3c_mem + nkpts_ij * nxao * nxao * memsize,
+                                     tmp_memory=2 * j3c_mem,
+                                     flops=nkpts_ij * (2.0 * nao2 * nxao * _INTOR_FLOPS + nxao ** 3 +
+                                                       2.0 * nao2 * nxao * nxao))
+        stages["coulomb"] = StageEstimate(memory=nk * nspin * nao2 * memsize,
+                                          flops=4.0 * nk * nao2 * nxao, per_iter=True)
+    if nxao > 0 and (exchange or lr_exchange):
+        strategies["exchange"] = "unsupported"
+
+    if ngrid > 0:
+        # basis and basis * dvolume, plus the gradients for GGA and the
+        # gradients and the laplacian for MGGA
+        nbasis = 2 + (3 if xcfamily >= 2 else 0) + (1 if xcfamily >= 3 else 0)
+        ao_mem = nbasis * nk * ngrid * nao * gmemsize
+        strategies["ao_grid"] = "stored" if ao_mem <= thresh else "block_sparse"
+        stages["ao_grid"] = StageEstimate(memory=ao_mem,
+                                          flops=float(nbasis * nk * ngrid * nao * _EVAL_FLOPS))
+        grid_chunk = max(config.CHUNK_MEMORY // (nao * gmemsize), 1)
+        strategies["grid_chunk"] = min(grid_chunk, ngrid)
+
+    if ngrid > 0 and xcfamily > 0:
+        # density and potential components on the grid: value, gradient (GGA),
+        # laplacian and kinetic energy density (MGGA)
+        ncomp = 1 + (3 if xcfamily >= 2 else 0) + (2 if xcfamily >= 3 else 0)
+        xc_mem = 2 * nspin * ncomp * ngrid * memsize
+        chunk_mem = min(grid_chunk, ngrid) * nao * gmemsize * (1 + ncomp) * nspin
+        # the dense matrix products with the basis to get the density and the
+        # xc matrix
+        flops = 4.0 * nspin * nk * ngrid * nao2 + 2.0 * nspin * (ncomp - 1) * nk * ngrid * nao
+        stages["xc"] = StageEstimate(tmp_memory=xc_mem + chunk_mem, flops=flops, per_iter=True)
+
+    # the fock matrices, the density matrices, and the orbitals, including the
+    # history of the extrapolations
+    stages["diag"] = StageEstimate(memory=12 * nspin * nk * nao2 * memsize,
+                                   flops=10.0 * nspin * nk * nao3, per_iter=True)
+
+    res.peak_memory = _get_peak_memory(stages)
+
+    # the streamed xc keeps only the grid chunks of the densities and the
+    # potentials, but it is only implemented for the isolated molecules
+    stream_xc = "xc" in stages and not pbc and (res.peak_memory > thresh or config.STREAM_XC)
+    strategies["stream_xc"] = stream_xc
+    if stream_xc:
+        stages["xc"].tmp_memory = chunk_mem
+        res.peak_memory = _get_peak_memory(stages)
+    return res
+
+def _get_peak_memory(stages: Dict[str, StageEstimate]) -> int:
+    # all the kept tensors plus the largest temporary tensors
+    return sum([st.memory for st in stages.values()]) + \
+        max([st.tmp_memory for st in stages.values()])
+
+def get_nao(atombases: List[AtomCGTOBasis], spherical: bool = True) -> int:
+    """
+    Returns the number of the atomic orbitals of the basis without
+    constructing the basis wrapper, where every ``CGTOBasis`` is one shell.
+
+    Arguments
+    ---------
+    atombases: list of AtomCGTOBasis
+        The basis of every atom.
+    spherical: bool
+        Whether the basis is spherical or cartesian.
+
+    Returns
+    -------
+    int
+        The number of the atomic orbitals.
+    """
+    nao = 0
+    for atb in atombases:
+        for bas in atb.bases:
+            angmom = bas.angmom
+            nao += (2 * angmom + 1) if spherical else ((angmom + 1) * (angmom + 2) // 2)
+    return nao
@@ -0,0 +1,93 @@
+import math
+from typing import Optional
+import torch
+
+__all__ = ["SMEARING_METHODS", "get_smearing_occ"]
+
+# available smearing methods of the occupation numbers
+SMEARING_METHODS = ["fermi", "gaussian", "methfessel-paxton"]
+
+def get_smearing_occ(eivals: torch.Tensor, nelecs: torch.Tensor, maxocc: float,
+                     method: str, width: float,
+                     wkpts: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    Calculate the smeared occupation numbers of the orbitals from their
+    eigenvalues, where the chemical potential is solved such that the total
+    number of electrons is ``nelecs``.
+    The occupation numbers are differentiable w.r.t. the eigenvalues and the
+    number of electrons.
+
+    Arguments
+    ---------
+    eivals: torch.Tensor
+        The orbital eigenvalues with shape ``(norb,)`` or ``(nkpts, norb)``.
+    nelecs: torch.Tensor
+        The number of electrons to be occupied.
+    maxocc: float
+        The maximum occupation of an orbital, i.e. 2 for restricted and 1 for
+        spin-polarized orbitals.
+    method: str
+        The smearing method: ``"fermi"`` (Fermi-Dirac), ``"gaussian"``, or
+        ``"methfessel-paxton"`` (first order).
+    width: float
+        The smearing width in Hartree.
+    wkpts: torch.Tensor or None
+        The weights of the k-points with shape ``(nkpts,)``. It is only used if
+        ``eivals`` has the k-points dimension. If ``None``, the weights are
+        uniform.
+
+    Returns
+    -------
+    torch.Tensor
+        The occupation numbers with the same shape as ``eivals``.
+    """
+    if method not in SMEARING_METHODS:
+        raise RuntimeError("Unknown smearing method: %s. Available options are: %s" %
+                           (method, SMEARING_METHODS))
+    assert width > 0, "The smearing width must be positive"
+    if eivals.ndim > 1 and wkpts is None:
+        nkpts = eivals.shape[0]
+        wkpts = torch.ones((nkpts,), dtype=eivals.dtype, device=eivals.device) / nkpts
+
+    def get_nelecs(mu: torch.Tensor) -> torch.Tensor:
+        occ = maxocc * _occ_fcn((eivals - mu) / width, method)
+        if eivals.ndim > 1:
+            assert wkpts is not None
+            return torch.sum(occ.sum(dim=-1) * wkpts)
+        return occ.sum()
+
+    # find the chemical potential by bisection without the gradient
+    nelecs_val = float(nelecs)
+    with torch.no_grad():
+        lo = float(eivals.min()) - 20 * width - 1.0
+        hi = float(eivals.max()) + 20 * width + 1.0
+        for _ in range(200):
+            mid = 0.5 * (lo + hi)
+            if float(get_nelecs(torch.tensor(mid, dtype=eivals.dtype))) < nelecs_val:
+                lo = mid
+            else:
+                hi = mid
+            if hi - lo < 1e-15 * max(abs(lo), abs(hi), 1.0):
+                break
+    mu0 = torch.tensor(0.5 * (lo + hi), dtype=eivals.dtype, device=eivals.device)
+
+    # one Newton step from the converged chemical potential to propagate the
+    # gradient w.r.t. the eigenvalues and the number of electrons by the
+    # implicit function theorem, skipped if the occupations are saturated
+    with torch.enable_grad():
+        mu1 = mu0.clone().requires_grad_()
+        dndmu, = torch.autograd.grad(get_nelecs(mu1), mu1)
+    if float(dndmu) > 1e-10:
+        mu = mu0 + (nelecs - get_nelecs(mu0)) / dndmu
+    else:
+        mu = mu0
+    return maxocc * _occ_fcn((eivals - mu) / width, method)
+
+def _occ_fcn(x: torch.Tensor, method: str) -> torch.Tensor:
+    # occupation as a function of the scaled energy, x = (e - mu) / width
+    if method == "fermi":
+        return torch.sigmoid(-x)
+    elif method == "gaussian":
+        return 0.5 * torch.erfc(x)
+    else:  # methfessel-paxton
+        return 0.5 * torch.erfc(x) - x * torch.exp(-x * x) / (2 * math.sqrt(math.pi))
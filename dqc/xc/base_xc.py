@@ -2,7 +2,7 @@ from contextlib import contextmanager
 from abc import abstractmethod, abstractproperty
 import torch
 import xitorch as xt
-from typing import List, Union, overload, Iterator
+from typing import List, Union, overload, Iterator, Tuple
 from dqc.utils.datastruct import ValGrad, SpinParam
 
 class BaseXC(xt.EditableModule):
@@ -17,6 +17,17 @@ class BaseXC(xt.EditableModule):
         """
         pass
 
+    @property
+    def exx_coeffs(self) -> Tuple[Union[float, torch.Tensor], Union[float, torch.Tensor], float]:
+        """
+        Returns the coefficients of the exact exchange of hybrid functionals as
+        ``(alpha, beta, omega)``, i.e. the exchange operator added to the Fock
+        matrix is ``alpha * K + beta * K_lr`` where ``K_lr`` is the exchange
+        with the long-range Coulomb operator, ``erf(omega * r12) / r12``.
+        The coefficients are zeros for non-hybrid functionals.
+        """
+        return (0.0, 0.0, 0.0)
+
     @abstractmethod
     def get_edensityxc(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> \
             torch.Tensor:
@@ -43,6 +54,30 @@ class BaseXC(xt.EditableModule):
         """
         # This is the default implementation of vxc if there is no implementation
         # in the specific class of XC.
+        return self._get_edensityxc_vxc_autograd(densinfo)[1]
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: ValGrad) -> Tuple[torch.Tensor, ValGrad]:
+        ...
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: SpinParam[ValGrad]) -> Tuple[torch.Tensor, SpinParam[ValGrad]]:
+        ...
+
+    def get_edensityxc_vxc(self, densinfo):
+        """
+        Returns the xc energy density and the ValGrad of the xc potential
+        given the density info, i.e. the results of ``get_edensityxc`` and
+        ``get_vxc`` from a single evaluation if the class supports it.
+        """
+        # the default implementation of vxc calculates the energy density anyway
+        if type(self).get_vxc is BaseXC.get_vxc:
+            return self._get_edensityxc_vxc_autograd(densinfo)
+        return self.get_edensityxc(densinfo), self.get_vxc(densinfo)
+
+    def _get_edensityxc_vxc_autograd(self, densinfo):
+        # calculate the energy density and the potential as its derivative with
+        # autograd
 
         # densinfo.value & lapl: (*BD, nr)
         # densinfo.grad: (*BD, ndim, nr)
@@ -56,6 +91,7 @@ class BaseXC(xt.EditableModule):
                 edensity = self.get_edensityxc(densinfo)  # (*BD, nr)
             grad_outputs = torch.ones_like(edensity)
             grad_enabled = torch.is_grad_enabled()
+            edens_out = edensity if grad_enabled else edensity.detach()
 
             if not isinstance(densinfo, ValGrad):  # polarized case
                 if self.family == 1:  # LDA
@@ -63,14 +99,14 @@ class BaseXC(xt.EditableModule):
                     dedn_u, dedn_d = torch.autograd.grad(
                         edensity, params, create_graph=grad_enabled, grad_outputs=grad_outputs)
 
-                    return SpinParam(u=ValGrad(value=dedn_u), d=ValGrad(value=dedn_d))
+                    return edens_out, SpinParam(u=ValGrad(value=dedn_u), d=ValGrad(value=dedn_d))
 
                 elif self.family == 2:  # GGA
                     params = (densinfo.u.value, densinfo.d.value, densinfo.u.grad, densinfo.d.grad)
                     dedn_u, dedn_d, dedg_u, dedg_d = torch.autograd.grad(
                         edensity, params, create_graph=grad_enabled, grad_outputs=grad_outputs)
 
-                    return SpinParam(
+                    return edens_out, SpinParam(
                         u=ValGrad(value=dedn_u, grad=dedg_u),
                         d=ValGrad(value=dedn_d, grad=dedg_d))
 
@@ -83,14 +119,14 @@ class BaseXC(xt.EditableModule):
                         edensity, densinfo.value, create_graph=grad_enabled,
                         grad_outputs=grad_outputs)
 
-                    return ValGrad(value=dedn)
+                    return edens_out, ValGrad(value=dedn)
 
                 elif self.family == 2:  # GGA
                     dedn, dedg = torch.autograd.grad(
                         edensity, (densinfo.value, densinfo.grad), create_graph=grad_enabled,
                         grad_outputs=grad_outputs)
 
-                    return ValGrad(value=dedn, grad=dedg)
+                    return edens_out, ValGrad(value=dedn, grad=dedg)
 
                 else:
                     raise NotImplementedError("Default vxc for family %d is not implemented" % self.family)
@@ -98,6 +134,8 @@ class BaseXC(xt.EditableModule):
     def getparamnames(self, methodname: str, prefix: str = "") -> List[str]:
         if methodname == "get_vxc":
             return self.getparamnames("get_edensityxc", prefix=prefix)
+        elif methodname == "get_edensityxc_vxc":
+            return self.getparamnames("get_vxc", prefix=prefix)
         else:
             raise KeyError("Unknown methodname: %s" % methodname)
 
@@ -172,6 +210,16 @@ class AddBaseXC(BaseXC):
     def family(self):
         return self._family
 
+    @property
+    def exx_coeffs(self):
+        aalpha, abeta, aomega = self.a.exx_coeffs
+        balpha, bbeta, bomega = self.b.exx_coeffs
+        if abeta != 0 and bbeta != 0 and aomega != bomega:
+            msg = "Adding range-separated hybrids with different omega is not supported"
+            raise NotImplementedError(msg)
+        omega = aomega if abeta != 0 else bomega
+        return (aalpha + balpha, abeta + bbeta, omega)
+
     @overload
     def get_vxc(self, densinfo: ValGrad) -> ValGrad:
         ...
@@ -189,6 +237,23 @@ class AddBaseXC(BaseXC):
         else:
             return SpinParam(u=avxc.u + bvxc.u, d=avxc.d + bvxc.d)
 
+    @overload
+    def get_edensityxc_vxc(self, densinfo: ValGrad) -> Tuple[torch.Tensor, ValGrad]:
+        ...
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: SpinParam[ValGrad]) -> Tuple[torch.Tensor, SpinParam[ValGrad]]:
+        ...
+
+    def get_edensityxc_vxc(self, densinfo):
+        aedens, avxc = self.a.get_edensityxc_vxc(densinfo)
+        bedens, bvxc = self.b.get_edensityxc_vxc(densinfo)
+
+        if isinstance(densinfo, ValGrad):
+            return aedens + bedens, avxc + bvxc
+        else:
+            return aedens + bedens, SpinParam(u=avxc.u + bvxc.u, d=avxc.d + bvxc.d)
+
     def get_edensityxc(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> \
             torch.Tensor:
         return self.a.get_edensityxc(densinfo) + self.b.get_edensityxc(densinfo)
@@ -209,6 +274,11 @@ class MulBaseXC(BaseXC):
     def family(self):
         return self.a.family
 
+    @property
+    def exx_coeffs(self):
+        alpha, beta, omega = self.a.exx_coeffs
+        return (alpha * self.b, beta * self.b, omega)
+
     @overload
     def get_vxc(self, densinfo: ValGrad) -> ValGrad:
         ...
@@ -225,6 +295,22 @@ class MulBaseXC(BaseXC):
         else:
             return SpinParam(u=avxc.u * self.b, d=avxc.d * self.b)
 
+    @overload
+    def get_edensityxc_vxc(self, densinfo: ValGrad) -> Tuple[torch.Tensor, ValGrad]:
+        ...
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: SpinParam[ValGrad]) -> Tuple[torch.Tensor, SpinParam[ValGrad]]:
+        ...
+
+    def get_edensityxc_vxc(self, densinfo):
+        aedens, avxc = self.a.get_edensityxc_vxc(densinfo)
+
+        if isinstance(densinfo, ValGrad):
+            return aedens * self.b, avxc * self.b
+        else:
+            return aedens * self.b, SpinParam(u=avxc.u * self.b, d=avxc.d * self.b)
+
     def get_edensityxc(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> \
             torch.Tensor:
         return self.a.get_edensityxc(densinfo) * self.b
@@ -1,5 +1,6 @@
+import warnings
 from abc import abstractmethod, abstractproperty
-from typing import Union, List
+from typing import Union, List, Dict, Tuple, Type, Callable, Optional, Any, overload
 import torch
 from dqc.xc.base_xc import BaseXC
 from dqc.utils.datastruct import ValGrad, SpinParam
@@ -16,6 +17,137 @@ class CustomXC(BaseXC, torch.nn.Module):
     def get_edensityxc(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) -> torch.Tensor:
         pass
 
+    def compile_xc(self, enable: bool = True, **compile_kwargs) -> "CustomXC":
+        """
+        Compile the energy density and its derivatives with ``torch.compile``
+        to calculate the xc potential. The kernel is compiled once for every
+        polarization case in the first call of ``get_vxc``.
+
+        Arguments
+        ---------
+        enable: bool
+            If ``False``, the compiled kernels are discarded and the potential
+            is calculated in the eager mode.
+        **compile_kwargs
+            Additional keyword arguments passed to ``torch.compile``, e.g.
+            ``backend`` or ``mode``.
+
+        Returns
+        -------
+        CustomXC
+            The xc object itself.
+
+        Note
+        ----
+        The compiled potential can be differentiated once (e.g. for training
+        the parameters of the functional), but not twice.
+        Only LDA and GGA functionals are compiled, the potential of MGGA
+        functionals is silently calculated in the eager mode.
+        If the compilation fails, a warning is raised and the potential is
+        calculated in the eager mode, but errors raised by ``get_edensityxc``
+        are propagated.
+        """
+        if enable and not hasattr(torch, "compile"):
+            warnings.warn("torch.compile is not available, the xc potential is calculated in the eager mode.")
+            enable = False
+        self._compile_kwargs: Optional[Dict[str, Any]] = compile_kwargs if enable else None
+        self._compiled_vxc: Dict[Tuple[int, bool], Callable] = {}
+        return self
+
+    @overload
+    def get_vxc(self, densinfo: ValGrad) -> ValGrad:
+        ...
+
+    @overload
+    def get_vxc(self, densinfo: SpinParam[ValGrad]) -> SpinParam[ValGrad]:
+        ...
+
+    def get_vxc(self, densinfo):
+        # use the compiled kernel if it is enabled, otherwise use the default
+        # implementation with autograd
+        res = self._get_edensityxc_vxc_compiled(densinfo)
+        if res is None:
+            return super().get_vxc(densinfo)
+        return res[1]
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: ValGrad) -> Tuple[torch.Tensor, ValGrad]:
+        ...
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: SpinParam[ValGrad]) -> Tuple[torch.Tensor, SpinParam[ValGrad]]:
+        ...
+
+    def get_edensityxc_vxc(self, densinfo):
+        # the potential might be implemented differently in the subclass
+        if type(self).get_vxc is not CustomXC.get_vxc:
+            return super().get_edensityxc_vxc(densinfo)
+        res = self._get_edensityxc_vxc_compiled(densinfo)
+        if res is None:
+            return self._get_edensityxc_vxc_autograd(densinfo)
+        return res
+
+    def _get_edensityxc_vxc_compiled(self, densinfo: Union[ValGrad, SpinParam[ValGrad]]) \
+            -> Optional[Tuple[torch.Tensor, Union[ValGrad, SpinParam[ValGrad]]]]:
+        # calculate the energy density and the potential with the compiled
+        # kernel, returns None if the compilation is not enabled or failed
+        compile_kwargs = getattr(self, "_compile_kwargs", None)
+        if compile_kwargs is None or self.family not in (1, 2):
+            return None
+
+        polarized = not isinstance(densinfo, ValGrad)
+        key = (self.family, polarized)
+        if key not in self._compiled_vxc:
+            self._compiled_vxc[key] = torch.compile(self._get_flat_vxc_fcn(polarized),
+                                                    dynamic=True, **compile_kwargs)
+
+        vgs = [densinfo.u, densinfo.d] if isinstance(densinfo, SpinParam) else [densinfo]
+        args: List[torch.Tensor] = []
+        for vg in vgs:
+            args.append(vg.value)
+            if self.family >= 2:
+                assert vg.grad is not None
+                args.append(vg.grad)
+        try:
+            outs = self._compiled_vxc[key](*args)
+        except _get_compile_errors() as e:
+            # the compilation can fail for unsupported operations or backends
+            warnings.warn("Failed to compile the xc potential, falling back to the eager mode: %s" % e)
+            self._compile_kwargs = None
+            return None
+
+        # arrange the derivatives in the same order as the arguments
+        edens, derivs = outs[0], outs[1:]
+        nargs = len(args) // len(vgs)
+        potinfos = []
+        for i in range(len(vgs)):
+            dargs = derivs[i * nargs:(i + 1) * nargs]
+            potinfos.append(ValGrad(value=dargs[0], grad=dargs[1] if nargs > 1 else None))
+        if polarized:
+            return edens, SpinParam(u=potinfos[0], d=potinfos[1])
+        return edens, potinfos[0]
+
+    def _get_flat_vxc_fcn(self, polarized: bool) -> Callable:
+        # returns a function that takes the flattened density info tensors and
+        # returns the energy density and its derivatives w.r.t. the inputs
+        family = self.family
+
+        def edens_fcn(*args: torch.Tensor) -> torch.Tensor:
+            vgs = []
+            nargs = 1 if family == 1 else 2
+            for i in range(0, len(args), nargs):
+                grad = args[i + 1] if nargs > 1 else None
+                vgs.append(ValGrad(value=args[i], grad=grad))
+            densinfo = SpinParam(u=vgs[0], d=vgs[1]) if polarized else vgs[0]
+            return self.get_edensityxc(densinfo)
+
+        def vxc_fcn(*args: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+            vjp_res = torch.func.vjp(edens_fcn, *args)
+            edens, vjp_fcn = vjp_res[0], vjp_res[1]
+            return (edens,) + tuple(vjp_fcn(torch.ones_like(edens)))
+
+        return vxc_fcn
+
     def getparamnames(self, methodname: str = "", prefix: str = "") -> List[str]:
         if methodname == "get_edensityxc":
             pfix = prefix if not prefix.endswith(".") else prefix[:-1]
@@ -23,3 +155,12 @@ class CustomXC(BaseXC, torch.nn.Module):
             return names
         else:
             return super().getparamnames(methodname, prefix=prefix)
+
+def _get_compile_errors() -> Tuple[Type[BaseException], ...]:
+    # returns the exception types raised by torch.compile when it fails to
+    # compile the function, other errors come from the function itself
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+    except ImportError:
+        return ()
+    return (TorchDynamoException,)
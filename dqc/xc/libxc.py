@@ -7,7 +7,8 @@ except (ImportError, ModuleNotFoundError) as e:
 from typing import List, Tuple, Union, overload, Optional
 from dqc.xc.base_xc import BaseXC
 from dqc.xc.libxc_wrapper import CalcLDALibXCPol, CalcLDALibXCUnpol, \
-    CalcGGALibXCPol, CalcGGALibXCUnpol, CalcMGGALibXCUnpol, CalcMGGALibXCPol
+    CalcGGALibXCPol, CalcGGALibXCUnpol, CalcMGGALibXCUnpol, CalcMGGALibXCPol, \
+    CalcExcVxcLibXC
 from dqc.utils.datastruct import ValGrad, SpinParam
 
 
@@ -24,11 +25,16 @@ class LibXCLDA(BaseXC):
     def __init__(self, name: str) -> None:
         self.libxc_unpol = pylibxc.LibXCFunctional(name, "unpolarized")
         self.libxc_pol = pylibxc.LibXCFunctional(name, "polarized")
+        self._exx_coeffs = _get_exx_coeffs(self.libxc_unpol)
 
     @property
     def family(self) -> int:
         return self._family
 
+    @property
+    def exx_coeffs(self) -> Tuple[float, float, float]:
+        return self._exx_coeffs
+
     @overload
     def get_vxc(self, densinfo: ValGrad) -> ValGrad:
         ...
@@ -84,6 +90,38 @@ class LibXCLDA(BaseXC):
             edens = self._calc_unpol(flatten_inps, densinfo.value.shape, 0)[0]  # (*BD, nr)
             return edens
 
+    @overload
+    def get_edensityxc_vxc(self, densinfo: ValGrad) -> Tuple[torch.Tensor, ValGrad]:
+        ...
+
+    @overload
+    def get_edensityxc_vxc(self, densinfo: SpinParam[ValGrad]) -> Tuple[torch.Tensor, SpinParam[ValGrad]]:
+        ...
+
+    def get_edensityxc_vxc(self, densinfo):
+        # calculate the energy density and the potential with a single libxc call
+
+        libxc_inps = _prepare_libxc_input(densinfo, xcfamily=self.family)
+        flatten_inps = tuple(inp.reshape(-1) for inp in libxc_inps)
+
+        # polarized case
+        if not isinstance(densinfo, ValGrad):
+            shape = densinfo.u.value.shape
+            outs = CalcExcVxcLibXC.apply(self._polfcn_wrapper, self.libxc_pol, self.family, True,
+                                         *flatten_inps)
+            outs = tuple(out.reshape(-1, *shape) for out in outs)
+
+        # unpolarized case
+        else:
+            shape = densinfo.value.shape
+            outs = CalcExcVxcLibXC.apply(self._unpolfcn_wrapper, self.libxc_unpol, self.family, False,
+                                         *flatten_inps)
+            outs = tuple(out.reshape(shape) for out in outs)
+
+        edens = outs[0].reshape(shape)  # (*BD, nr)
+        potinfo = _postproc_libxc_voutput(densinfo, *outs[1:])
+        return edens, potinfo
+
     def _calc_pol(self, flatten_inps: Tuple[torch.Tensor, ...], shape: torch.Size, deriv: int) ->\
             Tuple[torch.Tensor, ...]:
 
@@ -121,6 +159,25 @@ def _all_same_shape(densinfo_u: ValGrad, densinfo_d: ValGrad) -> bool:
 def _get_polstr(polarized: bool) -> str:
     return "polarized" if polarized else "unpolarized"
 
+def _get_exx_coeffs(libxcfcn) -> Tuple[float, float, float]:
+    # get the exact exchange coefficients (alpha, beta, omega) of the libxc
+    # functional, where the exchange operator is alpha * K + beta * K_lr.
+    # libxc describes the range-separated hybrids with the full-range fraction
+    # cam_alpha and the short-range fraction cam_beta, so the short-range part
+    # is converted with erfc = 1 - erf.
+    # Non-hybrid functionals raise ValueError in both methods.
+    try:
+        omega, cam_alpha, cam_beta = libxcfcn.get_cam_coef()
+        if omega != 0.0 and cam_beta != 0.0:
+            return (float(cam_alpha + cam_beta), float(-cam_beta), float(omega))
+        return (float(cam_alpha), 0.0, 0.0)
+    except (ValueError, AttributeError):
+        pass
+    try:
+        return (float(libxcfcn.get_hyb_exx_coef()), 0.0, 0.0)
+    except (ValueError, AttributeError):
+        return (0.0, 0.0, 0.0)
+
 def _prepare_libxc_input(densinfo: Union[SpinParam[ValGrad], ValGrad], xcfamily: int) -> Tuple[torch.Tensor, ...]:
     # convert the densinfo into tuple of tensors for libxc inputs
     # the elements in the tuple is arranged according to libxc manual
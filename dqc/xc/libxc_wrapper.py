@@ -1,8 +1,9 @@
 from __future__ import annotations
-from typing import Mapping, Tuple, Optional, Union, Iterator, List
+from typing import Mapping, Tuple, Optional, Union, Iterator, List, Dict
 import torch
 import numpy as np
 import warnings
+from types import SimpleNamespace
 try:
     import pylibxc
 except (ImportError, ModuleNotFoundError) as e:
@@ -377,22 +378,69 @@ class CalcMGGALibXCPol(torch.autograd.Function):
                                    deriv_idxs, spin_idxs)
         return (*grad_inps, None, None)
 
+class CalcExcVxcLibXC(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, fcn: type, libxcfcn: pylibxc.functional.LibXCFunctional,  # type: ignore
+                family: int, polarized: bool, *inps: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        # Calculates and returns the energy density and its first derivatives
+        # from a single libxc call.
+        # fcn is the autograd function of the family and polarization above
+        # (e.g. CalcGGALibXCPol) which is used to propagate the gradients of
+        # the first derivatives.
+        # The outputs are the same as the outputs of fcn with deriv == 0
+        # followed by the outputs of fcn with deriv == 1.
+        inp = _get_libxc_inp(inps, family, polarized)
+        res = _get_libxc_res(inp, 0, libxcfcn, family=family, polarized=polarized, with_vxc=True)
+
+        ctx.save_for_backward(*inps, *res[1:])
+        ctx.fcn = fcn
+        ctx.libxcfcn = libxcfcn
+        return (*res,)
+
+    @staticmethod
+    def backward(ctx, grad_edens: torch.Tensor,  # type: ignore
+                 *grad_vxcs: torch.Tensor) -> Tuple[Optional[torch.Tensor], ...]:
+        ninps = len(ctx.saved_tensors) - len(grad_vxcs)
+        inps = ctx.saved_tensors[:ninps]
+        vxcs = ctx.saved_tensors[ninps:]
+        needs_input_grad = ctx.needs_input_grad[4:]
+
+        # the first derivatives are arranged in the same order as the inputs,
+        # so the gradients from the energy density can be obtained directly
+        dedinps = torch.cat([vxc.reshape(-1, inps[0].shape[-1]) for vxc in vxcs], dim=0)
+        grad_edens = grad_edens.reshape(-1)
+
+        # the gradients from the first derivatives are the same as the
+        # backward of fcn with deriv == 1, so call it with the same context
+        fcn_ctx = SimpleNamespace(saved_tensors=(*inps, *vxcs), deriv=1, libxcfcn=ctx.libxcfcn,
+                                  needs_input_grad=(*needs_input_grad, False, False))
+        grad_inps = ctx.fcn.backward(fcn_ctx, *grad_vxcs)[:ninps]
+
+        grad_inps = tuple(
+            None if not needs_input_grad[i] else grad_edens * dedinps[i] + grad_inps[i]
+            for i in range(ninps))
+        return (None, None, None, None, *grad_inps)
+
 def _get_libxc_res(inp: Mapping[str, Union[np.ndarray, Tuple[np.ndarray, ...], torch.Tensor, Tuple[torch.Tensor, ...]]],
                    deriv: int,
                    libxcfcn: pylibxc.functional.LibXCFunctional,
-                   family: int, polarized: bool) -> Tuple[torch.Tensor, ...]:
+                   family: int, polarized: bool, with_vxc: bool = False) -> Tuple[torch.Tensor, ...]:
     # deriv == 0 for energy per unit volume
     # deriv == 1 for vrho (1st derivative of energy/volume w.r.t. density)
     # deriv == 2 for v2rho2
     # deriv == 3 for v3rho3
     # deriv == 4 for v4rho4
+    # if with_vxc and deriv == 0, the 1st derivatives are calculated in the
+    # same call and returned after the energy density
     do_exc, do_vxc, do_fxc, do_kxc, do_lxc = _get_dos(deriv)
+    with_vxc = with_vxc and deriv == 0
 
     res = libxcfcn.compute(
         inp,
-        do_exc=do_exc, do_vxc=do_vxc, do_fxc=do_fxc,
+        do_exc=do_exc, do_vxc=do_vxc or with_vxc, do_fxc=do_fxc,
         do_kxc=do_kxc, do_lxc=do_lxc
     )
+    vxcs = _extract_returns(res, 1, family) if with_vxc else ()
 
     # compile the results in a tuple with order given in the *_KEYS (e.g. LDA_KEYS)
     res = _extract_returns(res, deriv, family)
@@ -408,14 +456,35 @@ def _get_libxc_res(inp: Mapping[str, Union[np.ndarray, Tuple[np.ndarray, ...], t
             start = np.zeros(1, dtype=rho.dtype)
             rho = sum(_unpack_input(rho), start)  # rho[:, 0] + rho[:, 1]
         res0 = res[0] * rho
-        res = (res0, *res[1:])
+        res = (res0, *res[1:], *vxcs)
 
     return res
 
 def _pack_input(*vals: torch.Tensor) -> np.ndarray:
-    # arrange the values in a numpy array with fortran memory order
-    vals_np = np.asarray([val.detach().numpy() for val in vals])
-    return np.ascontiguousarray(vals_np.T)
+    # arrange the values in a numpy array with shape (ninps, nvals) in C order,
+    # i.e. the values of a point are contiguous as expected by libxc.
+    # The buffer is allocated in every call, so the calls from different
+    # functionals, threads, or grid chunks do not share any state
+    ninps = vals[0].shape[-1]
+    buf = np.empty((ninps, len(vals)), dtype=np.float64)
+
+    # write the values directly to the buffer
+    torch.stack([val.detach().to(torch.float64) for val in vals], dim=-1, out=torch.from_numpy(buf))
+    return buf
+
+def _get_libxc_inp(inps: Tuple[torch.Tensor, ...], family: int, polarized: bool) -> Dict[str, np.ndarray]:
+    # arrange the flattened inputs (in the order of the autograd functions
+    # above) as the input of libxc
+    names = ["rho", "sigma", "lapl", "tau"][:{1: 1, 2: 2, 4: 4}[family]]
+    if not polarized:
+        return {name: inp.detach().numpy() for (name, inp) in zip(names, inps)}
+    nvals = [2, 3, 2, 2]
+    res: Dict[str, np.ndarray] = {}
+    i = 0
+    for (name, nval) in zip(names, nvals):
+        res[name] = _pack_input(*inps[i:i + nval])
+        i += nval
+    return res
 
 def _unpack_input(inp: np.ndarray) -> Iterator[np.ndarray]:
     # unpack from libxc input format into tuple of inputs
@@ -459,7 +528,9 @@ def _extract_returns(ret: Mapping[str, np.ndarray], deriv: int, family: int) ->
         Tuple[torch.Tensor, ...]:
     # compile the returns from pylibxc into a tuple of tensors with order given
     # by the keys
-    a = lambda v: torch.as_tensor(v.T)
+    # the outputs have shape (ninps, nderiv), so they are wrapped as
+    # transposed views of the numpy arrays without copying the data
+    a = lambda v: torch.from_numpy(v.T)
     if family == 1:
         keys = LDA_KEYS
     elif family == 2: